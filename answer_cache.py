@@ -0,0 +1,196 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from bm25_index import strip_accents
+from config import *
+from identifier_index import extract_identifiers
+
+
+def normalize_question(question):
+    """Minúsculas, sin acentos, sin signos de puntuación y con espacios simples"""
+    texto = strip_accents(question.lower())
+    texto = re.sub(r"[¿?¡!.,;:\"]", " ", texto)
+    return " ".join(texto.split())
+
+
+class AnswerCache:
+    """
+    Caché de respuestas en dos niveles delante de query_rag.
+
+    1. Coincidencia exacta de la pregunta normalizada.
+    2. Pregunta casi idéntica: similitud coseno del embedding de la consulta
+       mayor o igual a similarity_threshold y los mismos identificadores
+       (contratos, cláusulas, anexos, montos), que el embedding casi no
+       distingue: "cláusula novena" y "cláusula décima" quedan a 0.98.
+
+    Cada entrada guarda la versión del índice con la que se generó; al cambiar
+    la colección (ingest_docs) las entradas de versiones anteriores se
+    descartan. También caducan por TTL y se desalojan por LRU al superar
+    max_entries.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # Espejo en memoria de los embeddings para la búsqueda semántica
+        self._keys = []
+        self._identifiers = []
+        self._matrix = None
+        self._dirty = True
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                question_norm TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                docs TEXT NOT NULL,
+                index_version INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _purge(self, index_version):
+        """Elimina entradas caducadas o de otra versión del índice"""
+        borradas = self._conn.execute(
+            "DELETE FROM answers WHERE index_version != ? OR created < ?",
+            (index_version, time.time() - self.ttl),
+        ).rowcount
+        if borradas:
+            self._conn.commit()
+            self._dirty = True
+
+    def _load_matrix(self):
+        if not self._dirty:
+            return
+        filas = self._conn.execute(
+            "SELECT question_norm, embedding, question FROM answers WHERE embedding IS NOT NULL"
+        ).fetchall()
+        self._keys = [fila[0] for fila in filas]
+        self._identifiers = [extract_identifiers(fila[2]) for fila in filas]
+        if filas:
+            matriz = np.stack([np.frombuffer(fila[1], dtype=np.float32) for fila in filas])
+            self._matrix = matriz / np.linalg.norm(matriz, axis=1, keepdims=True)
+        else:
+            self._matrix = None
+        self._dirty = False
+
+    def _fetch(self, key):
+        fila = self._conn.execute(
+            "SELECT answer, docs FROM answers WHERE question_norm = ?", (key,)
+        ).fetchone()
+        if fila is None:
+            return None
+        self._conn.execute("UPDATE answers SET last_access = ? WHERE question_norm = ?", (time.time(), key))
+        self._conn.commit()
+        return {"answer": fila[0], "docs": json.loads(fila[1])}
+
+    def lookup_exact(self, question, index_version):
+        with self._lock:
+            self._purge(index_version)
+            resultado = self._fetch(normalize_question(question))
+        if resultado:
+            self.hits += 1
+            resultado["nivel"] = "exacto"
+        return resultado
+
+    def lookup_similar(self, embedding, index_version, question=None):
+        """
+        Respuesta de la pregunta más parecida sobre el umbral cuyos
+        identificadores coinciden exactamente con los de question (sin
+        question, solo se aceptan preguntas sin identificadores).
+        """
+        identificadores = extract_identifiers(question) if question else set()
+        with self._lock:
+            self._purge(index_version)
+            self._load_matrix()
+            if self._matrix is None:
+                self.misses += 1
+                return None
+
+            consulta = np.asarray(embedding, dtype=np.float32)
+            if consulta.shape[0] != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+            similitudes = self._matrix @ (consulta / np.linalg.norm(consulta))
+            sobre_umbral = np.flatnonzero(similitudes >= self.similarity_threshold)
+            candidatas = [
+                int(i) for i in sobre_umbral[np.argsort(-similitudes[sobre_umbral])]
+                if self._identifiers[i] == identificadores
+            ]
+            if not candidatas:
+                self.misses += 1
+                return None
+            mejor = candidatas[0]
+            resultado = self._fetch(self._keys[mejor])
+
+        if resultado is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        resultado["nivel"] = "semantico"
+        resultado["similitud"] = float(similitudes[mejor])
+        return resultado
+
+    def store(self, question, index_version, answer, docs, embedding=None):
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_question(question), question, blob, answer,
+                 json.dumps(docs, ensure_ascii=False), index_version, ahora, ahora),
+            )
+            total = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if total > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE question_norm IN "
+                    "(SELECT question_norm FROM answers ORDER BY last_access ASC LIMIT ?)",
+                    (total - self.max_entries,),
+                )
+            self._conn.commit()
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"aciertos": self.hits, "fallos": self.misses, "entradas": entradas}
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Instancia de la caché de respuestas compartida por todas las sesiones"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache()
+        return _shared_cache
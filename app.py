@@ -1,41 +1,30 @@
 import streamlit as st
-import chromadb
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import logging
+import time
+import os
+import uuid
 import config
+from config import CONTRATOS_PATH
+from batch_qa import batch_running, get_batch_store, start_batch, stop_batch
+from ingest_jobs import get_job_queue, submit_ingest_job
+from document_catalog import get_document_catalog
+from log_store import attach_log_file, get_log_index, tail_lines
+from metrics import get_metrics_store
+from projects import list_project_folders, project_folder, project_slug
+from prompts import BATCH_QA_CHECKLIST
+from serving import get_query_scheduler
 
-# 1. Primero configuramos los Embeddings
-# Asegúrate de pasarle el modelo (como vimos antes)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-# 2. Después configuramos la ruta (desde tus secrets)
-persist_dir = st.secrets["CHROMA_DB_PATH"]
-
-# 3. Inicializamos el cliente de Chroma
-client = chromadb.PersistentClient(path=persist_dir)
+# El sistema RAG (LangChain, Chroma, Gemini) y pandas se importan bajo demanda:
+# el primer render no espera esas dependencias y cada rerun solo relee el
+# script. Los clientes pesados se crean una sola vez por proceso (clients.py).
 
-# 4. Finalmente creamos el objeto vectordb
-# Aquí es donde fallaba porque 'embeddings' no existía arriba
-vectordb = Chroma(
-    client=client,
-    embedding_function=embeddings,  # <--- Ahora sí está definida
-    collection_name="sinergia_collection"
-)
 
-
-try:
-    from rag_system import query_rag, get_retriever_info, ingest_docs
-    RAG_AVAILABLE = True
-    RAG_IMPORT_ERROR = None
-except Exception as _e:
-    # Guardar el error para mostrar instrucciones en la UI
-    RAG_AVAILABLE = False
-    RAG_IMPORT_ERROR = _e
-
-import time
-import os
-import pandas as pd
-from config import CONTRATOS_PATH
+def cargar_rag():
+    """Importa el sistema RAG la primera vez que se necesita"""
+    import rag_system
+    # Los eventos de consultas quedan en el historial de la pestaña Monitor
+    attach_log_file(rag_system.logger)
+    return rag_system
 
 
 # --- CONFIGURACIÓN DE PÁGINA ---
@@ -55,10 +44,23 @@ if "uploader_id" not in st.session_state:
 if "show_success_toast" not in st.session_state:
     st.session_state.show_success_toast = False
 
+if "ingest_job_id" not in st.session_state:
+    st.session_state.ingest_job_id = None
+
+if "proyectos_consulta" not in st.session_state:
+    st.session_state.proyectos_consulta = []
+
+if "lote_id" not in st.session_state:
+    st.session_state.lote_id = None
+
+# Identifica la sesión ante el servicio de consultas (una cola por usuario)
+if "usuario" not in st.session_state:
+    st.session_state.usuario = uuid.uuid4().hex[:12]
+
 # --- LÓGICA DE NOTIFICACIONES (TOAST) ---
 if st.session_state.show_success_toast:
     try:
-        num_contratos = len([f for f in os.listdir(CONTRATOS_PATH) if f.endswith('.pdf')])
+        num_contratos = get_document_catalog().summary()["indexado"]
         st.toast(f"✅ ¡Base de datos actualizada! {num_contratos} contratos listos.", icon="⚖️")
         st.session_state.show_success_toast = False
     except Exception:
@@ -66,51 +68,182 @@ if st.session_state.show_success_toast:
 
 
 # --- FUNCIONES DE APOYO ---
-def save_uploaded_file(uploaded_file):
-    if not os.path.exists(CONTRATOS_PATH):
-        os.makedirs(CONTRATOS_PATH)
-    file_path = os.path.join(CONTRATOS_PATH, uploaded_file.name)
+def save_uploaded_file(uploaded_file, proyecto=config.PROJECT_DEFAULT):
+    # Cada proyecto es una subcarpeta de contratos (el general es la carpeta raíz)
+    file_path = os.path.join(project_folder(proyecto, CONTRATOS_PATH), uploaded_file.name)
     with open(file_path, "wb") as f:
         f.write(uploaded_file.getbuffer())
     return file_path
 
 
-def obtener_info_archivos(ruta):
+def obtener_info_archivos(pagina):
+    # Una página del catálogo que mantiene la ingesta (no se recorre la carpeta)
     archivos = []
-    if os.path.exists(ruta):
-        for nombre in os.listdir(ruta):
-            if nombre.endswith(".pdf"):
-                path_completo = os.path.join(ruta, nombre)
-                stats = os.stat(path_completo)
-                fecha_mod = time.strftime('%d/%m/%Y %H:%M', time.localtime(stats.st_mtime))
-                tamano = f"{round(stats.st_size / (1024 * 1024), 2)} MB"
-                archivos.append({
-                    "Archivo": nombre,
-                    "Fecha de Carga": fecha_mod,
-                    "Tamaño": tamano
-                })
+    for doc in get_document_catalog().page(offset=(pagina - 1) * config.DOCUMENT_CATALOG_PAGE_SIZE):
+        archivos.append({
+            "Archivo": os.path.basename(doc["nombre"]),
+            "Proyecto": doc["proyecto"],
+            "Estado": doc["estado"],
+            "Páginas": doc["paginas"],
+            "Fragmentos": doc["fragmentos"],
+            "Versión": doc["version"],
+            "Indexado": time.strftime('%d/%m/%Y %H:%M', time.localtime(doc["indexado"])) if doc["indexado"] else "",
+            "Fecha de Carga": time.strftime('%d/%m/%Y %H:%M', time.localtime(doc["mtime"])),
+            "Tamaño": f"{round(doc['tamano'] / (1024 * 1024), 2)} MB"
+        })
     return archivos
 
 
-def leer_logs_con_formato(ruta_log='logs/historial_db.log', n_lineas=20):
-    if os.path.exists(ruta_log):
-        with open(ruta_log, 'r', encoding='utf-8') as f:
-            lineas = f.readlines()
-            ultimas_lineas = lineas[-n_lineas:]
-
-            # Procesamos cada línea para añadir indicadores visuales
-            log_formateado = ""
-            for linea in ultimas_lineas:
-                if "[ERROR]" in linea:
-                    log_formateado += f"❌ {linea}"
-                elif "[WARNING]" in linea:
-                    log_formateado += f"⚠️ {linea}"
-                elif "ÉXITO" in linea or "EXITOSAMENTE" in linea:
-                    log_formateado += f"✅ {linea}"
-                else:
-                    log_formateado += f"🔹 {linea}"
-            return log_formateado
-    return "No se encontraron registros de actividad."
+def leer_logs_con_formato(ruta_log=config.LOG_PATH, n_lineas=20, nivel_minimo=None, desde=None, hasta=None):
+    # Sin filtros se leen las últimas líneas desde el final del archivo; con
+    # filtros se consultan los registros en el índice del historial
+    if nivel_minimo is None and desde is None:
+        lineas = tail_lines(ruta_log, n_lineas)
+    else:
+        lineas = get_log_index().query(min_level=nivel_minimo, since=desde, until=hasta, limit=n_lineas)
+    if not lineas:
+        return "No se encontraron registros de actividad."
+
+    # Procesamos cada línea para añadir indicadores visuales
+    log_formateado = ""
+    for linea in lineas:
+        if "[ERROR]" in linea:
+            log_formateado += f"❌ {linea}"
+        elif "[WARNING]" in linea:
+            log_formateado += f"⚠️ {linea}"
+        elif "ÉXITO" in linea or "EXITOSAMENTE" in linea:
+            log_formateado += f"✅ {linea}"
+        else:
+            log_formateado += f"🔹 {linea}"
+    return log_formateado
+
+def mostrar_documentos(docs):
+    if docs:
+        for doc in docs:
+            with st.expander(f"📄 Fragmento {doc['fragmento']} - {doc['fuente']}", expanded=False):
+                st.markdown(f"**Página:** {doc['pagina']}")
+                st.caption(doc['contenido'])
+    else:
+        st.info("Los fragmentos del documento aparecerán aquí al consultar.")
+
+def mostrar_metricas(tipo):
+    store = get_metrics_store()
+    duraciones = store.stage_durations(tipo)
+    if not duraciones:
+        st.info("Aún no hay métricas registradas para este tipo de operación.")
+        return
+
+    import pandas as pd
+
+    # Resumen por etapa
+    df = pd.DataFrame(duraciones, columns=["Etapa", "Duración (s)"])
+    resumen = df.groupby("Etapa")["Duración (s)"].describe(percentiles=[0.5, 0.95])
+    resumen = resumen[["count", "mean", "50%", "95%", "max"]].rename(
+        columns={"count": "Eventos", "mean": "Media", "50%": "p50", "95%": "p95", "max": "Máx."}
+    )
+    st.dataframe(resumen.round(3), width='stretch')
+
+    # Histograma de latencia de la etapa seleccionada
+    etapa = st.selectbox("Histograma de latencia", sorted(df["Etapa"].unique()), key=f"hist_{tipo}")
+    valores = df.loc[df["Etapa"] == etapa, "Duración (s)"]
+    intervalos = pd.cut(valores, bins=min(20, max(1, valores.nunique())))
+    histograma = intervalos.value_counts().sort_index()
+    histograma.index = [f"{i.left:.2f}-{i.right:.2f}s" for i in histograma.index]
+    st.bar_chart(histograma)
+
+    # Detalle de las operaciones más lentas
+    st.markdown("#### 🐢 Operaciones más lentas")
+    for traza in store.slowest_traces(tipo, limit=10):
+        fecha = time.strftime('%d/%m/%Y %H:%M:%S', time.localtime(traza["inicio"]))
+        etiqueta = (traza["etiqueta"] or tipo)[:80]
+        with st.expander(f"⏱️ {traza['duracion']:.2f}s · {etiqueta}"):
+            st.caption(f"{fecha} · {traza['atributos']}")
+            etapas = pd.DataFrame(store.trace_spans(traza["trace_id"]))
+            if not etapas.empty:
+                etapas["inicio"] = (etapas["inicio"] - traza["inicio"]).round(3)
+                etapas["duracion"] = etapas["duracion"].round(3)
+                st.dataframe(etapas, width='stretch', hide_index=True)
+
+@st.fragment(run_every=2)
+def progreso_ingesta():
+    # Consulta periódica del estado del trabajo de ingesta sin bloquear la sesión
+    job_id = st.session_state.ingest_job_id
+    if job_id is None:
+        return
+
+    trabajo = get_job_queue().get(job_id)
+    if trabajo is None:
+        st.session_state.ingest_job_id = None
+        return
+
+    if trabajo["estado"] in ("pendiente", "en_proceso"):
+        etiqueta = "En cola" if trabajo["estado"] == "pendiente" else trabajo["mensaje"]
+        st.progress(min(1.0, trabajo["progreso"] or 0.0), text=f"⏳ {etiqueta}")
+        return
+
+    st.session_state.ingest_job_id = None
+    if trabajo["estado"] == "completado":
+        st.session_state.show_success_toast = True
+    else:
+        st.toast(f"❌ Error en la ingesta: {trabajo['mensaje']}", icon="⚠️")
+    st.rerun()
+
+@st.fragment(run_every=2)
+def progreso_lote():
+    # Estado de la revisión por lotes; corre en un hilo de la app (batch_qa.start_batch)
+    store = get_batch_store()
+    corrida = store.get(st.session_state.lote_id) if st.session_state.lote_id else store.latest()
+    if corrida is None:
+        return
+
+    activa = batch_running()
+    st.markdown(
+        f"**Revisión {corrida['id']}** · {len(corrida['preguntas'])} preguntas × "
+        f"{len(corrida['documentos'])} documentos"
+    )
+    st.progress(min(1.0, corrida["progreso"] or 0.0), text=corrida["mensaje"] or corrida["estado"])
+    if activa:
+        if st.button("⏹️ Detener", key="lote_detener"):
+            stop_batch()
+        return
+
+    if corrida["estado"] != "completado":
+        # Interrumpida, detenida o con errores: se reanudan solo las celdas sin respuesta
+        if st.button("🔁 Reanudar", key="lote_reanudar"):
+            st.session_state.lote_id = corrida["id"]
+            start_batch(corrida["id"])
+            st.rerun()
+
+    import pandas as pd
+
+    encabezados, filas = store.matrix(corrida["id"])
+    st.dataframe(pd.DataFrame(filas, columns=encabezados), width='stretch', hide_index=True)
+    col_csv, col_parquet = st.columns(2)
+    with col_csv:
+        with open(store.export(corrida["id"]), "rb") as f:
+            st.download_button(
+                label="📥 Descargar Matriz (CSV)",
+                data=f,
+                file_name=f"revision_{corrida['id']}.csv",
+                mime="text/csv",
+                width='stretch'
+            )
+    with col_parquet:
+        try:
+            ruta_parquet = store.export(
+                corrida["id"], os.path.join(config.BATCH_QA_EXPORT_DIR, f"revision_{corrida['id']}.parquet")
+            )
+        except RuntimeError:
+            st.caption("Parquet no disponible (requiere pyarrow).")
+        else:
+            with open(ruta_parquet, "rb") as f:
+                st.download_button(
+                    label="📥 Descargar Matriz (Parquet)",
+                    data=f,
+                    file_name=f"revision_{corrida['id']}.parquet",
+                    mime="application/octet-stream",
+                    width='stretch'
+                )
 
 # --- TÍTULO ---
 st.title(":diamond_shape_with_a_dot_inside: SINERG-IA: El núcleo de inteligencia de Grupo FOA")
@@ -127,44 +260,43 @@ with st.sidebar:
         key=f"pdf_uploader_{st.session_state.uploader_id}"
     )
 
+    # Proyecto de destino: cada proyecto tiene su propia colección
+    proyectos_existentes = [config.PROJECT_DEFAULT] + [
+        p for p in list_project_folders(CONTRATOS_PATH) if p != config.PROJECT_DEFAULT
+    ]
+    opcion_nuevo = "➕ Nuevo proyecto..."
+    proyecto_destino = st.selectbox("Proyecto", proyectos_existentes + [opcion_nuevo])
+    if proyecto_destino == opcion_nuevo:
+        proyecto_destino = project_slug(st.text_input("Nombre del nuevo proyecto"))
+
     # Actualización: width='stretch' reemplaza use_container_width=True
     if st.button("🚀 Procesar e Indexar", width='stretch'):
         if uploaded_files:
-            with st.status("Sincronizando base de conocimientos...", expanded=True) as status:
-                for uploaded_file in uploaded_files:
-                    st.write(f"Guardando {uploaded_file.name}...")
-                    save_uploaded_file(uploaded_file)
-
-                st.write("Actualizando vectores en Chroma...")
-                if RAG_AVAILABLE:
-                    try:
-                        ingest_docs()
-                    except Exception as e:
-                        st.error(f"Error al ejecutar ingest_docs: {e}")
-                else:
-                    st.error("El componente RAG no está disponible en este entorno. Revisa los logs y las dependencias (requirements).")
-                    if RAG_IMPORT_ERROR:
-                        st.caption(str(RAG_IMPORT_ERROR))
-
-                st.cache_resource.clear()
-                st.session_state.uploader_id += 1
-                st.session_state.show_success_toast = True
+            for uploaded_file in uploaded_files:
+                save_uploaded_file(uploaded_file, proyecto_destino)
+
+            # La ingesta corre en segundo plano; las consultas siguen usando el índice actual
+            st.session_state.ingest_job_id = submit_ingest_job()
 
-                status.update(label="✅ Sincronización exitosa", state="complete")
+            st.session_state.uploader_id += 1
             st.rerun()
         else:
             st.warning("Selecciona archivos primero.")
 
+    progreso_ingesta()
+
     st.divider()
 
-    # Info del sistema
-    with st.container(border=True):
-        try:
-            retriever_info = get_retriever_info()
-            st.markdown(f"**🔍 Retriever:**")
-            st.markdown(f"`{retriever_info['tipo']}`")
-        except:
-            st.caption("🔍 Retriever: No inicializado")
+    # Alcance de las consultas: sin selección, el sistema elige los proyectos
+    st.multiselect(
+        "🗂️ Proyectos a consultar",
+        proyectos_existentes,
+        key="proyectos_consulta",
+        placeholder="Automático (según la pregunta)",
+    )
+
+    # Info del sistema (se llena al final del script, cuando ya se pintó la página)
+    tarjeta_retriever = st.container(border=True)
 
     # Tarjeta de Modelos
     with st.container(border=True):
@@ -183,9 +315,10 @@ col1, col2 = st.columns([2, 1])
 
 with col1:
     # Añadimos la tercera pestaña "🖥️ Monitor"
-    tab_chat, tab_historial, tab_monitor = st.tabs([
+    tab_chat, tab_historial, tab_lotes, tab_monitor = st.tabs([
         "💬 Consultoría Inteligente",
         "📜 Archivo Documental",
+        "📑 Revisión por Lotes",
         "🖥️ Monitor de Sistema"
     ])
 
@@ -227,17 +360,33 @@ with col1:
     with tab_historial:
         # Aquí integramos el diseño de tabla que definimos anteriormente
         st.markdown("### 📜 Repositorio de Conocimiento")
-        lista_archivos = obtener_info_archivos(CONTRATOS_PATH)
+        catalogo = get_document_catalog()
+        # Solo relista las carpetas que cambiaron desde la última vez
+        catalogo.scan(CONTRATOS_PATH)
+        resumen = catalogo.summary()
+
+        if resumen["documentos"]:
+            import pandas as pd
+
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Documentos", resumen["documentos"])
+            c2.metric("Indexados", resumen["indexado"])
+            c3.metric("Pendientes", resumen["pendiente"] + resumen["error"])
+            c4.metric("Fragmentos", resumen["fragmentos"])
+
+            paginas = -(-resumen["documentos"] // config.DOCUMENT_CATALOG_PAGE_SIZE)
+            pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1) if paginas > 1 else 1
 
-        if lista_archivos:
             # Estilo de tabla "Premium" usando dataframe con configuración de columna
-            df_archivos = pd.DataFrame(lista_archivos)
+            df_archivos = pd.DataFrame(obtener_info_archivos(pagina))
             st.dataframe(
                 df_archivos,
                 width='stretch',
                 hide_index=True,
                 column_config={
                     "Archivo": st.column_config.TextColumn("Nombre del Documento", width="large"),
+                    "Proyecto": st.column_config.TextColumn("🗂️ Proyecto"),
+                    "Estado": st.column_config.TextColumn("🔎 Estado"),
                     "Fecha de Carga": st.column_config.TextColumn("📅 Fecha"),
                     "Tamaño": st.column_config.TextColumn("📦 Tamaño")
                 }
@@ -245,25 +394,66 @@ with col1:
 
             col_down, col_info = st.columns([1, 1])
             with col_down:
-                csv = df_archivos.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Exportar Inventario",
-                    data=csv,
-                    file_name="inventario_legal.csv",
-                    mime="text/csv",
-                    width='stretch'
-                )
+                # El CSV se regenera solo cuando cambia el catálogo
+                with open(catalogo.export_csv(), "rb") as f:
+                    st.download_button(
+                        label="📥 Exportar Inventario",
+                        data=f,
+                        file_name="inventario_legal.csv",
+                        mime="text/csv",
+                        width='stretch'
+                    )
         else:
             st.info("El archivo documental está vacío. Por favor, cargue documentos en la barra lateral.")
 
+    with tab_lotes:
+        st.markdown("### 📑 Revisión por Lotes")
+        st.caption("La misma lista de preguntas para cada documento, en una matriz documento × pregunta.")
+        texto_preguntas = st.text_area(
+            "Preguntas (una por línea)", value="\n".join(BATCH_QA_CHECKLIST), height=220, key="lote_preguntas"
+        )
+        preguntas_lote = list(dict.fromkeys(linea.strip() for linea in texto_preguntas.splitlines() if linea.strip()))
+        proyectos_lote = st.multiselect(
+            "Proyectos", proyectos_existentes, key="lote_proyectos", placeholder="Todos los proyectos"
+        )
+        documentos_lote = [
+            nombre for proyecto in (proyectos_lote or [None])
+            for nombre in get_document_catalog().names(project=proyecto)
+        ]
+        st.caption(
+            f"{len(documentos_lote)} documentos indexados × {len(preguntas_lote)} preguntas = "
+            f"{len(documentos_lote) * len(preguntas_lote)} respuestas"
+        )
+        if st.button("▶️ Iniciar Revisión", disabled=batch_running() or not (preguntas_lote and documentos_lote)):
+            st.session_state.lote_id = get_batch_store().create(preguntas_lote, documentos_lote)
+            start_batch(st.session_state.lote_id)
+            st.rerun()
+
+        progreso_lote()
+
     with tab_monitor:
         st.markdown("### 🖥️ Consola de Diagnóstico")
 
+        # Filtros por nivel y fecha (se resuelven con el índice del historial)
+        niveles = {"Todos": None, "Advertencias y errores": logging.WARNING, "Solo errores": logging.ERROR}
+        col_nivel, col_fecha = st.columns(2)
+        with col_nivel:
+            nivel = st.selectbox("Nivel", list(niveles), key="log_nivel")
+        with col_fecha:
+            fecha = st.date_input("Día", value=None, key="log_fecha", format="DD/MM/YYYY")
+        desde = hasta = None
+        if fecha is not None:
+            desde = time.mktime(fecha.timetuple())
+            hasta = desde + 24 * 60 * 60
+
         # Creamos un contenedor vacío para que el log se imprima siempre actualizado
         placeholder_log = st.empty()
 
         # Obtenemos los logs procesados
-        logs_texto = leer_logs_con_formato()
+        logs_texto = leer_logs_con_formato(
+            n_lineas=20 if niveles[nivel] is None and fecha is None else 200,
+            nivel_minimo=niveles[nivel], desde=desde, hasta=hasta,
+        )
 
         # Mostramos el log dentro del placeholder
         placeholder_log.text_area(
@@ -283,16 +473,37 @@ with col1:
                 st.session_state.uploader_id += 1
                 st.rerun()
         with col_btn2:
-            if os.path.exists('logs/historial_db.log'):
-                with open('logs/historial_db.log', 'rb') as f:
+            # La rotación acota el tamaño del archivo vigente; los anteriores quedan en logs/*.gz
+            if os.path.exists(config.LOG_PATH):
+                with open(config.LOG_PATH, 'rb') as f:
                     st.download_button(
-                        label="📥 Descargar Log Completo",
+                        label="📥 Descargar Log Vigente",
                         data=f,
                         file_name="historial_tecnico.log",
                         mime="text/plain",
                         width='stretch'
                     )
 
+        st.markdown("### 🚦 Servicio de Consultas")
+        if config.SERVING_ENABLED:
+            servicio = get_query_scheduler().stats()
+            col_cola, col_ocupados, col_espera, col_rechazadas = st.columns(4)
+            col_cola.metric("En cola", servicio["en_cola"], help=f"Máximo observado: {servicio['max_en_cola']}")
+            col_ocupados.metric(
+                "Workers ocupados", f"{servicio['ocupados']}/{servicio['trabajadores']}",
+                help=f"Utilización media: {servicio['utilizacion_media']:.0%}"
+            )
+            col_espera.metric(
+                "Espera p95", f"{servicio['espera_p95_s']:.2f}s" if servicio["espera_p95_s"] is not None else "—"
+            )
+            col_rechazadas.metric("Rechazadas", servicio["rechazadas"])
+        else:
+            st.caption("Servicio de consultas desactivado (SERVING_ENABLED): cada sesión consulta directamente.")
+
+        st.markdown("### 📊 Métricas por Etapa")
+        tipo_traza = st.radio("Operación", ["consulta", "ingesta", "lote"], horizontal=True, key="tipo_traza")
+        mostrar_metricas(tipo_traza)
+
 with col2:
     st.markdown("### 📄 Documentos Relevantes")
     docs_to_show = None
@@ -301,41 +512,76 @@ with col2:
             docs_to_show = msg["docs"]
             break
 
-    if docs_to_show:
-        for doc in docs_to_show:
-            with st.expander(f"📄 Fragmento {doc['fragmento']} - {doc['fuente']}", expanded=False):
-                st.markdown(f"**Página:** {doc['pagina']}")
-                st.caption(doc['contenido'])
-    else:
-        st.info("Los fragmentos del documento aparecerán aquí al consultar.")
+    # Placeholder para mostrar las fuentes en cuanto se recuperan, antes de la respuesta
+    panel_documentos = st.empty()
+    with panel_documentos.container():
+        mostrar_documentos(docs_to_show)
 
 # --- PROCESAMIENTO DE CHAT ---
 if prompt := st.chat_input("Realiza una consulta..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.rerun()
 
+# --- CARGA DIFERIDA DEL SISTEMA RAG ---
+# La página ya está pintada; aquí se importa el sistema RAG (una vez por proceso)
+try:
+    rag = cargar_rag()
+    RAG_IMPORT_ERROR = None
+except Exception as _e:
+    # Guardar el error para mostrar instrucciones en la UI
+    rag = None
+    RAG_IMPORT_ERROR = _e
+
+with tarjeta_retriever:
+    if rag is not None:
+        retriever_info = rag.get_retriever_info()
+        st.markdown(f"**🔍 Retriever:**")
+        st.markdown(f"`{retriever_info['tipo']}`")
+    else:
+        st.caption("🔍 Retriever: No inicializado")
+
 if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
     last_prompt = st.session_state.messages[-1]["content"]
     with col1:
         with st.chat_message("assistant"):
-            with st.status("🧠 Analizando la base de conocimiento de SINERG-IA...", expanded=True) as status:
-                st.write("🔍 Aplicando Multi-Query...")
-                time.sleep(0.3)
-                st.write("📂 Recuperando contexto relevante...")
-                if RAG_AVAILABLE:
-                    try:
-                        response, docs = query_rag(last_prompt)
-                    except Exception as e:
-                        response = "El motor RAG falló al procesar la consulta. Revisa los logs."
-                        docs = []
-                        st.error(f"Error interno: {e}")
-                else:
-                    response = "El motor RAG no está disponible en este despliegue. Revisa las dependencias y el archivo requirements."
-                    docs = []
-                    if RAG_IMPORT_ERROR:
-                        st.caption(str(RAG_IMPORT_ERROR))
-                status.update(label="✅ Análisis finalizado", state="complete", expanded=False)
-            st.markdown(response)
+            st.markdown("##### SINERG-IA")
+            estado = st.empty()
+            docs = []
+
+            if rag is not None:
+                estado.caption("🔍 Recuperando contexto relevante...")
+
+                def tokens_respuesta():
+                    # Las fuentes llegan primero; después, la respuesta token a token
+                    proyectos = st.session_state.proyectos_consulta or None
+                    if config.SERVING_ENABLED:
+                        # La consulta corre en el pool compartido; aquí solo se leen sus eventos
+                        eventos = get_query_scheduler().stream(
+                            st.session_state.usuario, rag.query_rag_stream, last_prompt, projects=proyectos
+                        )
+                    else:
+                        eventos = rag.query_rag_stream(last_prompt, projects=proyectos)
+                    for tipo, valor in eventos:
+                        if tipo == "cola":
+                            estado.caption(f"⏳ En cola: {valor} consultas por delante...")
+                        elif tipo == "docs":
+                            docs.extend(valor)
+                            with panel_documentos.container():
+                                mostrar_documentos(valor)
+                            estado.caption(f"📍 Basado en {len(valor)} fuentes del archivo. Redactando respuesta...")
+                        elif tipo == "token":
+                            yield valor
+                        elif tipo == "error":
+                            st.error(valor)
+                            yield "El motor RAG falló al procesar la consulta. Revisa los logs."
+
+                response = st.write_stream(tokens_respuesta())
+                estado.empty()
+            else:
+                response = "El motor RAG no está disponible en este despliegue. Revisa las dependencias y el archivo requirements."
+                st.markdown(response)
+                if RAG_IMPORT_ERROR:
+                    st.caption(str(RAG_IMPORT_ERROR))
 
     st.session_state.messages.append({"role": "assistant", "content": response, "docs": docs})
     st.rerun()
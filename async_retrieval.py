@@ -0,0 +1,168 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from config import *
+from metrics import record_span
+from query_rewrite import QueryRewriter
+
+logger = logging.getLogger(__name__)
+
+
+def unique_union(listas):
+    """Unión de listas de documentos sin repetir contenido, respetando el orden"""
+    vistos = set()
+    unicos = []
+    for docs in listas:
+        for doc in docs:
+            if doc.page_content not in vistos:
+                vistos.add(doc.page_content)
+                unicos.append(doc)
+    return unicos
+
+
+def reciprocal_rank_fusion(listas, pesos, c=60):
+    """Fusión RRF ponderada, equivalente a la de EnsembleRetriever"""
+    puntajes = {}
+    por_contenido = {}
+    for docs, peso in zip(listas, pesos):
+        for rango, doc in enumerate(docs, 1):
+            puntajes[doc.page_content] = puntajes.get(doc.page_content, 0.0) + peso / (rango + c)
+            por_contenido.setdefault(doc.page_content, doc)
+    orden = sorted(puntajes, key=puntajes.get, reverse=True)
+    return [por_contenido[contenido] for contenido in orden]
+
+
+class AsyncMultiQueryRetriever(BaseRetriever):
+    """
+    Recuperación multi-consulta concurrente con presupuesto de latencia.
+
+    Mientras el LLM de reescritura trabaja, ya corren la búsqueda por
+    similitud de la pregunta original y BM25. Las búsquedas MMR de cada
+    reescritura se lanzan en paralelo en cuanto llegan. Si la reescritura
+    excede rewrite_budget se omite la rama multi-consulta, y al vencer
+    deadline se cancelan las etapas pendientes y se devuelve el mejor
+    contexto reunido hasta ese momento.
+
+    Las reescrituras las da rewriter (query_rewrite.QueryRewriter), que puede
+    responder desde su cache o con la tabla local de sinónimos; sin él se
+    piden siempre al LLM.
+    """
+
+    vector_store: Any
+    llm: Any
+    prompt: Any
+    bm25_index: Optional[Any] = None
+    rewriter: Optional[Any] = None
+    k: int = SEARCH_K
+    fetch_k: int = MMR_FETCH_K
+    lambda_mult: float = MMR_DIVERSITY_LAMBDA
+    bm25_weight: float = BM25_WEIGHT
+    rewrite_budget: float = REWRITE_BUDGET
+    deadline: float = RETRIEVAL_DEADLINE
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    async def _timed(self, nombre, corrutina):
+        """Ejecuta una etapa y registra su duración en la traza activa"""
+        inicio = time.perf_counter()
+        try:
+            resultado = await corrutina
+        except asyncio.CancelledError:
+            record_span(nombre, time.perf_counter() - inicio, estado="cancelada")
+            raise
+        record_span(nombre, time.perf_counter() - inicio, resultados=len(resultado))
+        return resultado
+
+    def _rewriter(self):
+        if self.rewriter is None:
+            self.rewriter = QueryRewriter(self.llm, self.prompt, mode="llm")
+        return self.rewriter
+
+    async def _aget_relevant_documents(self, query, *, run_manager: AsyncCallbackManagerForRetrieverRun):
+        return await self._aretrieve(query)
+
+    async def _aretrieve(self, query):
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + self.deadline
+
+        # Etapas que no dependen de la reescritura arrancan de inmediato
+        tareas = {"similitud": asyncio.create_task(
+            self._timed("similitud", self.vector_store.asimilarity_search(query, k=self.k))
+        )}
+        if self.bm25_index is not None:
+            tareas["bm25"] = asyncio.create_task(self._timed("bm25", asyncio.to_thread(self._bm25_search, query)))
+
+        try:
+            presupuesto = max(0.0, min(self.rewrite_budget, limite - loop.time()))
+            consultas = await self._rewriter().arewrite(query, budget=presupuesto)
+            if consultas and hasattr(self.vector_store, "batch_max_marginal_relevance_search"):
+                # Todas las reescrituras en una sola búsqueda por lotes (motor NumPy, proyectos)
+                tareas["mmr_lote"] = asyncio.create_task(self._timed("mmr", asyncio.to_thread(
+                    self.vector_store.batch_max_marginal_relevance_search,
+                    consultas, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+                )))
+            else:
+                for i, consulta in enumerate(consultas):
+                    tareas[f"mmr_{i}"] = asyncio.create_task(self._timed(
+                        "mmr",
+                        self.vector_store.amax_marginal_relevance_search(
+                            consulta, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+                        ),
+                    ))
+        except asyncio.TimeoutError:
+            logger.warning(f"Reescritura excedió {self.rewrite_budget:.1f}s; se omite multi-consulta.")
+        except Exception as e:
+            logger.warning(f"Falló la reescritura ({e}); se omite multi-consulta.")
+
+        nombres = {tarea: nombre for nombre, tarea in tareas.items()}
+        listos, pendientes = await asyncio.wait(tareas.values(), timeout=max(0.0, limite - loop.time()))
+        for tarea in pendientes:
+            tarea.cancel()
+        if pendientes:
+            omitidas = sorted(nombres[t] for t in pendientes)
+            logger.warning(f"Plazo de recuperación vencido; etapas omitidas: {omitidas}")
+
+        resultados = {}
+        for tarea in listos:
+            if tarea.exception() is None:
+                resultados[nombres[tarea]] = tarea.result()
+            else:
+                logger.warning(f"Etapa {nombres[tarea]} falló: {tarea.exception()}")
+
+        # Rama densa: similitud original + MMR de cada reescritura (unión única)
+        inicio = time.perf_counter()
+        densos = unique_union(
+            [resultados.get("similitud", [])]
+            + [resultados[n] for n in sorted(resultados) if n.startswith("mmr_") and n != "mmr_lote"]
+            + resultados.get("mmr_lote", [])
+        )
+        if "bm25" in resultados:
+            fusionados = reciprocal_rank_fusion(
+                [densos, resultados["bm25"]], [1 - self.bm25_weight, self.bm25_weight]
+            )
+        else:
+            fusionados = densos
+        record_span("fusion", time.perf_counter() - inicio, documentos=len(fusionados), omitidas=len(pendientes))
+        return fusionados
+
+    def _bm25_search(self, query):
+        puntajes = dict(self.bm25_index.search(query, k=self.k))
+        return self.bm25_index.get_documents(list(puntajes))
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        corrutina = self._aretrieve(query)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(corrutina)
+        # Ya hay un event loop en este hilo: se ejecuta en un hilo aparte, con el
+        # contexto actual (traza activa y alcance de proyectos)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(contextvars.copy_context().run, asyncio.run, corrutina).result()
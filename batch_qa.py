@@ -0,0 +1,449 @@
+import argparse
+import contextvars
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import *
+from log_store import attach_log_file
+from metrics import record_span, span, trace
+from projects import list_pdfs, project_of
+
+logger = logging.getLogger(__name__)
+
+# Módulo ligero al importarlo (lo usa la app): el sistema RAG se carga en run_batch
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+NO_LOCALIZADO = "No localizado en el documento."
+
+
+class BatchStore:
+    """
+    Revisiones por lotes en SQLite: las preguntas y documentos de cada
+    corrida y la respuesta de cada celda (documento × pregunta). Cada celda
+    se guarda al terminar, así una corrida interrumpida se reanuda desde las
+    celdas que faltan.
+    """
+
+    def __init__(self, path=BATCH_QA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                finished REAL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                questions TEXT NOT NULL,
+                documents TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cells (
+                run_id INTEGER NOT NULL,
+                document TEXT NOT NULL,
+                question INTEGER NOT NULL,
+                answer TEXT,
+                sources TEXT,
+                status TEXT NOT NULL,
+                error TEXT,
+                seconds REAL,
+                PRIMARY KEY (run_id, document, question)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def create(self, questions, documents):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (status, created, message, questions, documents) VALUES (?, ?, ?, ?, ?)",
+                (PENDIENTE, time.time(), "En cola", json.dumps(questions, ensure_ascii=False),
+                 json.dumps(documents, ensure_ascii=False)),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _row(self, fila):
+        if fila is None:
+            return None
+        claves = ["id", "estado", "creado", "terminado", "progreso", "mensaje", "preguntas", "documentos"]
+        corrida = dict(zip(claves, fila))
+        corrida["preguntas"] = json.loads(corrida["preguntas"])
+        corrida["documentos"] = json.loads(corrida["documentos"])
+        return corrida
+
+    def get(self, run_id):
+        with self._lock:
+            return self._row(self._conn.execute(
+                "SELECT id, status, created, finished, progress, message, questions, documents FROM runs WHERE id = ?",
+                (run_id,),
+            ).fetchone())
+
+    def latest(self):
+        with self._lock:
+            return self._row(self._conn.execute(
+                "SELECT id, status, created, finished, progress, message, questions, documents "
+                "FROM runs ORDER BY id DESC LIMIT 1"
+            ).fetchone())
+
+    def update(self, run_id, progreso, mensaje, estado=EN_PROCESO):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = ?, progress = ?, message = ? WHERE id = ?",
+                (estado, progreso, mensaje, run_id),
+            )
+            self._conn.commit()
+
+    def finish(self, run_id, estado, mensaje):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = ?, finished = ?, message = ? WHERE id = ?",
+                (estado, time.time(), mensaje, run_id),
+            )
+            self._conn.commit()
+
+    def pending(self, run_id):
+        """Celdas (documento, pregunta) sin respuesta; las que fallaron se reintentan"""
+        corrida = self.get(run_id)
+        with self._lock:
+            hechas = set(self._conn.execute(
+                "SELECT document, question FROM cells WHERE run_id = ? AND status = ?", (run_id, COMPLETADO)
+            ))
+        return [
+            (documento, i)
+            for documento in corrida["documentos"]
+            for i in range(len(corrida["preguntas"]))
+            if (documento, i) not in hechas
+        ]
+
+    def save_cell(self, run_id, documento, pregunta, answer, sources, estado, error=None, seconds=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, documento, pregunta, answer, json.dumps(sources, ensure_ascii=False), estado, error, seconds),
+            )
+            self._conn.commit()
+
+    def counts(self, run_id):
+        with self._lock:
+            por_estado = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM cells WHERE run_id = ? GROUP BY status", (run_id,)
+            ))
+        return {estado: por_estado.get(estado, 0) for estado in (COMPLETADO, ERROR)}
+
+    def matrix(self, run_id):
+        """
+        (encabezados, filas) de la corrida: una fila por documento con su
+        proyecto y una columna por pregunta. Las celdas con error muestran el
+        error y las pendientes quedan vacías.
+        """
+        corrida = self.get(run_id)
+        with self._lock:
+            celdas = {
+                (documento, pregunta): (answer, estado, error)
+                for documento, pregunta, answer, estado, error in self._conn.execute(
+                    "SELECT document, question, answer, status, error FROM cells WHERE run_id = ?", (run_id,)
+                )
+            }
+        encabezados = ["Documento", "Proyecto"] + corrida["preguntas"]
+        filas = []
+        for documento in corrida["documentos"]:
+            fila = [documento, project_of(documento)]
+            for i in range(len(corrida["preguntas"])):
+                answer, estado, error = celdas.get((documento, i), ("", PENDIENTE, None))
+                fila.append(answer if estado == COMPLETADO else f"ERROR: {error}" if estado == ERROR else "")
+            filas.append(fila)
+        return encabezados, filas
+
+    def export(self, run_id, path=None):
+        """Matriz de respuestas en CSV o Parquet (según la extensión; Parquet requiere pyarrow)"""
+        path = path or os.path.join(BATCH_QA_EXPORT_DIR, f"revision_{run_id}.csv")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        encabezados, filas = self.matrix(run_id)
+        if path.lower().endswith(".parquet"):
+            import pandas as pd
+            try:
+                pd.DataFrame(filas, columns=encabezados).to_parquet(path, index=False)
+            except ImportError as e:
+                raise RuntimeError(f"Para exportar a Parquet instala pyarrow ({e}); usa .csv mientras tanto.")
+            return path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+            escritor = csv.writer(f)
+            escritor.writerow(encabezados)
+            escritor.writerows(filas)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _subqueries(preguntas, indices, rewriter, pool):
+    """
+    Subconsultas de cada pregunta (la original y sus reescrituras) sin
+    repetir: preguntas iguales se reescriben una vez y las subconsultas que
+    coinciden entre preguntas se embeben una sola vez para todos los
+    documentos. Devuelve (textos únicos, {pregunta: posiciones en textos}).
+    """
+    unicas = sorted({preguntas[i] for i in indices})
+    reescrituras = dict(zip(unicas, pool.map(rewriter.rewrite, unicas)))
+    textos, posicion, por_pregunta = [], {}, {}
+    for i in indices:
+        por_pregunta[i] = []
+        for texto in [preguntas[i]] + reescrituras[preguntas[i]]:
+            clave = " ".join(texto.lower().split())
+            if clave not in posicion:
+                posicion[clave] = len(textos)
+                textos.append(texto)
+            if posicion[clave] not in por_pregunta[i]:
+                por_pregunta[i].append(posicion[clave])
+    return textos, por_pregunta
+
+
+def run_batch(run_id, store=None, concurrency=BATCH_QA_CONCURRENCY, stop_event=None):
+    """
+    Responde las celdas pendientes de una corrida.
+
+    Las subconsultas se reescriben y embeben una vez para todos los
+    documentos; por documento, una sola búsqueda por lotes (filtrada por su
+    source) recupera el contexto de todas sus preguntas, y las generaciones
+    corren en paralelo acotadas por concurrency mientras se recupera el
+    siguiente documento. Con stop_event (o Ctrl+C) se detiene dejando la
+    corrida pendiente para reanudarla.
+    """
+    # Imports diferidos: LangChain, Chroma y Gemini solo cuando se procesa una corrida
+    from langchain_core.prompts import PromptTemplate
+
+    from async_retrieval import unique_union
+    from clients import get_vector_store
+    from context_packer import pack_documents
+    from embeddings_cache import get_embeddings
+    from project_search import batch_mmr_search
+    from prompts import BATCH_QA_TEMPLATE
+    from rag_system import format_docs_info, initialize_rag_system
+
+    store = store or get_batch_store()
+    corrida = store.get(run_id)
+    preguntas, documentos = corrida["preguntas"], corrida["documentos"]
+    total = len(preguntas) * len(documentos)
+    pendientes = store.pending(run_id)
+    if not pendientes:
+        store.finish(run_id, COMPLETADO, f"{total} respuestas")
+        return store.counts(run_id)
+
+    hechas = total - len(pendientes)
+    store.update(run_id, hechas / total, "Preparando subconsultas")
+    logger.info(f"Revisión por lotes {run_id}: {len(pendientes)} de {total} celdas pendientes.")
+    plantilla = PromptTemplate.from_template(BATCH_QA_TEMPLATE)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lote")
+    detenida = False
+    try:
+        with trace("lote", f"{len(preguntas)} preguntas × {len(documentos)} documentos") as traza:
+            rag = initialize_rag_system()
+            rutas = list_pdfs()
+
+            with span("subconsultas") as etapa:
+                textos, por_pregunta = _subqueries(preguntas, sorted({i for _, i in pendientes}), rag["rewriter"], pool)
+                # Con caché: solo las subconsultas nuevas llaman al API
+                embeddings = get_embeddings()
+                vectores = [embeddings.embed_query(texto) for texto in textos]
+                etapa.set(preguntas=len(por_pregunta), subconsultas=len(textos))
+
+            def responder(documento, i, docs):
+                inicio = time.perf_counter()
+                fuentes = format_docs_info(docs)
+                try:
+                    if docs:
+                        prompt = plantilla.invoke({
+                            "context": rag["format_docs"](docs),
+                            "question": preguntas[i],
+                            "document": os.path.basename(documento),
+                        })
+                        respuesta = rag["generation"].invoke(prompt)
+                    else:
+                        # Sin fragmentos del documento no hace falta llamar al LLM
+                        respuesta = NO_LOCALIZADO
+                    segundos = time.perf_counter() - inicio
+                    record_span("generacion", segundos, documento=documento, pregunta=i)
+                    store.save_cell(run_id, documento, i, respuesta, fuentes, COMPLETADO, seconds=segundos)
+                except Exception as e:
+                    logger.warning(f"Revisión {run_id}: falló '{documento}' × pregunta {i + 1}: {e}")
+                    store.save_cell(run_id, documento, i, None, fuentes, ERROR, str(e), time.perf_counter() - inicio)
+
+            por_documento = {}
+            for documento, i in pendientes:
+                por_documento.setdefault(documento, []).append(i)
+
+            futuros = []
+            for documento, indices in por_documento.items():
+                if stop_event is not None and stop_event.is_set():
+                    detenida = True
+                    break
+                ruta = rutas.get(documento)
+                if ruta is None:
+                    for i in indices:
+                        store.save_cell(run_id, documento, i, None, [], ERROR,
+                                        "El documento ya no está en la carpeta de contratos")
+                    hechas += len(indices)
+                    continue
+                posiciones = sorted({p for i in indices for p in por_pregunta[i]})
+                with span("recuperacion", documento=documento, subconsultas=len(posiciones)):
+                    resultados = batch_mmr_search(
+                        [get_vector_store(project_of(documento))], [vectores[p] for p in posiciones],
+                        filter={"source": ruta},
+                    )
+                por_posicion = dict(zip(posiciones, resultados))
+                for i in indices:
+                    docs = pack_documents(unique_union([por_posicion[p] for p in por_pregunta[i]]))
+                    # Con el contexto actual: las generaciones quedan en la traza del lote
+                    futuros.append(pool.submit(contextvars.copy_context().run, responder, documento, i, docs))
+
+            # stop_event se revisa cada segundo, no solo al terminar una generación
+            en_espera = set(futuros)
+            while en_espera:
+                if stop_event is not None and stop_event.is_set():
+                    detenida = True
+                if detenida:
+                    # Las generaciones encoladas se descartan en cuanto se pide
+                    # detener; las que están en curso terminan y se guardan
+                    for futuro in en_espera:
+                        futuro.cancel()
+                listos, en_espera = wait(en_espera, timeout=1.0, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    if futuro.cancelled():
+                        continue
+                    futuro.result()
+                    hechas += 1
+                    store.update(run_id, hechas / total, f"{hechas} de {total} respuestas")
+
+            conteo = store.counts(run_id)
+            traza.set(celdas=total, errores=conteo[ERROR], detenida=detenida)
+    except KeyboardInterrupt:
+        detenida = True
+        raise
+    except Exception as e:
+        logger.error(f"Revisión por lotes {run_id} falló: {e}\n{traceback.format_exc()}")
+        store.finish(run_id, ERROR, str(e))
+        raise
+    finally:
+        # Las generaciones en curso terminan y se guardan; las encoladas se descartan
+        pool.shutdown(wait=True, cancel_futures=True)
+        if detenida:
+            conteo = store.counts(run_id)
+            store.update(run_id, conteo[COMPLETADO] / total,
+                         f"Detenida con {conteo[COMPLETADO]} de {total} respuestas; se puede reanudar", PENDIENTE)
+
+    if not detenida:
+        mensaje = f"{conteo[COMPLETADO]} respuestas" + (f", {conteo[ERROR]} con error" if conteo[ERROR] else "")
+        store.finish(run_id, COMPLETADO if not conteo[ERROR] else ERROR, mensaje)
+        logger.info(f"Revisión por lotes {run_id} terminada: {mensaje}.")
+    return conteo
+
+
+_shared_store = None
+_batch_thread = None
+_stop_event = None
+_shared_lock = threading.Lock()
+
+
+def get_batch_store():
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = BatchStore()
+        return _shared_store
+
+
+def _run_in_thread(run_id):
+    attach_log_file(logger)
+    attach_log_file(logging.getLogger("rag_system"))
+    try:
+        run_batch(run_id, stop_event=_stop_event)
+    except Exception:
+        # run_batch ya dejó el error en la corrida y en el historial
+        pass
+
+
+def start_batch(run_id):
+    """Procesa una corrida en un hilo de la app; una a la vez por proceso. Devuelve False si ya hay una"""
+    global _batch_thread, _stop_event
+    with _shared_lock:
+        if _batch_thread is not None and _batch_thread.is_alive():
+            return False
+        _stop_event = threading.Event()
+        _batch_thread = threading.Thread(target=_run_in_thread, args=(run_id,), name="sinergia-lote", daemon=True)
+        _batch_thread.start()
+        return True
+
+
+def stop_batch():
+    """Pide detener la corrida en curso (queda pendiente para reanudarla)"""
+    with _shared_lock:
+        if _stop_event is not None:
+            _stop_event.set()
+
+
+def batch_running():
+    with _shared_lock:
+        return _batch_thread is not None and _batch_thread.is_alive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revisión por lotes: lista de preguntas × documentos")
+    parser.add_argument("--questions", help="Archivo de texto con una pregunta por línea (por defecto, BATCH_QA_CHECKLIST)")
+    parser.add_argument("--project", action="append", help="Solo documentos de este proyecto (se puede repetir)")
+    parser.add_argument("--documents", nargs="+", help="Documentos (ruta relativa a contratos); por defecto, los indexados")
+    parser.add_argument("--resume", type=int, help="Reanudar la corrida con este número")
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY, help="Generaciones simultáneas")
+    parser.add_argument("--output", help="Archivo de salida .csv o .parquet")
+    args = parser.parse_args()
+
+    store = get_batch_store()
+    if args.resume:
+        run_id = args.resume
+        if store.get(run_id) is None:
+            parser.error(f"No existe la corrida {run_id}.")
+    else:
+        if args.questions:
+            with open(args.questions, encoding="utf-8") as f:
+                preguntas = [linea.strip() for linea in f if linea.strip()]
+        else:
+            from prompts import BATCH_QA_CHECKLIST
+            preguntas = list(BATCH_QA_CHECKLIST)
+        if args.documents:
+            documentos = args.documents
+        else:
+            from document_catalog import get_document_catalog
+            catalogo = get_document_catalog()
+            documentos = [n for p in (args.project or [None]) for n in catalogo.names(project=p)]
+        if not preguntas or not documentos:
+            parser.error("No hay preguntas o documentos para revisar.")
+        run_id = store.create(preguntas, documentos)
+        print(f"Corrida {run_id}: {len(preguntas)} preguntas × {len(documentos)} documentos.")
+
+    inicio = time.perf_counter()
+    try:
+        conteo = run_batch(run_id, store, concurrency=args.concurrency)
+        print(f"Terminada en {time.perf_counter() - inicio:.1f}s: {conteo}")
+    except KeyboardInterrupt:
+        print(f"Interrumpida. Reanuda con: python batch_qa.py --resume {run_id}")
+    print(f"Matriz: {store.export(run_id, args.output)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(message)s')
+    main()
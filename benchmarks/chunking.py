@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_contract_pages
+from benchmarks.run_benchmark import peak_rss_mb, percentiles
+from benchmarks.stand_ins import HashingEmbeddings
+from clause_splitter import get_text_splitter
+from config import *
+from context_packer import pack_documents
+from embedding_batcher import estimate_tokens
+from ingest_pipeline import count_pages, parse_page_range
+
+# Compara estrategias de fragmentación (clause_splitter.get_text_splitter) sobre
+# contratos sintéticos completos (benchmarks/corpus.synthetic_contract_pages).
+#
+# Por configuración "estrategia:tamaño:solapamiento" reporta el tamaño del
+# índice (fragmentos, caracteres, MB en disco), el costo de embedding (tokens
+# estimados y llamadas), los hechos cortados entre dos fragmentos y, por cada
+# k, la tasa de aciertos de la búsqueda dentro del contrato y los tokens de
+# contexto que llegan al prompt tras pack_documents. Por defecto se comparan
+# la ingesta anterior (caracteres 1200/200), la de vectorstores.py (5000/1000)
+# y la fragmentación por cláusulas.
+#
+# Uso:
+#     python benchmarks/chunking.py --contracts 200 --k 1,2,4,6
+#     python benchmarks/chunking.py --pdf-dir contratos   # solo tamaño, con PDFs reales
+
+
+def directory_mb(path):
+    total = sum(
+        os.path.getsize(os.path.join(raiz, nombre)) for raiz, _, nombres in os.walk(path) for nombre in nombres
+    )
+    return round(total / (1024 * 1024), 2)
+
+
+def parse_config(texto):
+    estrategia, tamano, solapamiento = texto.split(":")
+    return estrategia, int(tamano), int(solapamiento)
+
+
+def split_stats(docs):
+    """Tamaño del índice y costo de embedding de una lista de fragmentos"""
+    caracteres = [len(d.page_content) for d in docs]
+    return {
+        "fragmentos": len(docs),
+        "caracteres": sum(caracteres),
+        "caracteres_medio": round(sum(caracteres) / max(1, len(docs)), 1),
+        "tokens_embedding": sum(estimate_tokens(d.page_content) for d in docs),
+        "con_clausula": round(sum("clausula" in d.metadata for d in docs) / max(1, len(docs)), 4),
+    }
+
+
+def bench_config(configuracion, contratos, hechos, args, directorio):
+    estrategia, tamano, solapamiento = configuracion
+    inicio = time.perf_counter()
+    docs = []
+    for paginas in contratos:
+        # Un fragmentador por contrato, como un rango de páginas en la ingesta
+        docs += get_text_splitter(estrategia, chunk_size=tamano, chunk_overlap=solapamiento).split_documents(paginas)
+    resultado = {"configuracion": f"{estrategia}:{tamano}:{solapamiento}"}
+    resultado["fragmentacion_s"] = round(time.perf_counter() - inicio, 3)
+    resultado.update(split_stats(docs))
+
+    por_fuente = {}
+    for doc in docs:
+        por_fuente.setdefault(doc.metadata["source"], []).append(" ".join(doc.page_content.split()))
+    cortados = sum(not any(h["frase"] in texto for texto in por_fuente[h["fuente"]]) for h in hechos)
+    resultado["hechos_cortados"] = round(cortados / max(1, len(hechos)), 4)
+
+    embeddings = HashingEmbeddings(dimensions=args.dims)
+    persistencia = os.path.join(directorio, resultado["configuracion"].replace(":", "_"))
+    vector_store = Chroma(collection_name="chunking", embedding_function=embeddings, persist_directory=persistencia)
+    inicio = time.perf_counter()
+    for i in range(0, len(docs), args.batch_size):
+        lote = docs[i:i + args.batch_size]
+        vector_store.add_documents(documents=lote, ids=[f"frag-{i + j}" for j in range(len(lote))])
+    resultado["embedding_s"] = round(time.perf_counter() - inicio, 3)
+    resultado["llamadas_embedding"] = embeddings.calls
+    resultado["indice_mb"] = directory_mb(persistencia)
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    aciertos = {k: 0 for k in ks}
+    contexto = {k: 0 for k in ks}
+    segundos = []
+    muestra = random.Random(42).sample(hechos, min(args.queries, len(hechos)))
+    for hecho in muestra:
+        pregunta = f"¿Cuál es el {hecho['tema']} del contrato {hecho['contrato']}?"
+        inicio = time.perf_counter()
+        encontrados = vector_store.similarity_search(pregunta, k=ks[-1], filter={"source": hecho["fuente"]})
+        segundos.append(time.perf_counter() - inicio)
+        for k in ks:
+            aciertos[k] += any(hecho["respuesta"] in d.page_content for d in encontrados[:k])
+            empaquetados = pack_documents(encontrados[:k], token_budget=10 ** 9)
+            contexto[k] += sum(estimate_tokens(d.page_content) for d in empaquetados)
+    n = max(1, len(muestra))
+    resultado["recuperacion"] = percentiles(segundos)
+    resultado["por_k"] = {
+        k: {"tasa_aciertos": round(aciertos[k] / n, 4), "tokens_contexto_medio": round(contexto[k] / n, 1)}
+        for k in ks
+    }
+    return resultado
+
+
+def bench_pdfs(pdf_dir, configuraciones):
+    """Fragmentación de PDFs reales con el mismo camino que la ingesta (sin aciertos)"""
+    archivos = sorted(
+        os.path.join(pdf_dir, nombre) for nombre in os.listdir(pdf_dir) if nombre.lower().endswith(".pdf")
+    )
+    resultados = []
+    for estrategia, tamano, solapamiento in configuraciones:
+        docs = []
+        inicio = time.perf_counter()
+        for path in archivos:
+            fragmentos = parse_page_range(path, 0, count_pages(path), tamano, solapamiento, estrategia)["fragmentos"]
+            docs += [Document(page_content=texto, metadata=metadata) for texto, metadata in fragmentos]
+        resultados.append({
+            "configuracion": f"{estrategia}:{tamano}:{solapamiento}",
+            "archivos": len(archivos),
+            "segundos": round(time.perf_counter() - inicio, 3),
+            **split_stats(docs),
+        })
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fragmentación por cláusulas frente a fragmentación por caracteres")
+    parser.add_argument("--contracts", type=int, default=100, help="Contratos sintéticos")
+    parser.add_argument(
+        "--configs",
+        default=f"caracteres:1200:200,caracteres:5000:1000,clausulas:{CHUNK_SIZE}:{CHUNK_OVERLAP}",
+        help="Configuraciones estrategia:tamaño:solapamiento separadas por coma",
+    )
+    parser.add_argument("--queries", type=int, default=500, help="Preguntas (una por cláusula con respuesta)")
+    parser.add_argument("--k", default=f"1,2,{SEARCH_K}", help="Valores de k separados por coma")
+    parser.add_argument("--dims", type=int, default=256, help="Dimensión del embedding simulado")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--pdf-dir", default=None, help="Carpeta de PDFs reales para medir solo el tamaño del índice")
+    parser.add_argument("--output", default="bench_chunking.json", help="Archivo JSON de resultados")
+    parser.add_argument("--keep", action="store_true", help="Conservar los índices temporales")
+    args = parser.parse_args()
+
+    configuraciones = [parse_config(c) for c in args.configs.split(",")]
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corridas": [],
+    }
+
+    contratos, hechos = [], []
+    for contrato in range(args.contracts):
+        paginas, de_contrato = synthetic_contract_pages(contrato)
+        contratos.append(paginas)
+        hechos += de_contrato
+
+    directorio = tempfile.mkdtemp(prefix="sinergia_fragmentacion_")
+    try:
+        for configuracion in configuraciones:
+            print(f"--- {':'.join(map(str, configuracion))} ---")
+            resultado = bench_config(configuracion, contratos, hechos, args, directorio)
+            print(json.dumps(resultado, ensure_ascii=False, indent=2))
+            reporte["corridas"].append(resultado)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directorio, ignore_errors=True)
+    if args.pdf_dir:
+        reporte["pdfs"] = bench_pdfs(args.pdf_dir, configuraciones)
+    reporte["memoria_pico_mb"] = peak_rss_mb()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import random
+import textwrap
+
+from langchain_core.documents import Document
+
+TIPOS = ["LO", "LP", "IO", "AD"]
+CLAUSULAS = ["PRIMERA", "SEGUNDA", "TERCERA", "CUARTA", "QUINTA", "SEXTA", "SÉPTIMA", "OCTAVA", "NOVENA", "DÉCIMA"]
+TEMAS = [
+    "objeto del contrato y descripción pormenorizada de los trabajos",
+    "monto del contrato sin incluir el impuesto al valor agregado",
+    "plazo de ejecución de los trabajos en días naturales",
+    "garantía de cumplimiento mediante póliza de fianza",
+    "anticipo para el inicio de los trabajos y compra de materiales",
+    "forma de pago mediante estimaciones periódicas",
+    "penas convencionales por atraso en el programa de obra",
+    "documentación mínima a presentar por el licitante",
+    "especificaciones generales y particulares de construcción",
+    "resistencia del concreto f'c y control de calidad",
+]
+RELLENO = [
+    "conforme a lo establecido en la Ley de Obras Públicas y Servicios Relacionados con las Mismas",
+    "de acuerdo con los Términos de Referencia (TDR) del Anexo",
+    "según el catálogo de conceptos y el programa de ejecución",
+    "la residencia de obra verificará el cumplimiento",
+    "el contratista se obliga a",
+    "en los términos del Reglamento de la LOPSRM",
+]
+
+
+def contract_number(contrato, seed=42):
+    """Número de contrato determinista para el índice de contrato dado"""
+    rng = random.Random(f"{seed}-{contrato}")
+    return f"{rng.choice(TIPOS)}-{rng.randint(1, 32):02d}-D{rng.randint(0, 99):02d}-{contrato:09d}-N-{rng.randint(1, 99)}-2025"
+
+
+def synthetic_chunks(n_chunks, chunks_per_contract=200, seed=42):
+    """
+    Genera fragmentos de contratos de obra pública sintéticos y deterministas.
+
+    Cada contrato tiene su número, cláusulas, montos y anexos; los fragmentos
+    imitan el tamaño de los de la ingesta real (~1,000 caracteres).
+    """
+    rng = random.Random(seed)
+    for i in range(n_chunks):
+        contrato = i // chunks_per_contract
+        numero = contract_number(contrato, seed)
+        tema = rng.choice(TEMAS)
+        partes = [
+            f"CLÁUSULA {rng.choice(CLAUSULAS)}.- {tema.upper()}.",
+            f"Contrato {numero}:",
+            f"{tema} por un monto de ${rng.randint(100_000, 90_000_000):,}.00 M.N.",
+        ]
+        while sum(len(p) for p in partes) < 900:
+            partes.append(f"{rng.choice(RELLENO)} {rng.randint(1, 12)}, {tema}.")
+        yield Document(
+            page_content=" ".join(partes),
+            metadata={
+                "source": f"contrato_{contrato:05d}.pdf",
+                "page": (i % chunks_per_contract) // 3,
+                "contrato": numero,
+                "tema": tema,
+            },
+        )
+
+
+def synthetic_queries(n_queries, n_chunks, chunks_per_contract=200, seed=42):
+    """Preguntas con su respuesta esperada (contrato y tema) para medir aciertos"""
+    rng = random.Random(seed + 1)
+    n_contratos = max(1, -(-n_chunks // chunks_per_contract))
+    for _ in range(n_queries):
+        numero = contract_number(rng.randrange(n_contratos), seed)
+        tema = rng.choice(TEMAS)
+        yield {
+            "pregunta": f"¿Cuál es el {tema} del contrato {numero}?",
+            "contrato": numero,
+            "tema": tema,
+        }
+
+
+def synthetic_contract_pages(contrato, seed=42, page_chars=2500, line_chars=90):
+    """
+    Contrato sintético completo, paginado como lo entrega la lectura de PDF.
+
+    Tiene declaraciones, cláusulas de largo variable (una por tema, algunas
+    cruzan de página), referencias a otras cláusulas dentro del texto y un
+    anexo con secciones numeradas. Devuelve (páginas, hechos): cada hecho es
+    el tema de una cláusula y una frase con un código único que solo aparece
+    en ella, para medir aciertos con cualquier fragmentación.
+    """
+    rng = random.Random(f"{seed}-paginas-{contrato}")
+    numero = contract_number(contrato, seed)
+    fuente = f"contrato_{contrato:05d}.pdf"
+
+    def relleno():
+        frase = f"{rng.choice(RELLENO)} {rng.randint(1, 12)}"
+        if rng.random() < 0.2:
+            frase += f", sin perjuicio de lo dispuesto en la cláusula {rng.choice(CLAUSULAS).lower()} de este contrato"
+        if rng.random() < 0.2:
+            frase += f" y lo relativo a {rng.choice(TEMAS)}"
+        return frase + "."
+
+    def envolver(texto):
+        # Sin cortar en guiones: los números de contrato y códigos quedan en una línea
+        return textwrap.wrap(texto, line_chars, break_on_hyphens=False)
+
+    def parrafo(caracteres):
+        frases = []
+        while sum(len(f) + 1 for f in frases) < caracteres:
+            frases.append(relleno())
+        return envolver(" ".join(frases))
+
+    lineas = [f"CONTRATO DE OBRA PÚBLICA {numero}", "DECLARACIONES"]
+    for romano in ("I", "II", "III"):
+        lineas += envolver(f"{romano}. Declara la dependencia que {relleno()}")
+    lineas.append("CLÁUSULAS")
+
+    hechos = []
+    for ordinal, tema in zip(CLAUSULAS, rng.sample(TEMAS, len(TEMAS))):
+        codigo = f"REF-{contrato:05d}-{rng.randint(100_000, 999_999)}"
+        hecho = f"Para el {tema} del contrato {numero} se fija la referencia {codigo}."
+        cuerpo = parrafo(rng.choice([300, 800, 1500, 3000]))
+        posicion = rng.randint(0, len(cuerpo))
+        cuerpo = cuerpo[:posicion] + envolver(hecho) + cuerpo[posicion:]
+        lineas += [f"{ordinal}.- {tema.upper()}."] + cuerpo
+        hechos.append({"fuente": fuente, "contrato": numero, "tema": tema, "respuesta": codigo, "frase": hecho})
+
+    lineas.append("ANEXO 1")
+    for i, tema in enumerate(rng.sample(TEMAS, 4), 1):
+        lineas += [f"1.{i} {tema.upper()}"] + parrafo(rng.choice([400, 1200]))
+
+    paginas, actual = [], []
+    for linea in lineas:
+        actual.append(linea)
+        if sum(len(l) + 1 for l in actual) >= page_chars:
+            paginas.append("\n".join(actual))
+            actual = []
+    if actual:
+        paginas.append("\n".join(actual))
+    docs = [
+        Document(page_content=texto, metadata={"source": fuente, "page": i, "total_pages": len(paginas)})
+        for i, texto in enumerate(paginas)
+    ]
+    return docs, hechos
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import chromadb
+from langchain_chroma import Chroma
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_queries
+from benchmarks.run_benchmark import is_hit, peak_rss_mb, percentiles
+from benchmarks.stand_ins import HashingEmbeddings
+from benchmarks.vector_engines import load_collection, load_corpus
+from config import *
+from document_index import DocumentIndex, update_document_index
+
+# Búsqueda en dos etapas (document_index.py) frente a MMR sobre toda la colección.
+#
+# El corpus sintético (un archivo por contrato) se carga en Chroma y el índice
+# de documentos se construye con update_document_index, como en la ingesta
+# (resúmenes extractivos, sin LLM). Por cada --top-n reporta la tasa de
+# aciertos, si el contrato correcto quedó entre los documentos elegidos, la
+# latencia de la etapa gruesa y del MMR filtrado y los vectores comparados
+# por consulta (centroides + fragmentos de los documentos elegidos, frente a
+# todos los fragmentos).
+#
+# Las preguntas citan el número de contrato, que en la app ya resuelve la ruta
+# de identificadores; aquí se usa como señal para medir la etapa gruesa sola.
+#
+# Uso:
+#     python benchmarks/document_routing.py --chunks 20000,100000 --top-n 1,3,5,10
+
+
+def bench_flat(store, consultas, vectores, args):
+    segundos, aciertos = [], 0
+    for consulta, vector in zip(consultas, vectores):
+        inicio = time.perf_counter()
+        docs = store.max_marginal_relevance_search_by_vector(
+            vector, k=args.k, fetch_k=args.fetch_k, lambda_mult=args.lambda_mult
+        )
+        segundos.append(time.perf_counter() - inicio)
+        aciertos += is_hit(docs, consulta)
+    return {"tasa_aciertos": round(aciertos / len(consultas), 4), "mmr": percentiles(segundos)}
+
+
+def bench_routed(store, indice, consultas, vectores, por_fuente, top_n, args):
+    etapa_gruesa, etapa_fina = [], []
+    aciertos = documento_correcto = comparados = 0
+    for consulta, vector in zip(consultas, vectores):
+        inicio = time.perf_counter()
+        elegidos = indice.route(vector, n=top_n, min_docs=0)
+        etapa_gruesa.append(time.perf_counter() - inicio)
+        fuentes = [fuente for fuente, _, _ in elegidos]
+        filtro = {"source": {"$in": fuentes}} if len(fuentes) > 1 else {"source": fuentes[0]}
+        inicio = time.perf_counter()
+        docs = store.max_marginal_relevance_search_by_vector(
+            vector, k=args.k, fetch_k=args.fetch_k, lambda_mult=args.lambda_mult, filter=filtro
+        )
+        etapa_fina.append(time.perf_counter() - inicio)
+        aciertos += is_hit(docs, consulta)
+        documento_correcto += consulta["fuente"] in fuentes
+        comparados += len(por_fuente) + sum(por_fuente[fuente] for fuente in fuentes)
+    n = len(consultas)
+    gruesa, fina = percentiles(etapa_gruesa), percentiles(etapa_fina)
+    return {
+        "top_n": top_n,
+        "tasa_aciertos": round(aciertos / n, 4),
+        "documento_correcto": round(documento_correcto / n, 4),
+        "vectores_comparados": round(comparados / n, 1),
+        "etapa_gruesa": gruesa,
+        "mmr_filtrado": fina,
+        "total_p50_ms": round(gruesa["p50_ms"] + fina["p50_ms"], 3),
+    }
+
+
+def run(n_chunks, args):
+    directorio = tempfile.mkdtemp(prefix=f"sinergia_documentos_{n_chunks}_")
+    try:
+        embeddings = HashingEmbeddings(dimensions=args.dims)
+        ids, docs, vectores = load_corpus(n_chunks, embeddings, args.batch_size)
+        cliente = chromadb.PersistentClient(path=os.path.join(directorio, "chroma"))
+        _, carga = load_collection(cliente, "documentos", 100, ids, docs, vectores, args.batch_size)
+        store = Chroma(client=cliente, collection_name="documentos", embedding_function=embeddings)
+
+        por_fuente = {}
+        contrato_de = {}
+        for doc in docs:
+            por_fuente[doc.metadata["source"]] = por_fuente.get(doc.metadata["source"], 0) + 1
+            contrato_de[doc.metadata["contrato"]] = doc.metadata["source"]
+
+        # Mismo camino que la ingesta: nombre -> ruta y manifiesto con hash y proyecto
+        indice = DocumentIndex(path=os.path.join(directorio, "documents.sqlite3"))
+        indexados = {fuente: {"hash": fuente, "proyecto": PROJECT_DEFAULT} for fuente in por_fuente}
+        inicio = time.perf_counter()
+        update_document_index(indice, indexados, {fuente: fuente for fuente in por_fuente}, lambda _: store)
+        construccion = time.perf_counter() - inicio
+
+        consultas = list(synthetic_queries(args.queries, n_chunks))
+        for consulta in consultas:
+            consulta["fuente"] = contrato_de[consulta["contrato"]]
+        vectores_consulta = [embeddings.embed_query(consulta["pregunta"]) for consulta in consultas]
+
+        resultado = {
+            "fragmentos": n_chunks,
+            "documentos": len(por_fuente),
+            "carga_s": round(carga, 3),
+            "indice_documentos_s": round(construccion, 3),
+            "plano": {"vectores_comparados": n_chunks, **bench_flat(store, consultas, vectores_consulta, args)},
+            "dos_etapas": [
+                bench_routed(store, indice, consultas, vectores_consulta, por_fuente, int(n), args)
+                for n in args.top_n.split(",") if int(n) < len(por_fuente)
+            ],
+        }
+        resultado["memoria_pico_mb"] = peak_rss_mb()
+        return resultado
+    finally:
+        if not args.keep:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Búsqueda en dos etapas (documentos y fragmentos) frente a MMR plano")
+    parser.add_argument("--chunks", default="20000", help="Tamaños de corpus separados por coma")
+    parser.add_argument("--queries", type=int, default=200, help="Preguntas por corrida")
+    parser.add_argument("--top-n", default=f"1,3,{DOCUMENT_TOP_N},10", help="Documentos elegidos en la etapa gruesa")
+    parser.add_argument("--dims", type=int, default=256, help="Dimensión del embedding simulado")
+    parser.add_argument("--k", type=int, default=SEARCH_K)
+    parser.add_argument("--fetch-k", type=int, default=MMR_FETCH_K)
+    parser.add_argument("--lambda-mult", type=float, default=MMR_DIVERSITY_LAMBDA)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--output", default="bench_document_routing.json", help="Archivo JSON de resultados")
+    parser.add_argument("--keep", action="store_true", help="Conservar los índices temporales")
+    args = parser.parse_args()
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corridas": [],
+    }
+    for n_chunks in (int(n) for n in args.chunks.split(",")):
+        print(f"--- Corrida con {n_chunks} fragmentos ---")
+        resultado = run(n_chunks, args)
+        print(json.dumps(resultado, ensure_ascii=False, indent=2))
+        reporte["corridas"].append(resultado)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
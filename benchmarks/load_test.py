@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from langchain_chroma import Chroma
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_queries
+from benchmarks.run_benchmark import bench_ingest, peak_rss_mb, percentiles
+from benchmarks.stand_ins import HashingEmbeddings, ScriptedChatModel
+from bm25_index import BM25Index
+from config import *
+from rag_system import build_rag_system
+from serving import QueryScheduler
+
+# Prueba de carga: N sesiones simultáneas consultan el sistema RAG construido
+# con build_rag_system, con modelos simulados (benchmarks/stand_ins.py) y un
+# corpus sintético en un Chroma temporal.
+#
+# Cada sesión hace --queries-per-session preguntas con una pausa aleatoria
+# (--think) entre ellas, como una persona que lee la respuesta. Las sesiones
+# "ráfaga" (--burst-users) mandan --burst-size preguntas a la vez, para ver
+# si el resto sigue siendo atendido. Cada consulta recorre las mismas etapas
+# que query_rag_stream después de la caché y el enrutamiento.
+#
+# Modos:
+#   directo  cada sesión consulta en su propio hilo, como hoy cada rerun de
+#            Streamlit (concurrencia sin límite)
+#   pool:W   a través de serving.QueryScheduler con W workers y cola por usuario
+#
+# Por modo reporta rendimiento, latencia total y al primer token (global,
+# sesiones normales y ráfaga), profundidad de cola, saturación de los workers
+# y consultas rechazadas.
+#
+# Uso:
+#     python benchmarks/load_test.py --sessions 20 --llm-latency 1.5 --modes directo,pool:8,pool:16
+
+
+def answer_stream(rag, pregunta):
+    """Las etapas de rag_system.query_rag_stream sin caché ni enrutamiento"""
+    state = rag["retrieve"](pregunta)
+    yield "docs", len(state["docs"])
+    state = rag["build_prompt"](state)
+    for texto in rag["generation"].stream(state["prompt"]):
+        yield "token", texto
+
+
+class Sampler:
+    """Muestrea cada intervalo la cola y los workers ocupados (o las consultas en vuelo)"""
+
+    def __init__(self, leer, intervalo):
+        self.leer = leer
+        self.intervalo = intervalo
+        self.muestras = []
+        self._detener = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._detener.wait(self.intervalo):
+            self.muestras.append(self.leer())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        self._thread.join()
+
+    def summary(self, trabajadores):
+        if not self.muestras:
+            return {}
+        colas = [cola for cola, _ in self.muestras]
+        ocupados = [ocupado for _, ocupado in self.muestras]
+        resumen = {
+            "cola_media": round(sum(colas) / len(colas), 2),
+            "cola_max": max(colas),
+            "en_servicio_medio": round(sum(ocupados) / len(ocupados), 2),
+            "en_servicio_max": max(ocupados),
+        }
+        if trabajadores:
+            resumen["saturacion_media"] = round(sum(ocupados) / (len(ocupados) * trabajadores), 3)
+            resumen["tiempo_saturado"] = round(sum(o >= trabajadores for o in ocupados) / len(ocupados), 3)
+        return resumen
+
+
+def run_query(ejecutar, usuario, pregunta, clase, resultados, lock):
+    inicio = time.perf_counter()
+    primer_token = None
+    error = None
+    for tipo, valor in ejecutar(usuario, pregunta):
+        if tipo == "token" and primer_token is None:
+            primer_token = time.perf_counter() - inicio
+        elif tipo == "error":
+            error = valor
+    with lock:
+        resultados.append({
+            "clase": clase,
+            "total": time.perf_counter() - inicio,
+            "primer_token": primer_token,
+            "error": error,
+        })
+
+
+def session(usuario, preguntas, clase, args, ejecutar, resultados, lock, seed):
+    rng = random.Random(seed)
+    rafaga = args.burst_size if clase == "rafaga" else 1
+    for inicio in range(0, len(preguntas), rafaga):
+        if args.think:
+            time.sleep(rng.expovariate(1 / args.think))
+        hilos = [
+            threading.Thread(target=run_query, args=(ejecutar, usuario, pregunta, clase, resultados, lock))
+            for pregunta in preguntas[inicio:inicio + rafaga]
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+
+def summarize(resultados, clase=None):
+    filas = [r for r in resultados if clase is None or r["clase"] == clase]
+    correctas = [r for r in filas if not r["error"]]
+    return {
+        "consultas": len(filas),
+        "rechazadas": len(filas) - len(correctas),
+        "latencia": percentiles([r["total"] for r in correctas]),
+        "primer_token": percentiles([r["primer_token"] for r in correctas if r["primer_token"] is not None]),
+    }
+
+
+def run_mode(modo, rag, preguntas, args):
+    resultados, lock = [], threading.Lock()
+    trabajadores = None
+    planificador = None
+    if modo == "directo":
+        en_vuelo = [0]
+
+        def ejecutar(usuario, pregunta):
+            with lock:
+                en_vuelo[0] += 1
+            try:
+                yield from answer_stream(rag, pregunta)
+            finally:
+                with lock:
+                    en_vuelo[0] -= 1
+
+        def leer():
+            return 0, en_vuelo[0]
+    else:
+        trabajadores = int(modo.split(":")[1])
+        planificador = QueryScheduler(
+            workers=trabajadores, max_queue=args.max_queue, max_per_user=args.max_per_user
+        )
+
+        def ejecutar(usuario, pregunta):
+            return planificador.stream(usuario, answer_stream, rag, pregunta)
+
+        def leer():
+            estado = planificador.stats()
+            return estado["en_cola"], estado["ocupados"]
+
+    sesiones = []
+    for i in range(args.sessions):
+        clase = "rafaga" if i < args.burst_users else "normal"
+        propias = preguntas[i * args.queries_per_session:(i + 1) * args.queries_per_session]
+        sesiones.append(threading.Thread(
+            target=session, args=(f"sesion-{i}", propias, clase, args, ejecutar, resultados, lock, i)
+        ))
+
+    inicio = time.perf_counter()
+    with Sampler(leer, args.sample_interval) as muestreo:
+        for hilo in sesiones:
+            hilo.start()
+        for hilo in sesiones:
+            hilo.join()
+    segundos = time.perf_counter() - inicio
+
+    resultado = {
+        "modo": modo,
+        "segundos": round(segundos, 3),
+        "rendimiento_qps": round(sum(not r["error"] for r in resultados) / segundos, 2),
+        **summarize(resultados),
+        "normales": summarize(resultados, "normal"),
+        "rafaga": summarize(resultados, "rafaga"),
+        **muestreo.summary(trabajadores),
+    }
+    if planificador:
+        estado = planificador.stats()
+        resultado["espera_cola"] = {
+            "p50_ms": round(estado["espera_p50_s"] * 1000, 3) if estado["espera_p50_s"] is not None else None,
+            "p95_ms": round(estado["espera_p95_s"] * 1000, 3) if estado["espera_p95_s"] is not None else None,
+        }
+        resultado["utilizacion_media"] = estado["utilizacion_media"]
+        planificador.shutdown()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones simultáneas y modelos simulados")
+    parser.add_argument("--sessions", type=int, default=20, help="Sesiones simultáneas")
+    parser.add_argument("--queries-per-session", type=int, default=5)
+    parser.add_argument("--think", type=float, default=2.0, help="Pausa media entre preguntas de una sesión (s)")
+    parser.add_argument("--burst-users", type=int, default=2, help="Sesiones que mandan preguntas en ráfaga")
+    parser.add_argument("--burst-size", type=int, default=5, help="Preguntas simultáneas por ráfaga")
+    parser.add_argument("--modes", default=f"directo,pool:{SERVING_WORKERS}",
+                        help="Modos separados por coma: directo, pool:W")
+    parser.add_argument("--max-queue", type=int, default=SERVING_MAX_QUEUE)
+    parser.add_argument("--max-per-user", type=int, default=SERVING_MAX_PER_USER)
+    parser.add_argument("--chunks", type=int, default=5000, help="Fragmentos del corpus sintético")
+    parser.add_argument("--dims", type=int, default=256, help="Dimensión del embedding simulado")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Segundos por llamada de embedding")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Segundos por llamada al LLM")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Segundos por token en streaming")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="Segundos entre muestras de la cola")
+    parser.add_argument("--output", default="bench_load.json", help="Archivo JSON de resultados")
+    parser.add_argument("--keep", action="store_true", help="Conservar los índices temporales")
+    args = parser.parse_args()
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corridas": [],
+    }
+
+    directorio = tempfile.mkdtemp(prefix="sinergia_carga_")
+    try:
+        embeddings = HashingEmbeddings(dimensions=args.dims, latency=args.embed_latency)
+        vector_store = Chroma(
+            collection_name="carga", embedding_function=embeddings, persist_directory=os.path.join(directorio, "chroma")
+        )
+        bm25 = BM25Index(path=os.path.join(directorio, "bm25.sqlite3"))
+        reporte["ingesta"] = bench_ingest(vector_store, [bm25], args.chunks, args.batch_size)
+        llm = ScriptedChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+        rag = build_rag_system(vector_store, llm, llm, bm25)
+        preguntas = [
+            q["pregunta"] for q in synthetic_queries(args.sessions * args.queries_per_session, args.chunks)
+        ]
+
+        for modo in args.modes.split(","):
+            print(f"--- {modo}: {args.sessions} sesiones ---")
+            resultado = run_mode(modo, rag, preguntas, args)
+            print(json.dumps(resultado, ensure_ascii=False, indent=2))
+            reporte["corridas"].append(resultado)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directorio, ignore_errors=True)
+    reporte["memoria_pico_mb"] = peak_rss_mb()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from langchain_chroma import Chroma
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_chunks, synthetic_queries
+from benchmarks.stand_ins import HashingEmbeddings, ScriptedChatModel
+from bm25_index import BM25Index
+from config import *
+from identifier_index import IdentifierIndex
+from ingest_pipeline import stream_chunks
+from numpy_store import NumpyChroma, NumpyVectorIndex
+from rag_system import build_rag_system
+from vector_quantization import QuantizedChroma, QuantizedVectorStore
+
+
+def percentiles(segundos):
+    """Resumen de latencias en milisegundos"""
+    if not segundos:
+        return {"n": 0}
+    ms = np.asarray(segundos) * 1000
+    return {
+        "n": len(ms),
+        "media_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso (no disponible en Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB; macOS, bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def is_hit(docs, consulta):
+    return any(
+        d.metadata.get("contrato") == consulta["contrato"] and d.metadata.get("tema") == consulta["tema"]
+        for d in docs
+    )
+
+
+def bench_ingest(vector_store, indices, n_chunks, batch_size):
+    """Embedding + upsert en Chroma + índices BM25 e identificadores, en lotes como ingest_docs"""
+    inicio = time.perf_counter()
+    ids, docs = [], []
+    for i, doc in enumerate(synthetic_chunks(n_chunks)):
+        ids.append(f"bench-{i}")
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            vector_store.add_documents(documents=docs, ids=ids)
+            for indice in indices:
+                indice.add(ids, docs)
+            ids, docs = [], []
+    if docs:
+        vector_store.add_documents(documents=docs, ids=ids)
+        for indice in indices:
+            indice.add(ids, docs)
+    segundos = time.perf_counter() - inicio
+    return {
+        "fragmentos": n_chunks,
+        "segundos": round(segundos, 3),
+        "fragmentos_por_s": round(n_chunks / segundos, 1),
+    }
+
+
+def bench_pdf_parse(pdf_dir):
+    """Lectura y fragmentación de PDFs reales con el pipeline paralelo"""
+    archivos = {
+        nombre: os.path.join(pdf_dir, nombre)
+        for nombre in sorted(os.listdir(pdf_dir))
+        if nombre.lower().endswith(".pdf")
+    }
+    inicio = time.perf_counter()
+    fragmentos = sum(len(docs) for _, docs, _ in stream_chunks(archivos))
+    segundos = time.perf_counter() - inicio
+    return {
+        "archivos": len(archivos),
+        "fragmentos": fragmentos,
+        "segundos": round(segundos, 3),
+        "fragmentos_por_s": round(fragmentos / segundos, 1) if segundos else None,
+    }
+
+
+def bench_queries(rag, consultas):
+    recuperacion, extremo, aciertos = [], [], 0
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        state = rag["retrieve"](consulta["pregunta"])
+        recuperacion.append(time.perf_counter() - inicio)
+        aciertos += is_hit(state["docs"], consulta)
+
+        inicio = time.perf_counter()
+        rag["chain"].invoke(consulta["pregunta"])
+        extremo.append(time.perf_counter() - inicio)
+
+    return {
+        "recuperacion": percentiles(recuperacion),
+        "extremo_a_extremo": percentiles(extremo),
+        "tasa_aciertos": round(aciertos / len(consultas), 4) if consultas else None,
+    }
+
+
+def run(n_chunks, args):
+    directorio = tempfile.mkdtemp(prefix=f"sinergia_bench_{n_chunks}_")
+    try:
+        embeddings = HashingEmbeddings(dimensions=args.dims, latency=args.embed_latency)
+        cuantizado = None
+        parametros_chroma = {}
+        if args.quantization:
+            cuantizado = QuantizedVectorStore(path=os.path.join(directorio, "quantized"))
+            parametros_chroma["quantized_store"] = cuantizado
+        matriz = None
+        if args.backend == "numpy":
+            matriz = NumpyVectorIndex(path=os.path.join(directorio, "numpy"), dtype=args.numpy_dtype)
+            parametros_chroma = {"numpy_index": matriz}
+        clase = NumpyChroma if matriz else QuantizedChroma if cuantizado else Chroma
+        vector_store = clase(
+            collection_name="benchmark",
+            embedding_function=embeddings,
+            persist_directory=os.path.join(directorio, "chroma"),
+            **parametros_chroma,
+        )
+        bm25 = BM25Index(path=os.path.join(directorio, "bm25.sqlite3"))
+        identificadores = None
+        if not args.no_identifiers:
+            identificadores = IdentifierIndex(path=os.path.join(directorio, "identifiers.sqlite3"))
+
+        resultado = {"fragmentos": n_chunks}
+        indices = [bm25] + ([identificadores] if identificadores else [])
+        resultado["ingesta"] = bench_ingest(vector_store, indices, n_chunks, args.batch_size)
+        if cuantizado:
+            inicio = time.perf_counter()
+            cuantizado.rebuild(vector_store._collection, quantization=args.quantization)
+            resultado["cuantizacion"] = dict(cuantizado.stats(), segundos=round(time.perf_counter() - inicio, 3))
+        if matriz:
+            inicio = time.perf_counter()
+            matriz.rebuild(vector_store._collection)
+            resultado["indice_numpy"] = dict(matriz.stats(), segundos=round(time.perf_counter() - inicio, 3))
+
+        llm = ScriptedChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+        rag = build_rag_system(vector_store, llm, llm, bm25, identificadores)
+        consultas = list(synthetic_queries(args.queries, n_chunks))
+        resultado.update(bench_queries(rag, consultas))
+        resultado["memoria_pico_mb"] = peak_rss_mb()
+        return resultado
+    finally:
+        if not args.keep:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del sistema RAG con modelos locales")
+    parser.add_argument("--chunks", default="10000",
+                        help="Tamaños de corpus separados por coma (ej. 10000,100000,1000000)")
+    parser.add_argument("--queries", type=int, default=100, help="Consultas por corrida")
+    parser.add_argument("--dims", type=int, default=256, help="Dimensión del embedding simulado")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Segundos por llamada de embedding")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Segundos por llamada al LLM")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Segundos por token en streaming")
+    parser.add_argument("--pdf-dir", default=None, help="Carpeta de PDFs reales para medir lectura y fragmentación")
+    parser.add_argument("--output", default="bench_results.json", help="Archivo JSON de resultados")
+    parser.add_argument("--no-identifiers", action="store_true",
+                        help="Desactivar la ruta directa por identificadores (contrato, cláusula, anexo)")
+    parser.add_argument("--quantization", choices=["int8", "binary"], default=None,
+                        help="Buscar con el índice cuantizado (con reordenamiento float32)")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma",
+                        help="Motor de consulta (numpy: matriz en memoria, ver numpy_store.py)")
+    parser.add_argument("--numpy-dtype", choices=["float32", "float16"], default=NUMPY_INDEX_DTYPE)
+    parser.add_argument("--keep", action="store_true", help="Conservar los índices temporales")
+    args = parser.parse_args()
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corridas": [],
+    }
+    if args.pdf_dir:
+        reporte["lectura_pdf"] = bench_pdf_parse(args.pdf_dir)
+
+    for n_chunks in (int(n) for n in args.chunks.split(",")):
+        print(f"--- Corrida con {n_chunks} fragmentos ---")
+        resultado = run(n_chunks, args)
+        print(json.dumps(resultado, ensure_ascii=False, indent=2))
+        reporte["corridas"].append(resultado)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
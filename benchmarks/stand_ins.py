@@ -0,0 +1,89 @@
+import hashlib
+import math
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from bm25_index import tokenize
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embedding por hashing de tokens (feature hashing con signo), normalizado.
+
+    Textos que comparten vocabulario quedan cerca, lo que basta para medir
+    recuperación de forma reproducible. latency simula el tiempo del API por
+    llamada.
+    """
+
+    def __init__(self, dimensions=256, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            valor = int.from_bytes(digest, "little")
+            signo = 1.0 if valor & 1 else -1.0
+            vector[(valor >> 1) % self.dimensions] += signo
+        norma = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norma for v in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Modelo de chat simulado con latencia configurable.
+
+    Si el prompt pide reformulaciones (MULTI_QUERY_PROMPT) devuelve tres
+    variantes de la consulta; en otro caso devuelve response_text. El
+    streaming emite la respuesta palabra por palabra con token_latency.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    response_text: str = "Respuesta simulada con base en los fragmentos proporcionados."
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "scripted-chat"
+
+    def _respond(self, messages):
+        prompt = messages[-1].content if messages else ""
+        if "Consulta original:" in prompt:
+            consulta = prompt.split("Consulta original:")[1].split("\n")[0].strip()
+            return "\n".join([consulta, f"{consulta} según el contrato", f"{consulta} en los anexos"])
+        return self.response_text
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        for palabra in self._respond(messages).split(" "):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palabra + " "))
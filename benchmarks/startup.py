@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Módulos que app.py importa antes del primer render: no deben cargar dependencias pesadas
+MODULOS_ARRANQUE = ["config", "projects", "clients", "metrics", "ingest_jobs", "document_catalog", "batch_qa", "prompts", "serving"]
+MODULOS_PESADOS = ["chromadb", "langchain_chroma", "langchain_google_genai", "langchain_core", "pandas"]
+
+
+def import_time(modulo):
+    """Importa un módulo en un intérprete limpio y mide el tiempo y las dependencias pesadas cargadas"""
+    codigo = (
+        "import json, sys, time\n"
+        "inicio = time.perf_counter()\n"
+        f"import {modulo}\n"
+        "segundos = time.perf_counter() - inicio\n"
+        f"print(json.dumps({{'segundos': segundos, 'pesados': [m for m in {MODULOS_PESADOS!r} if m in sys.modules]}}))"
+    )
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, capture_output=True, text=True)
+    if salida.returncode != 0:
+        return {"error": salida.stderr.strip().splitlines()[-1] if salida.stderr else "falló"}
+    resultado = json.loads(salida.stdout.strip().splitlines()[-1])
+    resultado["segundos"] = round(resultado["segundos"], 4)
+    return resultado
+
+
+def app_runs(reruns):
+    """Ejecuta app.py con el AppTest de Streamlit: primera ejecución y reruns"""
+    from streamlit.testing.v1 import AppTest
+
+    import clients
+
+    os.chdir(RAIZ)
+    app = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=300)
+    inicio = time.perf_counter()
+    app.run()
+    primera = time.perf_counter() - inicio
+
+    tiempos = []
+    for _ in range(reruns):
+        inicio = time.perf_counter()
+        app.run()
+        tiempos.append(time.perf_counter() - inicio)
+
+    return {
+        "primera_ejecucion_s": round(primera, 4),
+        "rerun_s": round(max(tiempos), 4) if tiempos else None,
+        "clientes_creados": [str(llave) for llave in clients.created_clients()],
+        "excepciones": [str(e.value) for e in app.exception],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo de arranque de la app (importaciones y primer render)")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--max-import-s", type=float, default=0.5,
+                        help="Tiempo máximo de importación de cada módulo de arranque")
+    parser.add_argument("--max-rerun-s", type=float, default=1.0, help="Tiempo máximo de un rerun de la app")
+    parser.add_argument("--check", action="store_true",
+                        help="Terminar con código 1 si se excede algún presupuesto (prueba de regresión)")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    reporte = {
+        "importacion": {modulo: import_time(modulo) for modulo in MODULOS_ARRANQUE + ["rag_system"]},
+        "app": app_runs(args.reruns),
+    }
+    print(json.dumps(reporte, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+
+    fallas = []
+    for modulo in MODULOS_ARRANQUE:
+        medida = reporte["importacion"][modulo]
+        if "error" in medida:
+            fallas.append(f"{modulo}: {medida['error']}")
+            continue
+        if medida["pesados"]:
+            fallas.append(f"{modulo} carga {medida['pesados']} al importarse")
+        if medida["segundos"] > args.max_import_s:
+            fallas.append(f"{modulo} tarda {medida['segundos']}s en importarse (máx. {args.max_import_s}s)")
+    if reporte["app"]["clientes_creados"]:
+        fallas.append(f"El render inicial crea clientes: {reporte['app']['clientes_creados']}")
+    if reporte["app"]["excepciones"]:
+        fallas.append(f"La app lanzó excepciones: {reporte['app']['excepciones']}")
+    if reporte["app"]["rerun_s"] is not None and reporte["app"]["rerun_s"] > args.max_rerun_s:
+        fallas.append(f"Un rerun tarda {reporte['app']['rerun_s']}s (máx. {args.max_rerun_s}s)")
+
+    for falla in fallas:
+        print(f"❌ {falla}")
+    if args.check and fallas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import chromadb
+import numpy as np
+from langchain_chroma import Chroma
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import synthetic_chunks, synthetic_queries
+from benchmarks.run_benchmark import peak_rss_mb, percentiles
+from benchmarks.stand_ins import HashingEmbeddings
+from config import *
+from numpy_store import NumpyChroma, NumpyVectorIndex
+from query_rewrite import local_rewrites
+
+# Compara el motor NumPy (numpy_store.py) con Chroma (HNSW) a igual recall.
+#
+# El corpus sintético se embebe una sola vez y se carga en colecciones Chroma
+# con distintos hnsw:search_ef; el índice NumPy se construye desde la primera
+# en float32 y float16. Para cada motor se mide recall@k frente a la búsqueda
+# exacta y la latencia de una consulta, del lote de reescrituras de una
+# pregunta (original + reescrituras locales) y del MMR de ese lote. Para cada
+# configuración NumPy se reporta el menor search_ef de Chroma que alcanza su
+# recall y las latencias de ambos en ese punto.
+#
+# Uso:
+#     python benchmarks/vector_engines.py --chunks 10000,100000 --queries 200
+
+
+def load_corpus(n_chunks, embeddings, batch_size):
+    """IDs, textos, metadatos y matriz float32 del corpus sintético"""
+    docs = list(synthetic_chunks(n_chunks))
+    ids = [f"bench-{i}" for i in range(n_chunks)]
+    vectores = np.empty((n_chunks, embeddings.dimensions), dtype=np.float32)
+    for inicio in range(0, n_chunks, batch_size):
+        lote = docs[inicio:inicio + batch_size]
+        vectores[inicio:inicio + len(lote)] = embeddings.embed_documents([d.page_content for d in lote])
+    return ids, docs, vectores
+
+
+def load_collection(cliente, nombre, ef, ids, docs, vectores, batch_size):
+    coleccion = cliente.create_collection(nombre, metadata={"hnsw:space": "l2", "hnsw:search_ef": ef})
+    inicio = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        coleccion.upsert(
+            ids=ids[i:i + batch_size],
+            embeddings=vectores[i:i + batch_size].tolist(),
+            documents=[d.page_content for d in docs[i:i + batch_size]],
+            metadatas=[d.metadata for d in docs[i:i + batch_size]],
+        )
+    return coleccion, time.perf_counter() - inicio
+
+
+def exact_top_k(vectores, consultas, k):
+    """Vecinos exactos (l2) calculados en float64: la referencia del recall"""
+    v = vectores.astype(np.float64)
+    q = consultas.astype(np.float64)
+    distancias = (v * v).sum(axis=1)[None, :] - 2 * q @ v.T
+    return np.argsort(distancias, axis=1)[:, :k]
+
+
+def recall(encontrados, referencia, ids):
+    """Fracción media de los k vecinos exactos que devuelve el motor"""
+    aciertos = [
+        len(set(fila) & {ids[j] for j in exactos}) / len(exactos)
+        for fila, exactos in zip(encontrados, referencia)
+    ]
+    return round(float(np.mean(aciertos)), 4)
+
+
+def timed(funcion, argumentos):
+    segundos, resultados = [], []
+    for argumento in argumentos:
+        inicio = time.perf_counter()
+        resultados.append(funcion(argumento))
+        segundos.append(time.perf_counter() - inicio)
+    return percentiles(segundos), resultados
+
+
+def bench_chroma(coleccion, store, consultas, lotes, k, fetch_k, lambda_mult):
+    una, resultados = timed(lambda q: coleccion.query(query_embeddings=[q.tolist()], n_results=k), consultas)
+    lote, _ = timed(lambda l: coleccion.query(query_embeddings=l.tolist(), n_results=k), lotes)
+    # MMR como lo hace hoy la recuperación: una búsqueda por reescritura
+    mmr, _ = timed(
+        lambda l: [
+            store.max_marginal_relevance_search_by_vector(q.tolist(), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult)
+            for q in l
+        ],
+        lotes,
+    )
+    return {"una_consulta": una, "lote_reescrituras": lote, "mmr_lote": mmr}, [r["ids"][0] for r in resultados]
+
+
+def bench_numpy(indice, store, consultas, lotes, k, fetch_k, lambda_mult):
+    una, resultados = timed(lambda q: indice.search(q[None, :], k=k)[0][0], consultas)
+    lote, _ = timed(lambda l: indice.search(l, k=k), lotes)
+    mmr, _ = timed(
+        lambda l: store.batch_max_marginal_relevance_search_by_vector(
+            list(l), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        ),
+        lotes,
+    )
+    fragmentos = indice.chunks(np.concatenate(resultados))
+    encontrados = [[fragmentos[int(f)][0] for f in filas] for filas in resultados]
+    return {"una_consulta": una, "lote_reescrituras": lote, "mmr_lote": mmr}, encontrados
+
+
+def run(n_chunks, args):
+    directorio = tempfile.mkdtemp(prefix=f"sinergia_motores_{n_chunks}_")
+    try:
+        embeddings = HashingEmbeddings(dimensions=args.dims)
+        ids, docs, vectores = load_corpus(n_chunks, embeddings, args.batch_size)
+        preguntas = [q["pregunta"] for q in synthetic_queries(args.queries, n_chunks)]
+        consultas = np.asarray([embeddings.embed_query(p) for p in preguntas], dtype=np.float32)
+        # Lote de una pregunta: la original y sus reescrituras locales
+        lotes = [
+            np.asarray([embeddings.embed_query(t) for t in [p] + local_rewrites(p)], dtype=np.float32)
+            for p in preguntas
+        ]
+        referencia = exact_top_k(vectores, consultas, args.k)
+
+        cliente = chromadb.PersistentClient(path=os.path.join(directorio, "chroma"))
+        resultado = {"fragmentos": n_chunks, "consultas_por_lote": round(float(np.mean([len(l) for l in lotes])), 2)}
+
+        chroma = []
+        for ef in (int(e) for e in args.ef.split(",")):
+            nombre = f"ef_{ef}"
+            coleccion, segundos = load_collection(cliente, nombre, ef, ids, docs, vectores, args.batch_size)
+            store = Chroma(client=cliente, collection_name=nombre, embedding_function=embeddings)
+            latencias, encontrados = bench_chroma(
+                coleccion, store, consultas, lotes, args.k, args.fetch_k, args.lambda_mult
+            )
+            chroma.append({
+                "search_ef": ef, "carga_s": round(segundos, 3),
+                "recall": recall(encontrados, referencia, ids), **latencias,
+            })
+        resultado["chroma"] = chroma
+
+        numpy_ = []
+        for dtype in args.numpy_dtypes.split(","):
+            indice = NumpyVectorIndex(path=os.path.join(directorio, f"numpy_{dtype}"), dtype=dtype)
+            inicio = time.perf_counter()
+            indice.rebuild(cliente.get_collection(f"ef_{chroma[0]['search_ef']}"))
+            construccion = time.perf_counter() - inicio
+            store = NumpyChroma(
+                client=cliente, collection_name=f"ef_{chroma[0]['search_ef']}", embedding_function=embeddings,
+                numpy_index=indice,
+            )
+            latencias, encontrados = bench_numpy(
+                indice, store, consultas, lotes, args.k, args.fetch_k, args.lambda_mult
+            )
+            numpy_.append({
+                "tipo": dtype, "construccion_s": round(construccion, 3), **indice.stats(),
+                "recall": recall(encontrados, referencia, ids), **latencias,
+            })
+        resultado["numpy"] = numpy_
+
+        # Igual recall: el search_ef más bajo con el que Chroma alcanza al motor NumPy
+        comparacion = []
+        for motor in numpy_:
+            alcanzan = [c for c in chroma if c["recall"] >= motor["recall"]]
+            par = min(alcanzan, key=lambda c: c["search_ef"]) if alcanzan else max(chroma, key=lambda c: c["recall"])
+            comparacion.append({
+                "tipo": motor["tipo"],
+                "recall_numpy": motor["recall"],
+                "search_ef": par["search_ef"],
+                "recall_chroma": par["recall"],
+                "alcanza": bool(alcanzan),
+                **{
+                    f"{medida}_p50_ms": {"numpy": motor[medida].get("p50_ms"), "chroma": par[medida].get("p50_ms")}
+                    for medida in ("una_consulta", "lote_reescrituras", "mmr_lote")
+                },
+            })
+        resultado["igual_recall"] = comparacion
+        resultado["memoria_pico_mb"] = peak_rss_mb()
+        return resultado
+    finally:
+        if not args.keep:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Motor NumPy frente a Chroma (HNSW) a igual recall")
+    parser.add_argument("--chunks", default="10000", help="Tamaños de corpus separados por coma")
+    parser.add_argument("--queries", type=int, default=100, help="Preguntas por corrida")
+    parser.add_argument("--dims", type=int, default=256, help="Dimensión del embedding simulado")
+    parser.add_argument("--k", type=int, default=SEARCH_K)
+    parser.add_argument("--fetch-k", type=int, default=MMR_FETCH_K)
+    parser.add_argument("--lambda-mult", type=float, default=MMR_DIVERSITY_LAMBDA)
+    parser.add_argument("--ef", default="10,25,50,100,200", help="Valores de hnsw:search_ef de Chroma")
+    parser.add_argument("--numpy-dtypes", default="float32,float16", help="Tipos de la matriz NumPy")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--output", default="bench_vector_engines.json", help="Archivo JSON de resultados")
+    parser.add_argument("--keep", action="store_true", help="Conservar los índices temporales")
+    args = parser.parse_args()
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corridas": [],
+    }
+    for n_chunks in (int(n) for n in args.chunks.split(",")):
+        print(f"--- Corrida con {n_chunks} fragmentos ---")
+        resultado = run(n_chunks, args)
+        print(json.dumps(resultado["igual_recall"], ensure_ascii=False, indent=2))
+        reporte["corridas"].append(resultado)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
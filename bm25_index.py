@@ -0,0 +1,299 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from config import *
+from projects import project_path
+
+# Palabras vacías del español (sin acentos, tras normalizar)
+STOPWORDS = {
+    "a", "al", "algo", "ante", "antes", "como", "con", "contra", "cual", "cuales", "cuando", "de", "del",
+    "desde", "donde", "durante", "e", "el", "ella", "ellas", "ellos", "en", "entre", "era", "es", "esa",
+    "esas", "ese", "eso", "esos", "esta", "estas", "este", "esto", "estos", "fue", "ha", "han", "hasta",
+    "hay", "la", "las", "le", "les", "lo", "los", "mas", "me", "mi", "mismo", "muy", "ni", "no", "nos",
+    "o", "otra", "otro", "para", "pero", "por", "que", "se", "sea", "segun", "ser", "si", "sin",
+    "sobre", "son", "su", "sus", "tambien", "te", "tiene", "todo", "todos", "u", "un", "una", "uno",
+    "unos", "y", "ya",
+}
+
+# Palabras y identificadores compuestos: LO-09-D00-009D00999-N-46-2025, f'c, 3.1.2
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/.'][a-z0-9]+)*")
+_SEPARATORS_RE = re.compile(r"[-/.']")
+
+
+def strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def stem(token):
+    """Reducción ligera de plurales del español (contratos -> contrato, licitaciones -> licitacion)"""
+    if len(token) > 5 and token.endswith("iones"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def words(text):
+    """Palabras e identificadores compuestos de un texto, en minúsculas y sin acentos"""
+    return _TOKEN_RE.findall(strip_accents(text.lower()))
+
+
+def tokenize(text):
+    """
+    Tokenizador para documentos de obra pública en español.
+
+    Normaliza mayúsculas y acentos, descarta palabras vacías y conserva los
+    identificadores compuestos completos además de sus partes, para que una
+    búsqueda del número de contrato completo o de un segmento funcione igual.
+    """
+    tokens = []
+    for token in words(text):
+        if _SEPARATORS_RE.search(token):
+            tokens.append(token)
+            # Las partes numéricas cortas (09, 46, 2025) se repiten en casi todos
+            # los números de contrato: solo se indexan las que distinguen
+            tokens.extend(
+                p for p in _SEPARATORS_RE.split(token)
+                if len(p) > 1 and p not in STOPWORDS and not (p.isdigit() and len(p) <= 4)
+            )
+        elif token not in STOPWORDS:
+            tokens.append(token if token.isdigit() else stem(token))
+    return tokens
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 persistente en SQLite.
+
+    Se actualiza de forma incremental (add/delete por ID de fragmento) con los
+    mismos IDs que usa Chroma, y responde sin llamar al modelo de embeddings.
+    La frecuencia de documento de cada término y los totales del índice se
+    mantienen al escribir, y cada consulta lee a lo sumo max_postings
+    apariciones por término, así su costo no crece con el corpus.
+    """
+
+    def __init__(self, path=BM25_INDEX_PATH, k1=BM25_K1, b=BM25_B, max_df_ratio=BM25_MAX_DF_RATIO,
+                 max_postings=BM25_MAX_POSTINGS):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.max_postings = max_postings
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                chunk_id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(chunk_id);
+            CREATE INDEX IF NOT EXISTS idx_postings_impact ON postings(term, tf DESC, chunk_id);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                docs INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            """
+        )
+        # Índices creados antes de mantener los totales: se calculan una vez
+        if self._conn.execute("SELECT COUNT(*) FROM totals").fetchone()[0] == 0:
+            self._conn.execute("INSERT INTO totals SELECT 0, COUNT(*), COALESCE(SUM(length), 0) FROM docs")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("INSERT INTO terms SELECT term, COUNT(*) FROM postings GROUP BY term")
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT docs FROM totals").fetchone()[0]
+
+    def add(self, ids, docs):
+        """Inserta o reemplaza fragmentos en el índice"""
+        with self._lock:
+            self._delete(ids)
+            filas_docs, filas_postings = [], []
+            for chunk_id, doc in zip(ids, docs):
+                frecuencias = Counter(tokenize(doc.page_content))
+                filas_docs.append((
+                    chunk_id,
+                    sum(frecuencias.values()),
+                    doc.page_content,
+                    json.dumps(doc.metadata, ensure_ascii=False),
+                ))
+                filas_postings.extend((term, chunk_id, tf) for term, tf in frecuencias.items())
+            self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", filas_docs)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", filas_postings)
+            self._conn.executemany(
+                "INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                Counter(term for term, _, _ in filas_postings).items(),
+            )
+            self._conn.execute(
+                "UPDATE totals SET docs = docs + ?, length = length + ?",
+                (len(filas_docs), sum(fila[1] for fila in filas_docs)),
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _delete(self, ids):
+        terminos = Counter()
+        borrados = longitud = 0
+        for chunk_id in ids:
+            fila = self._conn.execute("SELECT length FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if fila is None:
+                continue
+            borrados += 1
+            longitud += fila[0]
+            terminos.update(term for term, in self._conn.execute(
+                "SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)
+            ))
+        if borrados:
+            self._conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(n, t) for t, n in terminos.items()])
+            self._conn.execute("DELETE FROM terms WHERE df <= 0")
+            self._conn.execute("UPDATE totals SET docs = docs - ?, length = length - ?", (borrados, longitud))
+        self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(i,) for i in ids])
+        self._conn.executemany("DELETE FROM docs WHERE chunk_id = ?", [(i,) for i in ids])
+
+    def delete_source(self, source, keep=()):
+        """Elimina los fragmentos de un archivo salvo keep (para ingestas sin IDs conocidos)"""
+        with self._lock:
+            ids = [
+                fila[0] for fila in self._conn.execute(
+                    "SELECT chunk_id FROM docs WHERE json_extract(metadata, '$.source') = ?", (source,)
+                )
+                if fila[0] not in keep
+            ]
+            self._delete(ids)
+            self._conn.commit()
+
+    def search(self, query, k=SEARCH_K, sources=None):
+        """
+        Devuelve [(chunk_id, puntaje)] de los k fragmentos con mayor puntaje
+        BM25; con sources, solo entre los fragmentos de esos archivos (el idf
+        sigue siendo el de todo el índice). Los términos presentes en más de
+        max_df_ratio de los fragmentos casi no distinguen y no se consultan;
+        de cada término se leen las max_postings apariciones de mayor
+        frecuencia.
+        """
+        terminos = sorted(set(tokenize(query)))
+        if not terminos:
+            return []
+
+        with self._lock:
+            n_docs, longitud_total = self._conn.execute("SELECT docs, length FROM totals").fetchone()
+            if not n_docs:
+                return []
+            avgdl = longitud_total / n_docs
+
+            frecuencias = dict(self._conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(terminos))})", terminos
+            ).fetchall())
+            filtro = ""
+            if sources:
+                filtro = f" AND json_extract(d.metadata, '$.source') IN ({','.join('?' * len(sources))})"
+            # Si todos son comunes, se consulta solo el menos frecuente
+            por_frecuencia = sorted(frecuencias.items(), key=lambda item: item[1])
+            consultados = [
+                (term, frecuencia) for term, frecuencia in por_frecuencia if frecuencia <= self.max_df_ratio * n_docs
+            ] or por_frecuencia[:1]
+            puntajes = Counter()
+            for term, frecuencia in consultados:
+                filas = self._conn.execute(
+                    "SELECT p.chunk_id, p.tf, d.length FROM postings p "
+                    "JOIN docs d ON d.chunk_id = p.chunk_id WHERE p.term = ?" + filtro +
+                    " ORDER BY p.tf DESC LIMIT ?",
+                    (term, *(sources or ()), self.max_postings),
+                ).fetchall()
+                idf = math.log(1 + (n_docs - frecuencia + 0.5) / (frecuencia + 0.5))
+                for chunk_id, tf, length in filas:
+                    norma = tf + self.k1 * (1 - self.b + self.b * length / avgdl)
+                    puntajes[chunk_id] += idf * tf * (self.k1 + 1) / norma
+
+        return puntajes.most_common(k)
+
+    def get_documents(self, ids):
+        """Recupera los fragmentos por ID conservando el orden recibido"""
+        if not ids:
+            return []
+        with self._lock:
+            marcadores = ",".join("?" * len(ids))
+            filas = self._conn.execute(
+                f"SELECT chunk_id, content, metadata FROM docs WHERE chunk_id IN ({marcadores})", list(ids)
+            ).fetchall()
+        por_id = {
+            chunk_id: Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+            for chunk_id, content, metadata in filas
+        }
+        return [por_id[i] for i in ids if i in por_id]
+
+
+class BM25Retriever(BaseRetriever):
+    """Retriever léxico sobre BM25Index, compatible con EnsembleRetriever"""
+
+    index: BM25Index
+    k: int = SEARCH_K
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        puntajes = dict(self.index.search(query, k=self.k))
+        docs = self.index.get_documents(list(puntajes))
+        for doc in docs:
+            doc.metadata["bm25_score"] = round(puntajes[doc.id], 4)
+        return docs
+
+
+def backfill_from_chroma(index, vector_store, batch_size=1000):
+    """Construye el índice a partir de una colección Chroma existente"""
+    offset = 0
+    while True:
+        lote = vector_store.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not lote["ids"]:
+            break
+        docs = [
+            Document(page_content=texto or "", metadata=metadata or {})
+            for texto, metadata in zip(lote["documents"], lote["metadatas"])
+        ]
+        index.add(lote["ids"], docs)
+        offset += len(lote["ids"])
+    return offset
+
+
+_shared_indices = {}
+_shared_lock = threading.Lock()
+
+
+def get_bm25_index(project=PROJECT_DEFAULT):
+    """Índice BM25 de un proyecto, compartido por la ingesta y las consultas"""
+    with _shared_lock:
+        if project not in _shared_indices:
+            _shared_indices[project] = BM25Index(path=project_path(BM25_INDEX_PATH, project))
+        return _shared_indices[project]
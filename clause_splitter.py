@@ -0,0 +1,183 @@
+import re
+from bisect import bisect_right
+from itertools import groupby
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import *
+
+# Fragmentación por estructura de los contratos de obra pública: los cortes se
+# hacen en los encabezados (CLÁUSULA, ANEXO, DECLARACIONES, secciones
+# numeradas) y solo las piezas que exceden CHUNK_SIZE se cortan por tamaño.
+# Lo importan los procesos del pool de ingesta: no debe cargar nada pesado.
+
+# Metadatos de estructura que se agregan a cada fragmento (solo si se conocen)
+STRUCTURE_KEYS = ("apartado", "clausula", "seccion")
+
+# Firma de las ingestas previas a CHUNK_STRATEGY (manifiestos sin "fragmentacion")
+LEGACY_CHUNKING = "caracteres-1200-200"
+
+_RAIZ = (
+    r"(?:PRIMER|SEGUND|TERCER|CUART|QUINT|SEXT|S[EÉ]PTIM|OCTAV|NOVEN|D[EÉ]CIM|UND[EÉ]CIM|DUOD[EÉ]CIM"
+    r"|VIG[EÉ]SIM|TRIG[EÉ]SIM|CUADRAG[EÉ]SIM|[UÚ]NIC)[AO]?"
+)
+_ORDINAL = rf"{_RAIZ}(?:[ \t-]*{_RAIZ})*(?:[ \t]+BIS)?"
+
+# (tipo, patrón) en orden de prioridad cuando dos coinciden en la misma línea.
+# Todos exigen inicio de línea; las cláusulas además un signo después del
+# ordinal, para no cortar en referencias como "conforme a la cláusula décima de".
+_ENCABEZADOS = [
+    ("clausula", re.compile(
+        rf"^[ \t]*CL[AÁ]USULA[ \t]+(?P<etiqueta>{_ORDINAL}|\d{{1,3}})[ \t]*(?:[.:\-–—]|$)", re.I | re.M
+    )),
+    # "PRIMERA.- OBJETO DEL CONTRATO" (sin la palabra cláusula, solo en mayúsculas)
+    ("clausula", re.compile(rf"^[ \t]*(?P<etiqueta>{_ORDINAL})[ \t]*(?:\.[ \t]*[-–—]|[-–—:])", re.M)),
+    ("apartado", re.compile(
+        r"^[ \t]*(?P<etiqueta>ANEXO[ \t]+[A-Z0-9]+(?:[.\-][A-Z0-9]+)*|DECLARACIONES|ANTECEDENTES|CL[AÁ]USULAS"
+        r"|CAP[IÍ]TULO[ \t]+[IVXLC\d]+|T[IÍ]TULO[ \t]+[IVXLC\d]+)\b", re.M
+    )),
+    # "3.2 ESPECIFICACIONES PARTICULARES": número y al menos una palabra en mayúsculas
+    ("seccion", re.compile(r"^[ \t]*(?P<etiqueta>\d{1,2}(?:\.\d{1,2}){0,3})\.?[ \t]+(?=[A-ZÁÉÍÓÚÑ]{3})", re.M)),
+]
+
+
+def _advance(estado, tipo, etiqueta):
+    """Estado de estructura después de un encabezado"""
+    if tipo == "apartado":
+        return {"apartado": etiqueta}
+    if tipo == "clausula":
+        return {**{k: v for k, v in estado.items() if k == "apartado"}, "clausula": etiqueta}
+    return {**{k: v for k, v in estado.items() if k != "seccion"}, "seccion": etiqueta}
+
+
+def _group(estado):
+    # Las secciones numeradas de una misma cláusula pueden compartir fragmento
+    return estado.get("apartado"), estado.get("clausula")
+
+
+def _bare_heading(pieza):
+    # Una sola línea sin minúsculas: "CLÁUSULA SEGUNDA.- MONTO DEL CONTRATO"
+    pieza = pieza.strip()
+    return "\n" not in pieza and not any(c.islower() for c in pieza)
+
+
+class ClauseTextSplitter:
+    """
+    Divide el texto en los encabezados legales y agrupa las piezas contiguas
+    de una misma cláusula hasta chunk_size; una pieza mayor se corta con
+    RecursiveCharacterTextSplitter (con solapamiento solo dentro de ella).
+    Las piezas menores que min_size se unen a la siguiente de la misma
+    cláusula; si son solo un encabezado, también a la de otra cláusula.
+
+    split_documents fragmenta juntas las páginas consecutivas de una misma
+    fuente, para no cortar una cláusula en el salto de página: cada fragmento
+    lleva los metadatos de la página donde empieza y start_index relativo al
+    texto unido. El último estado de cada fuente queda en states, para
+    continuar en la siguiente llamada.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, min_size=CHUNK_MIN_SIZE):
+        self.chunk_size = chunk_size
+        self.min_size = min_size
+        self._por_tamano = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+        self.states = {}
+
+    def _headings(self, text):
+        marcas = {}
+        for tipo, patron in _ENCABEZADOS:
+            for match in patron.finditer(text):
+                etiqueta = " ".join(match.group("etiqueta").upper().split())
+                marcas.setdefault(match.start(), (tipo, etiqueta))
+        return sorted(marcas.items())
+
+    def split_with_state(self, text, estado=None):
+        """
+        Devuelve ([(inicio, texto, estado)], estado_final). inicio es la
+        posición del fragmento en text (como start_index).
+        """
+        estado = dict(estado or {})
+        marcas = self._headings(text)
+        limites = [0] + [inicio for inicio, _ in marcas if inicio > 0] + [len(text)]
+        por_inicio = dict(marcas)
+
+        piezas = []
+        for inicio, fin in zip(limites, limites[1:]):
+            if inicio in por_inicio:
+                estado = _advance(estado, *por_inicio[inicio])
+            if not text[inicio:fin].strip():
+                continue
+            previa = piezas[-1] if piezas else None
+            suelta = previa is not None and previa[1] - previa[0] < self.min_size
+            if previa and _group(previa[2]) == _group(estado) and (suelta or fin - previa[0] <= self.chunk_size):
+                previa[1] = fin
+            elif suelta and _bare_heading(text[previa[0]:previa[1]]):
+                # Un encabezado sin cuerpo toma la estructura de lo que sigue;
+                # una cláusula breve pero completa conserva la suya
+                previa[2] = estado
+                previa[1] = fin
+            else:
+                piezas.append([inicio, fin, estado])
+
+        fragmentos = []
+        for inicio, fin, estado_pieza in piezas:
+            pieza = text[inicio:fin]
+            if len(pieza) > self.chunk_size:
+                for doc in self._por_tamano.create_documents([pieza]):
+                    fragmentos.append((inicio + doc.metadata["start_index"], doc.page_content, estado_pieza))
+                continue
+            recorte = len(pieza) - len(pieza.lstrip())
+            fragmentos.append((inicio + recorte, pieza.strip(), estado_pieza))
+        return fragmentos, estado
+
+    def split_text(self, text):
+        return [texto for _, texto, _ in self.split_with_state(text)[0]]
+
+    def split_documents(self, documents):
+        fragmentos = []
+        for fuente, paginas in groupby(documents, key=lambda doc: doc.metadata.get("source")):
+            paginas = list(paginas)
+            inicios, posicion = [], 0
+            for pagina in paginas:
+                inicios.append(posicion)
+                posicion += len(pagina.page_content) + 1
+            texto = "\n".join(pagina.page_content for pagina in paginas)
+            piezas, self.states[fuente] = self.split_with_state(texto, self.states.get(fuente))
+            for inicio, contenido, estado in piezas:
+                pagina = paginas[bisect_right(inicios, inicio) - 1]
+                fragmentos.append(Document(
+                    page_content=contenido, metadata={**pagina.metadata, "start_index": inicio, **estado}
+                ))
+        return fragmentos
+
+
+def get_text_splitter(strategy=CHUNK_STRATEGY, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Fragmentador de la ingesta: "clausulas" (por estructura) o "caracteres" (solo por tamaño)"""
+    if strategy == "clausulas":
+        return ClauseTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if strategy == "caracteres":
+        # start_index permite unir fragmentos contiguos al armar el contexto
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+    raise ValueError(f"CHUNK_STRATEGY desconocida: {strategy!r} (usa 'clausulas' o 'caracteres')")
+
+
+def chunking_signature(strategy=CHUNK_STRATEGY, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Firma de la configuración de fragmentación; si cambia, la ingesta vuelve a fragmentar todo"""
+    firma = f"{strategy}-{chunk_size}-{chunk_overlap}"
+    return f"{firma}-{CHUNK_MIN_SIZE}" if strategy == "clausulas" else firma
+
+
+def inherit_structure(docs, estado):
+    """
+    Los fragmentos iniciales de un rango de páginas (antes de su primer
+    encabezado) toman el estado con el que terminó el rango anterior.
+    """
+    for doc in docs:
+        if any(clave in doc.metadata for clave in STRUCTURE_KEYS):
+            break
+        doc.metadata.update(estado or {})
+    return docs
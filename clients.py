@@ -0,0 +1,98 @@
+import threading
+
+from config import *
+from projects import collection_name, project_of_collection
+
+# Registro de clientes pesados compartidos por todo el proceso (app, rag_system,
+# scripts de verificación). Se crean la primera vez que se piden: importar este
+# módulo no carga Chroma ni LangChain.
+_registry = {}
+_registry_lock = threading.RLock()
+
+
+def _shared(llave, crear):
+    with _registry_lock:
+        if llave not in _registry:
+            _registry[llave] = crear()
+        return _registry[llave]
+
+
+def created_clients():
+    """Llaves de los clientes ya creados (para diagnóstico y pruebas de arranque)"""
+    with _registry_lock:
+        return list(_registry)
+
+
+def reset_clients():
+    """Descarta los clientes creados (p. ej. tras reemplazar la colección)"""
+    with _registry_lock:
+        _registry.clear()
+
+
+def get_chroma_client():
+    def crear():
+        import chromadb
+        return chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return _shared("chroma_client", crear)
+
+
+def open_vector_store(embedding_function, collection_name=None, quantized=False, numpy=False):
+    """
+    Vector store sobre el cliente Chroma compartido. No se guarda en el
+    registro: lo usan la ingesta (con su programador de embeddings) y las
+    colecciones temporales. Con numpy las consultas usan el índice NumPy
+    del proyecto (tiene prioridad sobre quantized).
+    """
+    parametros = {"client": get_chroma_client(), "embedding_function": embedding_function}
+    if collection_name:
+        parametros["collection_name"] = collection_name
+    if numpy:
+        from numpy_store import NumpyChroma, get_numpy_index
+        proyecto = project_of_collection(collection_name or DEFAULT_COLLECTION_NAME) or PROJECT_DEFAULT
+        return NumpyChroma(**parametros, numpy_index=get_numpy_index(proyecto))
+    if quantized:
+        from vector_quantization import QuantizedChroma, get_quantized_store
+        proyecto = project_of_collection(collection_name or DEFAULT_COLLECTION_NAME) or PROJECT_DEFAULT
+        return QuantizedChroma(**parametros, quantized_store=get_quantized_store(proyecto))
+    from langchain_chroma import Chroma
+    return Chroma(**parametros)
+
+
+def get_vector_store(project=PROJECT_DEFAULT):
+    """
+    Vector store de consultas de un proyecto (embeddings con caché; motor
+    NumPy si VECTOR_BACKEND es "numpy", cuantizado si VECTOR_QUANTIZATION)
+    """
+    def crear():
+        from embeddings_cache import get_embeddings
+        return open_vector_store(
+            get_embeddings(), collection_name=collection_name(project), quantized=bool(VECTOR_QUANTIZATION),
+            numpy=VECTOR_BACKEND == "numpy",
+        )
+    return _shared(("vector_store", project), crear)
+
+
+def indexed_projects():
+    """Proyectos con colección en Chroma (se consulta al cliente en cada llamada)"""
+    nombres = [getattr(coleccion, "name", coleccion) for coleccion in get_chroma_client().list_collections()]
+    return sorted(proyecto for proyecto in map(project_of_collection, nombres) if proyecto)
+
+
+def get_chat_model(model, **kwargs):
+    def crear():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=model, **kwargs)
+    return _shared(("chat", model, tuple(sorted(kwargs.items()))), crear)
+
+
+def get_query_llm():
+    return get_chat_model(
+        QUERY_MODEL,
+        temperature=0,
+        max_retries=10,  # Aumenta los reintentos
+        timeout=60,  # Espera más tiempo
+    )
+
+
+def get_generation_llm():
+    return get_chat_model(GENERATION_MODEL, temperature=0)
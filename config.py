@@ -12,6 +12,9 @@ CONTRATOS_PATH = os.path.join(BASE_DIR, "contratos")
 # Configuración de modelos GOOGLE
 EMBEDDING_MODEL = "gemini-embedding-001"
 #EMBEDDING_MODEL = "models/embedding-001"
+# Dimensión de salida del embedding (None = 3072, la del modelo; 768 o 1536 reducen
+# el índice). Al cambiarla hay que migrar la colección: python migrate_vectors.py
+EMBEDDING_DIMENSIONS = None
 QUERY_MODEL = "gemini-flash-latest"
 GENERATION_MODEL = "gemini-flash-latest"
 
@@ -23,12 +26,158 @@ GENERATION_MODEL = "gemini-flash-latest"
 # Configuración del vector store
 CHROMA_DB_PATH = "./chroma_db"
 
+# Colecciones por proyecto: cada subcarpeta de contratos/ es un proyecto con su
+# propia colección (e índices BM25 y cuantizado). Los PDF sueltos en contratos/
+# pertenecen al proyecto general, que conserva la colección histórica.
+PROJECT_DEFAULT = "general"
+DEFAULT_COLLECTION_NAME = "langchain"  # colección por defecto de langchain_chroma
+PROJECT_COLLECTION_PREFIX = "proyecto_"
+PROJECT_SEARCH_WORKERS = 8  # búsquedas simultáneas en colecciones de distintos proyectos
+
+# Índice cuantizado en memoria con reordenamiento a precisión completa
+VECTOR_QUANTIZATION = None  # None, "int8" o "binary"
+QUANTIZED_INDEX_PATH = os.path.join(CHROMA_DB_PATH, "quantized")
+QUANTIZATION_RESCORE_FACTOR = 4  # candidatos por resultado que se reordenan con float32
+
+# Motor de consulta: "chroma" (HNSW) o "numpy" (matriz de embeddings en memoria,
+# búsqueda exacta por lotes; ver numpy_store.py). La ingesta siempre escribe en
+# Chroma y el índice NumPy se reconstruye a partir de la colección.
+VECTOR_BACKEND = "chroma"
+NUMPY_INDEX_PATH = os.path.join(CHROMA_DB_PATH, "numpy_index")
+NUMPY_INDEX_DTYPE = "float32"  # "float32" o "float16" (la mitad de memoria)
+NUMPY_BLOCK_ROWS = 65536  # filas por bloque del producto matricial
+
+# Manifiesto de ingesta incremental (hashes por archivo y fragmento)
+INGEST_MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, "ingest_manifest.json")
+
+# Catálogo de documentos (estado de indexación por archivo) e inventario exportable
+DOCUMENT_CATALOG_PATH = os.path.join(CHROMA_DB_PATH, "document_catalog.sqlite3")
+DOCUMENT_CATALOG_EXPORT_PATH = os.path.join(CHROMA_DB_PATH, "inventario_documental.csv")
+DOCUMENT_CATALOG_PAGE_SIZE = 100  # filas por página en la pestaña Archivo Documental
+
+# Colecciones temporales donde se embebe antes de publicar en la principal
+STAGING_COLLECTION_PREFIX = "staging_"
+
+# Cola persistente de trabajos de ingesta en segundo plano
+INGEST_JOBS_PATH = os.path.join(CHROMA_DB_PATH, "ingest_jobs.sqlite3")
+INGEST_WORKER_IN_APP = True  # False si se ejecuta aparte: python ingest_jobs.py
+INGEST_JOB_HEARTBEAT = 10  # segundos entre latidos del worker que procesa un trabajo
+INGEST_JOB_LEASE = 60  # sin latido durante este tiempo, el trabajo se considera interrumpido
+
+# Versión del índice (se incrementa con cada ingesta que modifica la colección)
+INDEX_VERSION_PATH = os.path.join(CHROMA_DB_PATH, "index_version")
+
+# Caché persistente de embeddings (SQLite, desalojo LRU)
+EMBEDDING_CACHE_PATH = os.path.join(CHROMA_DB_PATH, "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# Configuración de la ingesta
+# Fragmentación única para la ingesta y vectorstores.py: "clausulas" corta en los
+# encabezados de los contratos (CLÁUSULA, ANEXO, secciones numeradas) y solo por
+# tamaño dentro de una cláusula larga; "caracteres" corta solo por tamaño. Al
+# cambiar la estrategia o los tamaños la siguiente ingesta vuelve a fragmentar
+# todos los archivos (ver clause_splitter.chunking_signature).
+CHUNK_STRATEGY = "clausulas"
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+CHUNK_MIN_SIZE = 100  # piezas menores (encabezados sueltos) se unen a la siguiente
+INGEST_WORKERS = os.cpu_count() or 1  # procesos para leer y fragmentar PDFs
+INGEST_PAGES_PER_TASK = 25  # páginas por tarea enviada al pool
+INGEST_BATCH_SIZE = 500  # fragmentos por lote enviado a embedding y a Chroma
+
+# Programador de embeddings (lotes concurrentes con cuota de tokens por minuto)
+EMBED_BATCH_SIZE = 100  # textos por solicitud al API
+EMBED_MAX_CONCURRENCY = 4  # solicitudes simultáneas
+EMBED_TOKENS_PER_MINUTE = 1_000_000  # None para desactivar el límite
+EMBED_MAX_RETRIES = 8
+
+# Empaquetado del contexto (une fragmentos solapados y descarta duplicados)
+CONTEXT_TOKEN_BUDGET = 4000  # tokens máximos de fragmentos en el prompt
+CONTEXT_DEDUP_SIMILARITY = 0.9  # fracción de n-gramas compartidos para considerar duplicado
+
 # Configuración del retriever
 SEARCH_TYPE = "mmr"
 MMR_DIVERSITY_LAMBDA = 0.7
 MMR_FETCH_K = 20
 SEARCH_K = 4
 
+# Recuperación asíncrona multi-consulta con presupuesto de latencia
+ENABLE_ASYNC_RETRIEVAL = True
+REWRITE_BUDGET = 3.0  # segundos máximos para las reescrituras del LLM de consultas
+RETRIEVAL_DEADLINE = 8.0  # segundos máximos para toda la recuperación
+
+# Reescritura de consultas: "llm" (MULTI_QUERY_PROMPT), "local" (tabla de
+# sinónimos REWRITE_SYNONYMS) o "auto" (LLM con respaldo local si el
+# presupuesto es corto, excede el tiempo o se agota la cuota)
+REWRITE_MODE = "auto"
+REWRITE_COUNT = 3  # reescrituras locales por consulta (las mismas que pide el prompt)
+REWRITE_MIN_LLM_BUDGET = 1.0  # con menos segundos de presupuesto se usa la tabla local
+REWRITE_LLM_COOLDOWN = 60  # segundos sin llamar al LLM tras un fallo o exceso de tiempo
+REWRITE_CACHE_PATH = os.path.join(CHROMA_DB_PATH, "rewrite_cache.sqlite3")
+REWRITE_CACHE_MAX_ENTRIES = 5000
+
+# Servicio de consultas (serving.py): pool acotado de workers compartido por todas
+# las sesiones, con una cola por usuario atendida en turno rotativo. La espera
+# en cola y la saturación se ven en la pestaña Monitor y con
+# python benchmarks/load_test.py
+SERVING_ENABLED = True
+SERVING_WORKERS = max(4, 2 * (os.cpu_count() or 1))  # consultas simultáneas (esperan sobre todo al LLM)
+SERVING_MAX_QUEUE = 200  # consultas en espera; más allá se rechazan
+SERVING_MAX_PER_USER = 5  # consultas en espera de una misma sesión
+SERVING_POLL_SECONDS = 0.5  # cada cuánto se informa la posición en la cola
+SERVING_STATS_WINDOW = 500  # consultas recientes para los percentiles de espera
+
+# Revisión por lotes (batch_qa.py): lista de preguntas × documentos
+BATCH_QA_PATH = os.path.join(CHROMA_DB_PATH, "batch_qa.sqlite3")
+BATCH_QA_CONCURRENCY = 8  # generaciones simultáneas (acotadas por la cuota del LLM)
+BATCH_QA_EXPORT_DIR = os.path.join(CHROMA_DB_PATH, "revisiones")
+
 # Configuración alternativa para retriever híbrido
 ENABLE_HYBRID_SEARCH = True
-SIMILARITY_THRESHOLD = 0.70
\ No newline at end of file
+SIMILARITY_THRESHOLD = 0.70
+
+# Índice léxico BM25 (rama léxica de la búsqueda híbrida)
+BM25_INDEX_PATH = os.path.join(CHROMA_DB_PATH, "bm25_index.sqlite3")
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_WEIGHT = 0.3  # peso de BM25 en el EnsembleRetriever (MMR recibe el resto)
+BM25_MAX_DF_RATIO = 0.5  # términos presentes en más fragmentos que esta fracción no se consultan
+BM25_MAX_POSTINGS = 2000  # apariciones leídas por término en cada consulta (las de mayor frecuencia)
+
+# Índice de identificadores (contratos, cláusulas, anexos, montos) con ruta directa
+ENABLE_IDENTIFIER_ROUTING = True
+IDENTIFIER_INDEX_PATH = os.path.join(CHROMA_DB_PATH, "identifiers.sqlite3")
+IDENTIFIER_MAX_CANDIDATES = 500  # fragmentos máximos a ordenar por similitud en la ruta directa
+
+# Índice de documentos (document_index.py): por archivo, el centroide de sus
+# embeddings, un resumen y campos clave. La búsqueda elige primero los
+# DOCUMENT_TOP_N documentos más parecidos a la pregunta y hace MMR solo dentro
+# de sus fragmentos; "¿de qué trata el contrato X?" se responde con el resumen.
+ENABLE_DOCUMENT_ROUTING = True
+DOCUMENT_INDEX_PATH = os.path.join(CHROMA_DB_PATH, "documents.sqlite3")
+DOCUMENT_TOP_N = 5  # documentos en los que se busca tras la etapa gruesa
+DOCUMENT_ROUTING_MIN_DOCS = 20  # con menos documentos candidatos se busca en todos
+DOCUMENT_SUMMARIES = True  # resúmenes con el LLM de consultas (si no, extractivos)
+DOCUMENT_SUMMARY_MAX_CHARS = 12000  # texto inicial del documento que recibe el LLM
+DOCUMENT_SUMMARY_CONCURRENCY = 4  # resúmenes simultáneos durante la ingesta
+DOCUMENT_SUMMARY_ANSWERS = True  # responder con el resumen sin recuperación ni generación
+
+# Caché de respuestas (exacta + semántica) delante de query_rag
+ENABLE_ANSWER_CACHE = True
+ANSWER_CACHE_PATH = os.path.join(CHROMA_DB_PATH, "answer_cache.sqlite3")
+ANSWER_CACHE_TTL = 24 * 60 * 60  # segundos
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_SIMILARITY = 0.95  # similitud coseno mínima para reutilizar una respuesta
+
+# Historial de eventos (pestaña Monitor de Sistema): rotación por tamaño y por
+# antigüedad, archivos rotados comprimidos e índice por nivel y fecha
+LOG_PATH = os.path.join("logs", "historial_db.log")
+LOG_INDEX_PATH = os.path.join("logs", "historial_db.index.sqlite3")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_MAX_AGE = 24 * 60 * 60  # segundos
+LOG_BACKUP_COUNT = 30  # archivos .gz que se conservan
+
+# Trazas y métricas por etapa (pestaña Monitor de Sistema)
+ENABLE_METRICS = True
+METRICS_DB_PATH = os.path.join("logs", "metricas.sqlite3")
+METRICS_MAX_TRACES = 5000
@@ -0,0 +1,137 @@
+import re
+
+from langchain_core.documents import Document
+
+from config import *
+from embedding_batcher import estimate_tokens
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+
+# Solapamiento mínimo (en caracteres) para unir dos fragmentos sin start_index
+MIN_TEXT_OVERLAP = 40
+
+
+def _shingles(text, n=3):
+    """Conjunto de n-gramas de palabras, para comparar textos casi idénticos"""
+    palabras = _PALABRA.findall(text.lower())
+    if len(palabras) < n:
+        return {tuple(palabras)} if palabras else set()
+    return {tuple(palabras[i:i + n]) for i in range(len(palabras) - n + 1)}
+
+
+def _text_overlap(a, b, max_overlap=CHUNK_OVERLAP * 2):
+    """Longitud del sufijo de a que coincide con el prefijo de b (0 si no se solapan)"""
+    for k in range(min(len(a), len(b), max_overlap), MIN_TEXT_OVERLAP - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+class _Block:
+    """Texto contiguo de una misma fuente y página, formado por uno o varios fragmentos"""
+
+    def __init__(self, doc, rank):
+        self.metadata = dict(doc.metadata or {})
+        self.rank = rank
+        self.parts = 1
+        self.start = doc.metadata.get("start_index") if doc.metadata else None
+        self.end = self.start + len(doc.page_content) if self.start is not None else None
+        # Con start_index se conserva el texto original para que los cortes coincidan
+        self.text = doc.page_content if self.start is not None else doc.page_content.strip()
+
+    def key(self):
+        return self.metadata.get("source"), self.metadata.get("page")
+
+    def try_merge(self, doc):
+        """Une doc al bloque si se solapa o es contiguo; devuelve True si lo hizo"""
+        texto = doc.page_content.strip()
+        inicio = doc.metadata.get("start_index")
+
+        if self.start is not None and inicio is not None:
+            fin = inicio + len(doc.page_content)
+            if inicio >= self.start and inicio <= self.end:
+                if fin > self.end:
+                    self.text += doc.page_content[self.end - inicio:]
+                    self.end = fin
+            elif inicio < self.start and fin >= self.start:
+                self.text = doc.page_content[:self.start - inicio] + self.text
+                self.start = inicio
+                self.end = max(self.end, fin)
+            else:
+                return False
+        else:
+            # Índices anteriores sin start_index: se detecta el solapamiento en el texto
+            if texto in self.text:
+                pass
+            elif self.text in texto:
+                self.text = texto
+            elif (k := _text_overlap(self.text, texto)):
+                self.text += texto[k:]
+            elif (k := _text_overlap(texto, self.text)):
+                self.text = texto + self.text[k:]
+            else:
+                return False
+
+        self.parts += 1
+        return True
+
+
+def pack_documents(docs, token_budget=CONTEXT_TOKEN_BUDGET, similarity=CONTEXT_DEDUP_SIMILARITY):
+    """
+    Prepara los documentos recuperados para el prompt.
+
+    1. Une fragmentos solapados o contiguos de la misma fuente y página.
+    2. Descarta bloques casi duplicados (contenidos en otro de mayor relevancia).
+    3. Llena el presupuesto de tokens en orden de relevancia (el de los docs).
+
+    Cada bloque conserva la fuente y página de sus fragmentos, de modo que las
+    citas siguen siendo válidas.
+    """
+    bloques = []
+    for rank, doc in enumerate(docs):
+        if not doc.page_content.strip():
+            continue
+        candidato = _Block(doc, rank)
+        destino = next(
+            (b for b in bloques
+             if candidato.key()[0] is not None and b.key() == candidato.key() and b.try_merge(doc)),
+            None,
+        )
+        if destino is None:
+            bloques.append(candidato)
+
+    unicos = []
+    firmas = []
+    for bloque in sorted(bloques, key=lambda b: b.rank):
+        bloque.text = bloque.text.strip()
+        firma = _shingles(bloque.text)
+        duplicado = any(
+            firma and len(firma & otra) / len(firma) >= similarity
+            for otra in firmas
+        )
+        if not duplicado:
+            unicos.append(bloque)
+            firmas.append(firma)
+
+    empaquetados = []
+    restantes = token_budget
+    for bloque in unicos:
+        tokens = estimate_tokens(bloque.text)
+        texto = bloque.text
+        if tokens > restantes:
+            if empaquetados:
+                # Otro bloque más corto aún puede caber
+                continue
+            # El más relevante siempre entra, recortado al presupuesto
+            texto = texto[:restantes * 4]
+            tokens = restantes
+        metadata = dict(bloque.metadata)
+        metadata.pop("start_index", None)
+        if bloque.parts > 1:
+            metadata["fragmentos_unidos"] = bloque.parts
+        empaquetados.append(Document(page_content=texto, metadata=metadata))
+        restantes -= tokens
+        if restantes <= 0:
+            break
+
+    return empaquetados
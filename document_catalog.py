@@ -0,0 +1,305 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+from config import *
+from projects import project_of
+
+# Estados de un documento en el catálogo
+PENDIENTE = "pendiente"
+INDEXADO = "indexado"
+ERROR = "error"
+
+
+class DocumentCatalog:
+    """
+    Catálogo persistente de los PDF del archivo documental (SQLite).
+
+    Guarda por archivo su proyecto, tamaño, fecha, hash, páginas, fragmentos,
+    versión del índice y estado. Se actualiza de forma incremental: scan solo
+    vuelve a listar las carpetas cuyo mtime cambió (agregar o borrar archivos
+    lo modifica) y la ingesta reutiliza el hash de los archivos con el mismo
+    tamaño y fecha. La pestaña Archivo Documental lee páginas y totales del
+    catálogo sin recorrer la carpeta.
+    """
+
+    def __init__(self, path=DOCUMENT_CATALOG_PATH, export_path=DOCUMENT_CATALOG_EXPORT_PATH):
+        self.path = path
+        self.export_path = export_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT PRIMARY KEY,
+                project TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT,
+                pages INTEGER,
+                chunks INTEGER,
+                index_version INTEGER,
+                status TEXT NOT NULL,
+                indexed REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_order ON documents(project, name);
+            CREATE TABLE IF NOT EXISTS folders (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('revision', 0);
+            """
+        )
+        self._conn.commit()
+
+    def _changed(self):
+        # Cada cambio invalida la exportación CSV
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+
+    def _revision(self):
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def scan(self, ruta=CONTRATOS_PATH, full=False):
+        """
+        Detecta archivos nuevos, modificados o borrados.
+
+        Sin full solo se relistan las carpetas cuyo mtime cambió, así que el
+        costo depende del número de carpetas y no del de archivos; con full se
+        compara el tamaño y la fecha de cada archivo (lo hace la ingesta).
+        Devuelve el número de documentos que cambiaron.
+        """
+        if not os.path.exists(ruta):
+            return 0
+        with self._lock:
+            conocidas = dict(self._conn.execute("SELECT path, mtime FROM folders"))
+            # La raíz y cada subcarpeta conocida: si la raíz cambió pueden haber nuevas subcarpetas
+            pendientes = [ruta] + [carpeta for carpeta in conocidas if carpeta != ruta]
+            cambios = 0
+            while pendientes:
+                carpeta = pendientes.pop()
+                try:
+                    mtime = os.stat(carpeta).st_mtime
+                except FileNotFoundError:
+                    cambios += self._forget_folder(carpeta)
+                    continue
+                if not full and conocidas.get(carpeta) == mtime:
+                    continue
+                archivos = {}
+                with os.scandir(carpeta) as entradas:
+                    for entrada in entradas:
+                        if entrada.is_dir():
+                            if entrada.path not in conocidas:
+                                pendientes.append(entrada.path)
+                                conocidas[entrada.path] = None
+                        elif entrada.name.lower().endswith(".pdf"):
+                            archivos[os.path.relpath(entrada.path, ruta).replace(os.sep, "/")] = entrada
+                cambios += self._update_folder(carpeta, archivos)
+                self._conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (carpeta, mtime))
+            if cambios:
+                self._changed()
+            self._conn.commit()
+            return cambios
+
+    def _update_folder(self, carpeta, archivos):
+        """Sincroniza las filas de una carpeta con su contenido actual"""
+        previos = {
+            nombre: (size, mtime)
+            for nombre, path, size, mtime in self._conn.execute(
+                "SELECT name, path, size, mtime FROM documents WHERE path LIKE ? ESCAPE '\\'",
+                (self._like_prefix(carpeta),),
+            )
+            if os.path.dirname(path) == carpeta
+        }
+        cambios = 0
+        for nombre, entrada in archivos.items():
+            stats = entrada.stat()
+            if previos.get(nombre) == (stats.st_size, stats.st_mtime):
+                continue
+            # Nuevo o modificado: queda pendiente de indexar y sin hash
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (name, project, path, size, mtime, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (nombre, project_of(nombre), entrada.path, stats.st_size, stats.st_mtime, PENDIENTE),
+            )
+            cambios += 1
+        borrados = [nombre for nombre in previos if nombre not in archivos]
+        self._conn.executemany("DELETE FROM documents WHERE name = ?", [(nombre,) for nombre in borrados])
+        return cambios + len(borrados)
+
+    def _forget_folder(self, carpeta):
+        cursor = self._conn.execute(
+            "DELETE FROM documents WHERE path LIKE ? ESCAPE '\\'", (self._like_prefix(carpeta),)
+        )
+        self._conn.execute("DELETE FROM folders WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                           (carpeta, self._like_prefix(carpeta)))
+        return cursor.rowcount
+
+    @staticmethod
+    def _like_prefix(carpeta):
+        prefijo = os.path.join(carpeta, "")
+        return prefijo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    def file_hashes(self, archivos, calcular):
+        """
+        {nombre: hash} de los archivos. Reutiliza el hash guardado si el
+        tamaño y la fecha no cambiaron; si no, lo calcula con calcular(path).
+        """
+        with self._lock:
+            guardados = {
+                nombre: (size, mtime, hash_)
+                for nombre, size, mtime, hash_ in self._conn.execute("SELECT name, size, mtime, hash FROM documents")
+            }
+        hashes = {}
+        nuevos = []
+        for nombre, path in archivos.items():
+            stats = os.stat(path)
+            previo = guardados.get(nombre)
+            if previo and previo[2] and previo[:2] == (stats.st_size, stats.st_mtime):
+                hashes[nombre] = previo[2]
+                continue
+            hashes[nombre] = calcular(path)
+            nuevos.append((hashes[nombre], stats.st_size, stats.st_mtime, nombre))
+        if nuevos:
+            with self._lock:
+                self._conn.executemany(
+                    "UPDATE documents SET hash = ?, size = ?, mtime = ? WHERE name = ?", nuevos
+                )
+                self._conn.commit()
+        return hashes
+
+    def reconcile(self, indexados, index_version):
+        """
+        Marca como indexados los archivos del manifiesto de ingesta. Los que
+        cambiaron desde su última indexación toman la versión actual.
+        """
+        with self._lock:
+            actuales = {
+                nombre: (hash_, status)
+                for nombre, hash_, status in self._conn.execute("SELECT name, hash, status FROM documents")
+            }
+            ahora = time.time()
+            filas = [
+                (registro["hash"], registro.get("paginas"), len(registro["fragmentos"]), index_version,
+                 INDEXADO, ahora, nombre)
+                for nombre, registro in indexados.items()
+                if nombre in actuales and actuales[nombre] != (registro["hash"], INDEXADO)
+            ]
+            self._conn.executemany(
+                "UPDATE documents SET hash = ?, pages = ?, chunks = ?, index_version = ?, status = ?, "
+                "indexed = ?, error = NULL WHERE name = ?",
+                filas,
+            )
+            if filas:
+                self._changed()
+            self._conn.commit()
+            return len(filas)
+
+    def mark_error(self, mensaje):
+        """Los documentos pendientes quedan con el error de la ingesta"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE documents SET status = ?, error = ? WHERE status = ?", (ERROR, mensaje, PENDIENTE)
+            )
+            if cursor.rowcount:
+                self._changed()
+            self._conn.commit()
+
+    def summary(self):
+        """Totales por estado, número de documentos, fragmentos y tamaño"""
+        with self._lock:
+            por_estado = dict(self._conn.execute("SELECT status, COUNT(*) FROM documents GROUP BY status"))
+            total, fragmentos, tamano = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunks), 0), COALESCE(SUM(size), 0) FROM documents"
+            ).fetchone()
+        return {
+            "documentos": total,
+            "fragmentos": fragmentos,
+            "tamano_mb": round(tamano / 2 ** 20, 2),
+            **{estado: por_estado.get(estado, 0) for estado in (INDEXADO, PENDIENTE, ERROR)},
+        }
+
+    def page(self, offset=0, limit=DOCUMENT_CATALOG_PAGE_SIZE, project=None):
+        """Una página de documentos ordenada por proyecto y nombre"""
+        consulta = (
+            "SELECT name, project, size, mtime, pages, chunks, index_version, status, indexed, error "
+            "FROM documents"
+        )
+        parametros = []
+        if project:
+            consulta += " WHERE project = ?"
+            parametros.append(project)
+        consulta += " ORDER BY project, name LIMIT ? OFFSET ?"
+        with self._lock:
+            filas = self._conn.execute(consulta, parametros + [limit, offset]).fetchall()
+        claves = ["nombre", "proyecto", "tamano", "mtime", "paginas", "fragmentos", "version", "estado",
+                  "indexado", "error"]
+        return [dict(zip(claves, fila)) for fila in filas]
+
+    def names(self, project=None, status=INDEXADO):
+        """Nombres de los documentos en ese estado, por proyecto y nombre"""
+        consulta = "SELECT name FROM documents WHERE status = ?"
+        parametros = [status]
+        if project:
+            consulta += " AND project = ?"
+            parametros.append(project)
+        with self._lock:
+            return [fila[0] for fila in self._conn.execute(consulta + " ORDER BY project, name", parametros)]
+
+    def export_csv(self):
+        """
+        Ruta del inventario en CSV. Solo se regenera si el catálogo cambió
+        desde la última exportación.
+        """
+        with self._lock:
+            revision = self._revision()
+            marca = self.export_path + ".revision"
+            try:
+                with open(marca, "r", encoding="utf-8") as f:
+                    vigente = int(f.read().strip()) == revision
+            except (FileNotFoundError, ValueError):
+                vigente = False
+            if vigente and os.path.exists(self.export_path):
+                return self.export_path
+
+            tmp_path = self.export_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                escritor = csv.writer(f)
+                escritor.writerow(["Archivo", "Proyecto", "Tamaño (bytes)", "Fecha", "Páginas", "Fragmentos",
+                                   "Versión del índice", "Estado", "Indexado", "Error"])
+                for fila in self._conn.execute(
+                    "SELECT name, project, size, mtime, pages, chunks, index_version, status, indexed, error "
+                    "FROM documents ORDER BY project, name"
+                ):
+                    escritor.writerow([
+                        *fila[:3], _fecha(fila[3]), *fila[4:8], _fecha(fila[8]), fila[9] or "",
+                    ])
+            os.replace(tmp_path, self.export_path)
+            with open(marca, "w", encoding="utf-8") as f:
+                f.write(str(revision))
+            return self.export_path
+
+
+def _fecha(segundos):
+    return time.strftime('%d/%m/%Y %H:%M', time.localtime(segundos)) if segundos else ""
+
+
+_shared_catalog = None
+_shared_lock = threading.Lock()
+
+
+def get_document_catalog():
+    global _shared_catalog
+    with _shared_lock:
+        if _shared_catalog is None:
+            _shared_catalog = DocumentCatalog()
+        return _shared_catalog
@@ -0,0 +1,361 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Índice de documentos: una fila por archivo con el centroide de los embeddings
+# de sus fragmentos, un resumen y campos clave. Es la etapa gruesa de la
+# búsqueda (elige los documentos antes de buscar en sus fragmentos) y responde
+# "¿de qué trata el contrato X?" sin recuperación ni generación.
+
+# Orígenes del resumen
+LLM = "llm"
+EXTRACTIVO = "extractivo"
+
+# (clave, etiqueta) de los campos clave, en el orden de DOCUMENT_SUMMARY_TEMPLATE
+SUMMARY_FIELDS = [
+    ("contrato", "Contrato"),
+    ("objeto", "Objeto"),
+    ("contratista", "Contratista"),
+    ("monto", "Monto sin IVA"),
+    ("plazo", "Plazo"),
+    ("fecha", "Fecha de firma"),
+]
+_POR_ETIQUETA = {"resumen": "resumen", **{etiqueta.lower(): clave for clave, etiqueta in SUMMARY_FIELDS}}
+
+# Sobre texto en minúsculas y sin acentos
+_PIDE_RESUMEN_RE = re.compile(
+    r"\b(?:de que (?:se )?trata|(?:de|sobre) que es|en que consiste|resum[a-z]*(?: de)?)\s+"
+    r"(?:el |la |este |esta |del )?(?:contrato|documento|archivo|convenio|[a-z]{2,4}-\d)"
+)
+
+
+def _normalize(texto):
+    texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode().lower()
+    return " ".join(texto.split())
+
+
+def asks_for_summary(question):
+    """True si la pregunta pide de qué trata un documento (y no una cláusula o un dato concreto)"""
+    return bool(_PIDE_RESUMEN_RE.search(_normalize(question)))
+
+
+def parse_summary(texto):
+    """Separa la respuesta de DOCUMENT_SUMMARY_TEMPLATE en (resumen, campos)"""
+    campos, actual = {}, None
+    for linea in texto.splitlines():
+        etiqueta, separador, valor = linea.partition(":")
+        clave = _POR_ETIQUETA.get(_normalize(etiqueta).strip(" *-")) if separador else None
+        if clave:
+            actual = clave
+            campos[clave] = valor.strip(" *")
+        elif actual and linea.strip():
+            campos[actual] = f"{campos[actual]} {linea.strip()}".strip()
+    resumen = campos.pop("resumen", "") or texto.strip()
+    return resumen, {
+        clave: valor for clave, valor in campos.items()
+        if valor and _normalize(valor).rstrip(".") != "no localizado"
+    }
+
+
+def _ordered(lote):
+    """Posiciones de los fragmentos en orden de lectura (página y posición en el texto)"""
+    def posicion(i):
+        metadata = lote["metadatas"][i] or {}
+        return metadata.get("page") or 0, metadata.get("start_index") or 0
+    return sorted(range(len(lote["ids"])), key=posicion)
+
+
+def extractive_summary(textos, metadatas):
+    """Resumen sin LLM: el inicio del documento y los encabezados de sus cláusulas"""
+    resumen = " ".join(" ".join(textos).split())[:400]
+    encabezados = {}
+    for texto, metadata in zip(textos, metadatas):
+        clausula = (metadata or {}).get("clausula")
+        if clausula and clausula not in encabezados:
+            encabezados[clausula] = " ".join(texto.split())[:80]
+    if encabezados:
+        resumen += "\nCláusulas: " + "; ".join(list(encabezados.values())[:12])
+    return resumen
+
+
+class DocumentIndex:
+    """
+    Tabla de documentos en SQLite con los centroides en memoria.
+
+    La ingesta agrega una fila por archivo (update_document_index); route
+    compara el embedding de la pregunta con todos los centroides en una
+    sola multiplicación de matrices, mucho más chica que la de fragmentos.
+    """
+
+    def __init__(self, path=DOCUMENT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._centroides = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                project TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                chunks INTEGER NOT NULL,
+                centroid BLOB NOT NULL,
+                summary TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def entries(self):
+        """{source: (file_hash, origen)} de los documentos indexados"""
+        with self._lock:
+            return {
+                source: (file_hash, origin)
+                for source, file_hash, origin in self._conn.execute("SELECT source, file_hash, origin FROM documents")
+            }
+
+    def upsert(self, entrada):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entrada["source"], entrada["name"], entrada["project"], entrada["file_hash"], entrada["chunks"],
+                    np.asarray(entrada["centroid"], dtype=np.float32).tobytes(), entrada["summary"],
+                    json.dumps(entrada["fields"], ensure_ascii=False), entrada["origin"], time.time(),
+                ),
+            )
+            self._conn.commit()
+            self._centroides = None
+
+    def delete(self, sources):
+        if not sources:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE source = ?", [(s,) for s in sources])
+            self._conn.commit()
+            self._centroides = None
+
+    def get(self, sources):
+        """Entradas (sin centroide) de los documentos indicados, en el mismo orden"""
+        if not sources:
+            return []
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT source, name, project, chunks, summary, fields, origin FROM documents "
+                f"WHERE source IN ({','.join('?' * len(sources))})",
+                list(sources),
+            ).fetchall()
+        por_fuente = {
+            fila[0]: {
+                "source": fila[0], "name": fila[1], "project": fila[2], "chunks": fila[3],
+                "summary": fila[4], "fields": json.loads(fila[5]), "origin": fila[6],
+            }
+            for fila in filas
+        }
+        return [por_fuente[s] for s in sources if s in por_fuente]
+
+    def _matrix(self):
+        """(fuentes, proyectos, centroides normalizados) de la dimensión más común; se cachea hasta la próxima escritura"""
+        with self._lock:
+            if self._centroides is None:
+                filas = self._conn.execute("SELECT source, project, centroid FROM documents").fetchall()
+                vectores = [np.frombuffer(centroide, dtype=np.float32) for _, _, centroide in filas]
+                dims = Counter(len(v) for v in vectores).most_common(1)[0][0] if vectores else 0
+                elegidas = [i for i, v in enumerate(vectores) if len(v) == dims]
+                matriz = np.vstack([vectores[i] for i in elegidas]) if elegidas else np.zeros((0, 0), np.float32)
+                self._centroides = (
+                    [filas[i][0] for i in elegidas], np.array([filas[i][1] for i in elegidas], dtype=object), matriz,
+                )
+            return self._centroides
+
+    def route(self, embedding, projects=None, n=DOCUMENT_TOP_N, min_docs=DOCUMENT_ROUTING_MIN_DOCS):
+        """
+        Devuelve [(source, proyecto, similitud)] de los n documentos cuyo
+        centroide es más parecido a embedding, o None si entre los proyectos
+        indicados hay min_docs documentos o menos (conviene buscar en todos).
+        """
+        fuentes, proyectos, matriz = self._matrix()
+        consulta = np.asarray(embedding, dtype=np.float32)
+        if not fuentes or matriz.shape[1] != len(consulta):
+            return None
+        filas = np.arange(len(fuentes))
+        if projects is not None:
+            filas = filas[np.isin(proyectos, list(projects))]
+        if len(filas) <= max(min_docs, n):
+            return None
+        similitudes = matriz[filas] @ (consulta / (np.linalg.norm(consulta) or 1.0))
+        mejores = np.argpartition(-similitudes, n - 1)[:n]
+        mejores = mejores[np.argsort(-similitudes[mejores])]
+        return [(fuentes[filas[i]], proyectos[filas[i]], float(similitudes[i])) for i in mejores]
+
+    def find(self, question, identifier_index=None):
+        """
+        Documentos que nombra la pregunta: por número de contrato (índice de
+        identificadores o campo contrato del resumen) o por nombre de archivo.
+        """
+        # Import diferido: identifier_index carga LangChain
+        from identifier_index import CONTRATO, extract_identifiers
+
+        contratos = [valor for tipo, valor in extract_identifiers(question) if tipo == CONTRATO]
+        fuentes = []
+        if contratos and identifier_index is not None:
+            fuentes = [source for _, source in identifier_index.lookup(CONTRATO, contratos) if source]
+        texto = _normalize(question)
+        with self._lock:
+            filas = self._conn.execute("SELECT source, name, fields FROM documents").fetchall()
+        for source, nombre, campos in filas:
+            base = _normalize(os.path.splitext(os.path.basename(nombre))[0])
+            contrato = _normalize(json.loads(campos).get("contrato", ""))
+            if (len(base) >= 5 and base in texto) or (contrato and any(c.lower() in contrato for c in contratos)):
+                fuentes.append(source)
+        return list(dict.fromkeys(fuentes))
+
+
+def format_summary(entrada):
+    """Texto de la respuesta inmediata con el resumen y los campos clave de un documento"""
+    lineas = [f"**{os.path.basename(entrada['name'])}**", "", entrada["summary"]]
+    campos = [(etiqueta, entrada["fields"][clave]) for clave, etiqueta in SUMMARY_FIELDS if clave in entrada["fields"]]
+    if campos:
+        lineas.append("")
+        lineas += [f"- **{etiqueta}:** {valor}" for etiqueta, valor in campos]
+    if entrada["origin"] == EXTRACTIVO:
+        lineas += ["", "_Resumen extractivo (generado sin el modelo de lenguaje)._"]
+    return "\n".join(lineas)
+
+
+def summarize_document(nombre, textos, llm):
+    """Resumen y campos clave con el LLM a partir del inicio del documento"""
+    # Imports diferidos: LangChain solo durante la ingesta
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+
+    from prompts import DOCUMENT_SUMMARY_TEMPLATE
+
+    texto = "\n".join(textos)[:DOCUMENT_SUMMARY_MAX_CHARS]
+    prompt = PromptTemplate.from_template(DOCUMENT_SUMMARY_TEMPLATE).invoke(
+        {"document": os.path.basename(nombre), "text": texto}
+    )
+    return parse_summary((llm | StrOutputParser()).invoke(prompt))
+
+
+def build_entry(collection, source, nombre, proyecto, file_hash, llm=None):
+    """Entrada del índice de un archivo a partir de sus fragmentos ya publicados en Chroma"""
+    from identifier_index import CONTRATO, extract_identifiers
+
+    lote = collection.get(where={"source": source}, include=["embeddings", "documents", "metadatas"])
+    if not len(lote["ids"]):
+        return None
+    orden = _ordered(lote)
+    textos = [lote["documents"][i] or "" for i in orden]
+    metadatas = [lote["metadatas"][i] for i in orden]
+
+    # Media de los embeddings normalizados (la búsqueda usa similitud coseno)
+    matriz = np.asarray(lote["embeddings"], dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    centroide = (matriz / np.where(normas == 0, 1.0, normas)).mean(axis=0)
+    centroide /= np.linalg.norm(centroide) or 1.0
+
+    resumen, campos, origen = None, {}, EXTRACTIVO
+    if llm is not None:
+        try:
+            resumen, campos = summarize_document(nombre, textos, llm)
+            origen = LLM
+        except Exception as e:
+            logger.warning(f"Resumen de '{nombre}' sin LLM: {e}")
+    if not resumen:
+        resumen, origen = extractive_summary(textos, metadatas), EXTRACTIVO
+    if "contrato" not in campos:
+        contratos = sorted({valor for tipo, valor in extract_identifiers(" ".join(textos[:5])) if tipo == CONTRATO})
+        if contratos:
+            campos["contrato"] = ", ".join(contratos)
+
+    return {
+        "source": source, "name": nombre, "project": proyecto, "file_hash": file_hash, "chunks": len(orden),
+        "centroid": centroide, "summary": resumen, "fields": campos, "origin": origen,
+    }
+
+
+def update_document_index(index, indexados, rutas, open_store, llm=None, concurrency=DOCUMENT_SUMMARY_CONCURRENCY):
+    """
+    Sincroniza el índice de documentos con el manifiesto de ingesta.
+
+    Agrega los archivos nuevos o modificados y los que aún no tienen entrada
+    (índices anteriores a este módulo), vuelve a intentar con el LLM los
+    resúmenes extractivos y retira los archivos que ya no están.
+    open_store(proyecto) devuelve el vector store del proyecto. Devuelve
+    contadores para la traza.
+    """
+    vigentes = {rutas[nombre]: nombre for nombre in indexados if nombre in rutas}
+    previas = index.entries()
+    retirados = [source for source in previas if source not in vigentes]
+    index.delete(retirados)
+
+    pendientes = [
+        source for source, nombre in vigentes.items()
+        if source not in previas or previas[source][0] != indexados[nombre]["hash"]
+        or (llm is not None and previas[source][1] != LLM)
+    ]
+
+    def construir(source):
+        nombre = vigentes[source]
+        proyecto = indexados[nombre].get("proyecto", PROJECT_DEFAULT)
+        try:
+            entrada = build_entry(
+                open_store(proyecto)._collection, source, nombre, proyecto, indexados[nombre]["hash"], llm
+            )
+        except Exception as e:
+            logger.warning(f"Índice de documentos: no se pudo procesar '{nombre}': {e}")
+            return None
+        if entrada is not None:
+            index.upsert(entrada)
+        return entrada
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="resumenes") as pool:
+        entradas = [entrada for entrada in pool.map(construir, pendientes) if entrada is not None]
+    if pendientes or retirados:
+        logger.info(
+            f"Índice de documentos: {len(entradas)} actualizados, {len(retirados)} retirados, "
+            f"{sum(e['origin'] == EXTRACTIVO for e in entradas)} con resumen extractivo."
+        )
+    return {
+        "documentos": index.count(),
+        "actualizados": len(entradas),
+        "retirados": len(retirados),
+        "extractivos": sum(entrada["origin"] == EXTRACTIVO for entrada in entradas),
+    }
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_document_index():
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = DocumentIndex()
+        return _shared_index
@@ -0,0 +1,134 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    # Aproximación usual de ~4 caracteres por token; basta para respetar la cuota
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(exc):
+    mensaje = str(exc).lower()
+    return "429" in mensaje or "resource_exhausted" in mensaje or "quota" in mensaje or "rate limit" in mensaje
+
+
+class TokenBucket:
+    """Limitador de tokens por minuto con recarga continua"""
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        # Un lote mayor que la capacidad espera a que la cubeta esté llena
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (ahora - self.updated) * self.rate)
+                self.updated = ahora
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                espera = (tokens - self.tokens) / self.rate
+            time.sleep(espera)
+
+
+class EmbeddingBatcher(Embeddings):
+    """
+    Programador de embeddings por lotes con concurrencia acotada.
+
+    Divide los textos en lotes de batch_size, envía hasta max_concurrency lotes
+    a la vez y respeta un presupuesto de tokens por minuto. Ante un 429 todos
+    los hilos esperan un enfriamiento compartido que se duplica con cada
+    rechazo y se reduce a la mitad con cada éxito.
+
+    Si embeddings es una CachedEmbeddings, cada lote se guarda en la caché en
+    cuanto termina y los textos ya cacheados no consumen cuota: una ingesta que
+    falla a la mitad se reanuda pagando solo los lotes que faltaban.
+    """
+
+    def __init__(self, embeddings, batch_size=EMBED_BATCH_SIZE, max_concurrency=EMBED_MAX_CONCURRENCY,
+                 tokens_per_minute=EMBED_TOKENS_PER_MINUTE, max_retries=EMBED_MAX_RETRIES,
+                 base_backoff=1.0, max_backoff=60.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self._backoff = base_backoff
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+        self.batches_done = 0
+        self.rate_limited = 0
+
+    def _wait_cooldown(self):
+        with self._lock:
+            espera = self._cooldown_until - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+
+    def _on_success(self):
+        with self._lock:
+            self._backoff = max(self.base_backoff, self._backoff / 2)
+            self.batches_done += 1
+
+    def _on_rate_limit(self):
+        with self._lock:
+            self.rate_limited += 1
+            espera = self._backoff * (1 + random.random() * 0.25)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + espera)
+            self._backoff = min(self.max_backoff, self._backoff * 2)
+            return espera
+
+    def _pending_texts(self, texts):
+        missing = getattr(self.embeddings, "missing_texts", None)
+        return missing(texts) if missing else texts
+
+    def _embed_batch(self, texts):
+        for intento in range(self.max_retries + 1):
+            self._wait_cooldown()
+            pendientes = self._pending_texts(texts)
+            if pendientes and self.bucket:
+                self.bucket.acquire(sum(estimate_tokens(t) for t in pendientes))
+            try:
+                vectores = self.embeddings.embed_documents(texts)
+                self._on_success()
+                return vectores
+            except Exception as e:
+                if intento == self.max_retries:
+                    raise
+                if is_rate_limit_error(e):
+                    espera = self._on_rate_limit()
+                    logger.warning(f"Límite de cuota en embeddings, reintento {intento + 1} en {espera:.1f}s")
+                else:
+                    espera = min(self.max_backoff, self.base_backoff * 2 ** intento)
+                    logger.warning(f"Error en lote de embeddings ({e}), reintento {intento + 1} en {espera:.1f}s")
+                    time.sleep(espera)
+
+    def embed_documents(self, texts):
+        lotes = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(lotes) <= 1 or self.max_concurrency <= 1:
+            resultados = [self._embed_batch(lote) for lote in lotes]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(lotes))) as pool:
+                resultados = list(pool.map(self._embed_batch, lotes))
+        return [vector for lote in resultados for vector in lote]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
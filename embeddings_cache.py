@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(vector):
+    norma = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norma for v in vector]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltura de un modelo de embeddings con caché persistente en SQLite.
+
+    La llave de cada vector es (modelo, dimensión, tipo, sha256(texto)); el tipo
+    distingue documentos de consultas porque Gemini usa un task_type distinto
+    para cada uno. Al superar max_entries se eliminan los vectores usados hace
+    más tiempo (LRU).
+    """
+
+    def __init__(self, embeddings, model, dimensions=None, path=EMBEDDING_CACHE_PATH,
+                 max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model = model
+        self.dimensions = dimensions
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, dim, kind, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _get(self, kind, hashes):
+        """Devuelve {hash: vector} para las llaves presentes y actualiza su último acceso"""
+        encontrados = {}
+        dim = self.dimensions or 0
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(hashes), 500):
+                lote = hashes[i:i + 500]
+                marcadores = ",".join("?" * len(lote))
+                filas = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND dim = ? AND kind = ? AND text_hash IN ({marcadores})",
+                    [self.model, dim, kind, *lote],
+                ).fetchall()
+                for text_hash, blob in filas:
+                    encontrados[text_hash] = array("f", blob).tolist()
+            if encontrados:
+                ahora = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? "
+                    "WHERE model = ? AND dim = ? AND kind = ? AND text_hash = ?",
+                    [(ahora, self.model, dim, kind, h) for h in encontrados],
+                )
+                self._conn.commit()
+        return encontrados
+
+    def _put(self, kind, items):
+        ahora = time.time()
+        dim = self.dimensions or 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dim, kind, text_hash, vector, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.model, dim, kind, h, array("f", v).tobytes(), ahora) for h, v in items],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        exceso = total - self.max_entries
+        if exceso > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (exceso,),
+            )
+            logger.info(f"Caché de embeddings: {exceso} vectores desalojados (LRU).")
+
+    def _embed_kwargs(self):
+        if self.dimensions:
+            return {"output_dimensionality": self.dimensions}
+        return {}
+
+    def _postprocess(self, vector):
+        # Con dimensión reducida Gemini no devuelve vectores normalizados
+        return normalize(vector) if self.dimensions else vector
+
+    def missing_texts(self, texts):
+        """Textos que aún no están en la caché (no altera contadores ni accesos)"""
+        hashes = [self.text_hash(t) for t in texts]
+        dim = self.dimensions or 0
+        presentes = set()
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                lote = list(set(hashes[i:i + 500]))
+                marcadores = ",".join("?" * len(lote))
+                filas = self._conn.execute(
+                    f"SELECT text_hash FROM embeddings "
+                    f"WHERE model = ? AND dim = ? AND kind = 'doc' AND text_hash IN ({marcadores})",
+                    [self.model, dim, *lote],
+                ).fetchall()
+                presentes.update(fila[0] for fila in filas)
+        return [t for h, t in zip(hashes, texts) if h not in presentes]
+
+    def embed_documents(self, texts):
+        hashes = [self.text_hash(t) for t in texts]
+        en_cache = self._get("doc", list(set(hashes)))
+
+        # Solo se envían al API los textos ausentes (sin repetir duplicados)
+        faltantes = {}
+        for h, t in zip(hashes, texts):
+            if h not in en_cache and h not in faltantes:
+                faltantes[h] = t
+        self.hits += len(texts) - len(faltantes)
+        self.misses += len(faltantes)
+
+        if faltantes:
+            vectores = self.embeddings.embed_documents(list(faltantes.values()), **self._embed_kwargs())
+            vectores = [self._postprocess(v) for v in vectores]
+            nuevos = list(zip(faltantes.keys(), vectores))
+            self._put("doc", nuevos)
+            en_cache.update(nuevos)
+
+        return [en_cache[h] for h in hashes]
+
+    def embed_query(self, text):
+        h = self.text_hash(text)
+        en_cache = self._get("query", [h])
+        if h in en_cache:
+            self.hits += 1
+            return en_cache[h]
+
+        self.misses += 1
+        vector = self._postprocess(self.embeddings.embed_query(text, **self._embed_kwargs()))
+        self._put("query", [(h, vector)])
+        return vector
+
+    def stats(self):
+        """Contadores de aciertos y fallos desde que se creó la instancia"""
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "tasa_aciertos": self.hits / total if total else 0.0,
+            "entradas": entradas,
+        }
+
+
+_shared_embeddings = None
+_shared_lock = threading.Lock()
+
+
+def get_embeddings():
+    """
+    Devuelve la instancia de embeddings con caché compartida por la ingesta
+    y las consultas dentro del proceso.
+    """
+    global _shared_embeddings
+    with _shared_lock:
+        if _shared_embeddings is None:
+            _shared_embeddings = CachedEmbeddings(
+                GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
+                model=EMBEDDING_MODEL,
+                dimensions=EMBEDDING_DIMENSIONS,
+            )
+        return _shared_embeddings
@@ -0,0 +1,330 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25_index import strip_accents
+from config import *
+from metrics import record_span
+from projects import current_documents, current_scope, project_of_source
+
+# Identificadores que se indexan por fragmento
+CONTRATO = "contrato"
+CLAUSULA = "clausula"
+ANEXO = "anexo"
+MONTO = "monto"
+
+_UNIDADES = ["PRIMER", "SEGUND", "TERCER", "CUART", "QUINT", "SEXT", "SEPTIM", "OCTAV", "NOVEN"]
+_DECENAS = {"DECIM": 10, "VIGESIM": 20, "TRIGESIM": 30}
+_ORDINAL = (
+    r"(?:(?:DECIM|VIGESIM|TRIGESIM)[AO](?:\s*(?:" + "|".join(_UNIDADES) + r")[AO])?"
+    r"|(?:" + "|".join(_UNIDADES) + r")[AO]|UNICA)"
+)
+
+# Sobre texto en mayúsculas y sin acentos
+_CONTRATO_RE = re.compile(r"\b[A-Z]{2,4}-\d{2,3}(?:-[A-Z0-9]{1,12}){3,}\b")
+# "CLÁUSULA PRIMERA BIS" es otra cláusula que la PRIMERA: el sufijo queda en el valor ("1-BIS")
+_CLAUSULA_RE = re.compile(r"\bCLAUSULA\s+(" + _ORDINAL + r"|\d{1,3})(?:\s+(BIS|TER|QUATER))?\b")
+# Números, romanos, letras sueltas y códigos alfanuméricos ("ANEXO AT-1", "ANEXO DT-3A")
+_ANEXO_RE = re.compile(
+    r"\bANEXOS?\s+(?:NO\.?\s*|NUM(?:ERO)?\.?\s*)?"
+    r"([A-Z]{1,4}-?\d{1,3}(?:[.-]\d{1,3})*[A-Z]?\b|\d{1,3}(?:[.-]\d{1,3})*[A-Z]?|[IVX]{1,5}\b|[A-Z](?=\s*[.:)-]))"
+)
+_MONTO_RE = re.compile(r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{2}))?")
+_PIDE_MONTO_RE = re.compile(r"\b(?:MONTO|IMPORTE|COSTO|PRECIO|VALOR)\b")
+
+
+def _ordinal_to_number(texto):
+    """PRIMERA -> 1, DECIMA SEGUNDA / DECIMOSEGUNDA -> 12; los números se dejan igual"""
+    if texto.isdigit():
+        return str(int(texto))
+    if texto == "UNICA":
+        return "1"
+    valor = 0
+    for raiz, decena in _DECENAS.items():
+        if texto.startswith(raiz):
+            valor = decena
+            texto = texto[len(raiz) + 1:].strip()
+            break
+    for i, raiz in enumerate(_UNIDADES, 1):
+        if texto.startswith(raiz):
+            valor += i
+            break
+    return str(valor)
+
+
+def extract_identifiers(text):
+    """
+    Extrae números de contrato, cláusulas, anexos y montos de un texto.
+
+    Devuelve un conjunto de (tipo, valor) normalizados, de modo que
+    "Cláusula Décima" y "cláusula 10" producen el mismo valor.
+    """
+    normalizado = strip_accents(text).upper()
+    encontrados = set()
+    for match in _CONTRATO_RE.finditer(normalizado):
+        encontrados.add((CONTRATO, match.group()))
+    for match in _CLAUSULA_RE.finditer(normalizado):
+        numero = _ordinal_to_number(match.group(1))
+        encontrados.add((CLAUSULA, f"{numero}-{match.group(2)}" if match.group(2) else numero))
+    for match in _ANEXO_RE.finditer(normalizado):
+        encontrados.add((ANEXO, match.group(1).lstrip("0") or "0"))
+    for match in _MONTO_RE.finditer(normalizado):
+        entero = match.group(1).replace(",", "")
+        encontrados.add((MONTO, f"{int(entero)}.{match.group(2) or '00'}"))
+    return encontrados
+
+
+def asks_for_amount(text):
+    return bool(_PIDE_MONTO_RE.search(strip_accents(text).upper()))
+
+
+def _source_and_project(metadata):
+    source = metadata.get("source")
+    return source, metadata.get("proyecto") or (project_of_source(source) if source else PROJECT_DEFAULT)
+
+
+class IdentifierIndex:
+    """
+    Tabla de identificadores por fragmento en SQLite.
+
+    Usa los mismos IDs de fragmento que Chroma y BM25 y se actualiza en la
+    misma fase de publicación de la ingesta.
+    """
+
+    def __init__(self, path=IDENTIFIER_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                source TEXT,
+                project TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+            CREATE TABLE IF NOT EXISTS identifiers (
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (kind, value, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_identifiers_chunk ON identifiers(chunk_id);
+            """
+        )
+        # Índices creados antes de guardar el proyecto: se deriva de la ruta
+        if "project" not in [fila[1] for fila in self._conn.execute("PRAGMA table_info(chunks)")]:
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN project TEXT")
+            fuentes = [fila[0] for fila in self._conn.execute("SELECT DISTINCT source FROM chunks")]
+            self._conn.executemany(
+                "UPDATE chunks SET project = ? WHERE source IS ?",
+                [(project_of_source(fuente) if fuente else PROJECT_DEFAULT, fuente) for fuente in fuentes],
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_project ON chunks(project)")
+        self._conn.commit()
+
+    def count(self):
+        """Fragmentos procesados (tengan o no identificadores)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, ids, docs):
+        """Inserta o reemplaza los identificadores de los fragmentos"""
+        with self._lock:
+            self._delete(ids)
+            filas = []
+            for chunk_id, doc in zip(ids, docs):
+                filas.extend((tipo, valor, chunk_id) for tipo, valor in extract_identifiers(doc.page_content))
+            self._conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?)",
+                [(chunk_id, *_source_and_project(doc.metadata or {})) for chunk_id, doc in zip(ids, docs)],
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO identifiers VALUES (?, ?, ?)", filas)
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _delete(self, ids):
+        self._conn.executemany("DELETE FROM identifiers WHERE chunk_id = ?", [(i,) for i in ids])
+        self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(i,) for i in ids])
+
+    def delete_source(self, source, keep=()):
+        with self._lock:
+            ids = [
+                fila[0] for fila in self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))
+                if fila[0] not in keep
+            ]
+            self._delete(ids)
+            self._conn.commit()
+
+    def lookup(self, tipo, valores, sources=None, projects=None):
+        """
+        Devuelve [(chunk_id, source)] de los fragmentos con alguno de los
+        valores; sources y projects limitan la búsqueda a esos archivos y
+        proyectos.
+        """
+        if not valores:
+            return []
+        with self._lock:
+            consulta = (
+                "SELECT DISTINCT i.chunk_id, c.source FROM identifiers i JOIN chunks c ON c.chunk_id = i.chunk_id "
+                f"WHERE i.kind = ? AND i.value IN ({','.join('?' * len(valores))})"
+            )
+            parametros = [tipo, *valores]
+            if sources is not None:
+                consulta += f" AND c.source IN ({','.join('?' * len(sources))})"
+                parametros.extend(sources)
+            if projects is not None:
+                consulta += f" AND c.project IN ({','.join('?' * len(projects))})"
+                parametros.extend(projects)
+            return self._conn.execute(consulta + " ORDER BY i.chunk_id", parametros).fetchall()
+
+    def route(self, query, projects=None, sources=None):
+        """
+        Resuelve los identificadores de una consulta dentro del alcance
+        (projects y sources, como projects.project_scope y document_scope).
+
+        Devuelve None si la consulta no menciona identificadores conocidos; si
+        los menciona, {"directos": [chunk_id], "fuentes": [source] o None,
+        "identificadores": [(tipo, valor)]}. Un número de contrato limita la
+        búsqueda a los archivos que lo mencionan; cláusulas, anexos y montos
+        apuntan a fragmentos concretos. Los directos quedan primero los que
+        tienen más identificadores de la consulta y, entre ellos, los del
+        identificador menos frecuente.
+        """
+        identificadores = extract_identifiers(query)
+        if not identificadores:
+            return None
+
+        por_tipo = {}
+        for tipo, valor in identificadores:
+            por_tipo.setdefault(tipo, []).append(valor)
+
+        fuentes = None
+        if CONTRATO in por_tipo:
+            fuentes = sorted({
+                source for _, source in self.lookup(CONTRATO, por_tipo[CONTRATO], sources, projects) if source
+            })
+            if not fuentes:
+                return None
+
+        # chunk_id -> [identificadores que contiene, frecuencia del más raro]
+        coincidencias = {}
+        for tipo in (CLAUSULA, ANEXO, MONTO):
+            for valor in por_tipo.get(tipo, []):
+                filas = self.lookup(tipo, [valor], fuentes if fuentes is not None else sources, projects)
+                for chunk_id, _ in filas:
+                    coincidencia = coincidencias.setdefault(chunk_id, [0, len(filas)])
+                    coincidencia[0] += 1
+                    coincidencia[1] = min(coincidencia[1], len(filas))
+        directos = sorted(coincidencias, key=lambda chunk_id: (-coincidencias[chunk_id][0], coincidencias[chunk_id][1]))
+        if fuentes and not directos and asks_for_amount(query):
+            directos = [chunk_id for chunk_id, _ in self.lookup(MONTO, self._values(MONTO, fuentes), fuentes)]
+
+        if not directos and fuentes is None:
+            return None
+        return {
+            "directos": directos,
+            "fuentes": fuentes,
+            "identificadores": sorted(identificadores),
+        }
+
+    def _values(self, tipo, sources):
+        with self._lock:
+            return [
+                fila[0] for fila in self._conn.execute(
+                    "SELECT DISTINCT i.value FROM identifiers i JOIN chunks c ON c.chunk_id = i.chunk_id "
+                    f"WHERE i.kind = ? AND c.source IN ({','.join('?' * len(sources))})",
+                    [tipo, *sources],
+                )
+            ]
+
+
+class IdentifierRetriever(BaseRetriever):
+    """
+    Ruta rápida para consultas con identificadores (contrato, cláusula, anexo, monto).
+
+    Si la consulta los menciona, ordena por similitud los fragmentos que los
+    contienen y completa con una búsqueda filtrada por archivo (filtro where
+    de Chroma), con un solo embedding y sin el LLM de reescritura. En otro
+    caso delega en fallback.
+    """
+
+    index: IdentifierIndex
+    vector_store: Any
+    fallback: BaseRetriever
+    k: int = SEARCH_K
+    max_candidates: int = IDENTIFIER_MAX_CANDIDATES
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        inicio = time.perf_counter()
+        # Mismo alcance que el resto de la búsqueda (route_projects, route_documents)
+        ruta = self.index.route(query, current_scope(), current_documents())
+        if ruta is None:
+            record_span("identificadores", time.perf_counter() - inicio, ruta="general")
+            return self.fallback.invoke(query)
+
+        embedding = self.vector_store.embeddings.embed_query(query)
+        docs = self._rank_direct(ruta["directos"][:self.max_candidates], embedding)
+        if len(docs) < self.k and ruta["fuentes"]:
+            filtro = {"source": {"$in": ruta["fuentes"]}} if len(ruta["fuentes"]) > 1 else {"source": ruta["fuentes"][0]}
+            vistos = {doc.page_content for doc in docs}
+            for doc in self.vector_store.similarity_search_by_vector(embedding, k=self.k, filter=filtro):
+                if len(docs) >= self.k:
+                    break
+                if doc.page_content not in vistos:
+                    docs.append(doc)
+
+        record_span(
+            "identificadores", time.perf_counter() - inicio, ruta="directa",
+            identificadores=[f"{tipo}:{valor}" for tipo, valor in ruta["identificadores"]],
+            candidatos=len(ruta["directos"]), documentos=len(docs),
+        )
+        if not docs:
+            return self.fallback.invoke(query)
+        return docs
+
+    def _rank_direct(self, ids, embedding):
+        """Ordena los fragmentos por similitud coseno con la consulta"""
+        if not ids:
+            return []
+        lote = self.vector_store._collection.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        if not len(lote["ids"]):
+            return []
+        matriz = np.asarray(lote["embeddings"], dtype=np.float32)
+        consulta = np.asarray(embedding, dtype=np.float32)
+        normas = np.linalg.norm(matriz, axis=1) * (np.linalg.norm(consulta) or 1.0)
+        similitudes = matriz @ consulta / np.where(normas == 0, 1.0, normas)
+        orden = np.argsort(-similitudes)[:self.k]
+        return [
+            Document(id=lote["ids"][i], page_content=lote["documents"][i], metadata=lote["metadatas"][i] or {})
+            for i in orden
+        ]
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_identifier_index():
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = IdentifierIndex()
+        return _shared_index
@@ -0,0 +1,223 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+from config import *
+from log_store import attach_log_file
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+
+class JobQueue:
+    """
+    Cola persistente de trabajos de ingesta en SQLite.
+
+    Sobrevive a reinicios de la app: el worker que procesa un trabajo lo
+    renueva con un latido y, si deja de latir por más de INGEST_JOB_LEASE
+    (proceso caído), otro worker lo devuelve a pendiente. Varios workers (la
+    app y uno independiente) pueden compartir la cola.
+    """
+
+    def __init__(self, path=INGEST_JOBS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                heartbeat REAL
+            )
+            """
+        )
+        # Colas creadas antes del latido
+        if "heartbeat" not in [fila[1] for fila in self._conn.execute("PRAGMA table_info(jobs)")]:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+        self._conn.commit()
+
+    def _row(self, fila):
+        if fila is None:
+            return None
+        claves = ["id", "estado", "creado", "iniciado", "terminado", "progreso", "mensaje"]
+        return dict(zip(claves, fila))
+
+    def submit(self):
+        """
+        Encola una ingesta. Si ya hay una pendiente se reutiliza, porque
+        procesará todos los archivos presentes en la carpeta al iniciar.
+        """
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (PENDIENTE,)
+            ).fetchone()
+            if fila:
+                return fila[0]
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (status, created, message) VALUES (?, ?, ?)",
+                (PENDIENTE, time.time(), "En cola"),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def claim(self):
+        """Toma el trabajo pendiente más antiguo y lo marca en proceso"""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (PENDIENTE,)
+            ).fetchone()
+            if fila is None:
+                return None
+            # La condición sobre status evita que dos procesos tomen el mismo trabajo
+            ahora = time.time()
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started = ?, heartbeat = ?, message = ? WHERE id = ? AND status = ?",
+                (EN_PROCESO, ahora, ahora, "Iniciando", fila[0], PENDIENTE),
+            )
+            self._conn.commit()
+            return fila[0] if cursor.rowcount == 1 else None
+
+    def update(self, job_id, progreso, mensaje):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, heartbeat = ? WHERE id = ?",
+                (progreso, mensaje, time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def heartbeat(self, job_id):
+        """Renueva el trabajo en proceso (lo llama el worker mientras lo procesa)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?", (time.time(), job_id, EN_PROCESO)
+            )
+            self._conn.commit()
+
+    def finish(self, job_id, estado, mensaje):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, progress = COALESCE(?, progress), message = ? WHERE id = ?",
+                (estado, time.time(), 1.0 if estado == COMPLETADO else None, mensaje, job_id),
+            )
+            self._conn.commit()
+
+    def recover(self, lease=INGEST_JOB_LEASE):
+        """
+        Devuelve a la cola los trabajos en proceso sin latido en los últimos
+        lease segundos (su worker se detuvo); los de otro worker vivo siguen.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, message = ? WHERE status = ? AND COALESCE(heartbeat, started, 0) < ?",
+                (PENDIENTE, "Reencolado tras reinicio", EN_PROCESO, time.time() - lease),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def get(self, job_id):
+        with self._lock:
+            return self._row(self._conn.execute(
+                "SELECT id, status, created, started, finished, progress, message FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone())
+
+    def latest(self):
+        with self._lock:
+            return self._row(self._conn.execute(
+                "SELECT id, status, created, started, finished, progress, message FROM jobs ORDER BY id DESC LIMIT 1"
+            ).fetchone())
+
+
+def _keep_alive(queue, job_id, terminado, intervalo=INGEST_JOB_HEARTBEAT):
+    # Las fases largas sin avance (publicación, cuantización) también renuevan el trabajo
+    while not terminado.wait(intervalo):
+        queue.heartbeat(job_id)
+
+
+def run_worker(queue, stop_event=None, poll_interval=1.0):
+    """Procesa trabajos de la cola uno a la vez hasta que se active stop_event"""
+    # Inicio y fallas de cada trabajo, y los eventos de la ingesta (rag_system),
+    # quedan en el historial de la pestaña Monitor
+    attach_log_file(logger)
+    attach_log_file(logging.getLogger("rag_system"))
+    while stop_event is None or not stop_event.is_set():
+        # Sin trabajo pendiente se revisan los de workers caídos
+        job_id = queue.claim()
+        if job_id is None and queue.recover():
+            job_id = queue.claim()
+        if job_id is None:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Trabajo de ingesta {job_id} iniciado.")
+        terminado = threading.Event()
+        threading.Thread(
+            target=_keep_alive, args=(queue, job_id, terminado), name="sinergia-ingesta-latido", daemon=True
+        ).start()
+        try:
+            # Import diferido: la app no carga el sistema RAG hasta que lo necesita
+            from rag_system import ingest_docs
+            ingest_docs(progress=lambda fraccion, mensaje: queue.update(job_id, fraccion, mensaje))
+            queue.finish(job_id, COMPLETADO, "Índice actualizado")
+        except Exception as e:
+            logger.error(f"Trabajo de ingesta {job_id} falló: {e}\n{traceback.format_exc()}")
+            queue.finish(job_id, ERROR, str(e))
+        finally:
+            terminado.set()
+
+
+_shared_queue = None
+_worker_thread = None
+_shared_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _shared_queue
+    with _shared_lock:
+        if _shared_queue is None:
+            _shared_queue = JobQueue()
+        return _shared_queue
+
+
+def ensure_worker():
+    """Arranca (una sola vez por proceso) el hilo que atiende la cola de ingesta"""
+    global _worker_thread
+    queue = get_job_queue()
+    with _shared_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(
+                target=run_worker, args=(queue,), name="sinergia-ingesta", daemon=True
+            )
+            _worker_thread.start()
+    return queue
+
+
+def submit_ingest_job():
+    """
+    Encola una ingesta. Si INGEST_WORKER_IN_APP está activo se asegura de que
+    haya un hilo atendiéndola; si no, la procesa el worker independiente.
+    """
+    queue = ensure_worker() if INGEST_WORKER_IN_APP else get_job_queue()
+    return queue.submit()
+
+
+if __name__ == "__main__":
+    # Worker independiente: python ingest_jobs.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(message)s')
+    run_worker(get_job_queue())
@@ -0,0 +1,127 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from clause_splitter import get_text_splitter, inherit_structure
+from config import *
+from metrics import record_span
+
+
+# Este módulo no importa streamlit ni el sistema RAG: los procesos del pool
+# lo importan de nuevo al arrancar (spawn en Windows).
+
+def count_pages(path):
+    return len(PdfReader(path).pages)
+
+
+def parse_page_range(path, start, end, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, strategy=CHUNK_STRATEGY):
+    """
+    Extrae y fragmenta las páginas [start, end) de un PDF dentro de un proceso del pool.
+
+    Devuelve tuplas (texto, metadatos) para que la transferencia entre procesos
+    sea ligera, junto con la duración de la lectura y de la fragmentación y la
+    estructura (cláusula, sección) con la que termina el rango.
+    """
+    inicio = time.perf_counter()
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    paginas = [
+        Document(
+            page_content=reader.pages[page].extract_text() or "",
+            metadata={"source": path, "page": page, "total_pages": total_pages},
+        )
+        for page in range(start, min(end, total_pages))
+    ]
+    t_lectura = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    text_splitter = get_text_splitter(strategy, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    fragmentos = [(doc.page_content, doc.metadata) for doc in text_splitter.split_documents(paginas)]
+    t_fragmentacion = time.perf_counter() - inicio
+
+    return {
+        "fragmentos": fragmentos,
+        "estructura": getattr(text_splitter, "states", {}).get(path),
+        "paginas": len(paginas),
+        "t_lectura": t_lectura,
+        "t_fragmentacion": t_fragmentacion,
+    }
+
+
+def _page_tasks(archivos, pages_per_task):
+    """Genera (nombre, path, inicio, fin, es_ultima) por cada rango de páginas de cada archivo"""
+    for nombre, path in archivos.items():
+        total = count_pages(path)
+        if total == 0:
+            yield nombre, path, 0, 0, True
+            continue
+        for start in range(0, total, pages_per_task):
+            end = min(start + pages_per_task, total)
+            yield nombre, path, start, end, end == total
+
+
+def stream_chunks(archivos, max_workers=INGEST_WORKERS, pages_per_task=INGEST_PAGES_PER_TASK):
+    """
+    Fragmenta PDFs en paralelo y entrega los fragmentos conforme se producen.
+
+    archivos es {nombre: path}. Produce tuplas (nombre, docs, fin_archivo) en el
+    orden original de archivos y páginas, de modo que los IDs por posición son
+    estables. Como máximo hay 2 * max_workers rangos en vuelo: si el consumidor
+    (el embedding) es más lento, el pool deja de recibir trabajo y la memoria
+    se mantiene acotada. La cláusula en curso al final de un rango pasa a los
+    primeros fragmentos del siguiente.
+    """
+    tareas = _page_tasks(archivos, pages_per_task)
+    estructura = {}
+
+    if max_workers <= 1:
+        for nombre, path, start, end, fin in tareas:
+            yield nombre, _to_documents(parse_page_range(path, start, end), estructura, nombre), fin
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        en_vuelo = deque()
+        for nombre, path, start, end, fin in tareas:
+            en_vuelo.append((nombre, fin, pool.submit(parse_page_range, path, start, end)))
+            if len(en_vuelo) >= 2 * max_workers:
+                nombre_listo, fin_listo, futuro = en_vuelo.popleft()
+                yield nombre_listo, _to_documents(futuro.result(), estructura, nombre_listo), fin_listo
+        while en_vuelo:
+            nombre_listo, fin_listo, futuro = en_vuelo.popleft()
+            yield nombre_listo, _to_documents(futuro.result(), estructura, nombre_listo), fin_listo
+
+
+def _to_documents(resultado, estructura, nombre):
+    # Los tiempos medidos en el proceso del pool se registran en la traza activa
+    record_span("lectura_pdf", resultado["t_lectura"], paginas=resultado["paginas"])
+    record_span("fragmentacion", resultado["t_fragmentacion"], fragmentos=len(resultado["fragmentos"]))
+    docs = [Document(page_content=texto, metadata=metadata) for texto, metadata in resultado["fragmentos"]]
+    inherit_structure(docs, estructura.get(nombre))
+    if resultado.get("estructura"):
+        estructura[nombre] = resultado["estructura"]
+    return docs
+
+
+def iter_batches(archivos, batch_size=INGEST_BATCH_SIZE, **kwargs):
+    """
+    Agrupa los fragmentos de stream_chunks en lotes de hasta batch_size.
+
+    Produce (lote, completados) donde lote es una lista de (nombre, doc) y
+    completados son los archivos cuyo último fragmento está en este lote o
+    antes, listos para registrarse en el manifiesto tras subir el lote.
+    """
+    lote = []
+    completados = []
+    for nombre, docs, fin in stream_chunks(archivos, **kwargs):
+        for doc in docs:
+            lote.append((nombre, doc))
+            if len(lote) >= batch_size:
+                yield lote, completados
+                lote, completados = [], []
+        if fin:
+            completados.append(nombre)
+    if lote or completados:
+        yield lote, completados
@@ -0,0 +1,237 @@
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from logging.handlers import BaseRotatingHandler
+
+from config import *
+
+
+class LogIndex:
+    """
+    Índice de los registros del log en SQLite: archivo, posición en bytes,
+    longitud, fecha y nivel. Permite filtrar por nivel y fecha leyendo solo
+    los registros que coinciden, sin recorrer el archivo.
+    """
+
+    def __init__(self, path=LOG_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                file TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                created REAL NOT NULL,
+                levelno INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_created ON records(created);
+            CREATE INDEX IF NOT EXISTS idx_records_level ON records(levelno, created);
+            CREATE INDEX IF NOT EXISTS idx_records_file ON records(file);
+            """
+        )
+        self._conn.commit()
+
+    def add(self, archivo, offset, length, created, levelno):
+        with self._lock:
+            self._conn.execute("INSERT INTO records VALUES (?, ?, ?, ?, ?)", (archivo, offset, length, created, levelno))
+            self._conn.commit()
+
+    def rename(self, viejo, nuevo):
+        with self._lock:
+            self._conn.execute("UPDATE records SET file = ? WHERE file = ?", (nuevo, viejo))
+            self._conn.commit()
+
+    def drop(self, archivo):
+        with self._lock:
+            self._conn.execute("DELETE FROM records WHERE file = ?", (archivo,))
+            self._conn.commit()
+
+    def first_record(self, archivo):
+        """Fecha del registro más antiguo de un archivo (None si no tiene)"""
+        with self._lock:
+            return self._conn.execute("SELECT MIN(created) FROM records WHERE file = ?", (archivo,)).fetchone()[0]
+
+    def query(self, min_level=None, since=None, until=None, limit=200):
+        """
+        Devuelve los textos de los registros más recientes que cumplen el
+        filtro, en orden cronológico.
+        """
+        condiciones, parametros = [], []
+        if min_level is not None:
+            condiciones.append("levelno >= ?")
+            parametros.append(min_level)
+        if since is not None:
+            condiciones.append("created >= ?")
+            parametros.append(since)
+        if until is not None:
+            condiciones.append("created < ?")
+            parametros.append(until)
+        consulta = "SELECT file, offset, length FROM records"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY created DESC, rowid DESC LIMIT ?"
+        with self._lock:
+            filas = self._conn.execute(consulta, parametros + [limit]).fetchall()
+        return read_records(list(reversed(filas)))
+
+
+def read_records(filas):
+    """Lee (archivo, offset, longitud) agrupando por archivo; los .gz se leen descomprimiendo"""
+    textos = {}
+    por_archivo = {}
+    for i, (archivo, offset, longitud) in enumerate(filas):
+        por_archivo.setdefault(archivo, []).append((offset, longitud, i))
+    for archivo, registros in por_archivo.items():
+        abrir = gzip.open if archivo.endswith(".gz") else open
+        try:
+            with abrir(archivo, "rb") as f:
+                for offset, longitud, i in sorted(registros):
+                    f.seek(offset)
+                    textos[i] = f.read(longitud).decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            continue
+    return [textos[i] for i in sorted(textos)]
+
+
+def tail_lines(path, n=20, block_size=8192):
+    """
+    Últimas n líneas de un archivo leyendo bloques desde el final: el costo
+    depende de n y no del tamaño del archivo.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        posicion = f.tell()
+        datos = b""
+        while posicion > 0 and datos.count(b"\n") <= n:
+            leer = min(block_size, posicion)
+            posicion -= leer
+            f.seek(posicion)
+            datos = f.read(leer) + datos
+    lineas = datos.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return lineas[-n:]
+
+
+class RotatingLogHandler(BaseRotatingHandler):
+    """
+    Handler de archivo que rota al superar max_bytes o max_age segundos.
+
+    El archivo rotado se comprime con gzip (historial_db.log.AAAAMMDD-HHMMSS.gz)
+    y se conservan los backup_count más recientes. Cada registro escrito se
+    anota en LogIndex con su posición para filtrarlo después.
+    """
+
+    def __init__(self, filename=LOG_PATH, max_bytes=LOG_MAX_BYTES, max_age=LOG_MAX_AGE,
+                 backup_count=LOG_BACKUP_COUNT, index=None):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, mode="a", encoding="utf-8")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.index = index
+        self._size = os.path.getsize(self.baseFilename)
+        primero = index.first_record(self.baseFilename) if index else None
+        self._opened = primero or time.time()
+
+    def _open(self):
+        # Sin traducción de fin de línea: las posiciones del índice son bytes exactos
+        return open(self.baseFilename, self.mode, encoding=self.encoding, newline="")
+
+    def shouldRollover(self, record):
+        if not self._size:
+            return False
+        return self._size >= self.max_bytes or record.created - self._opened >= self.max_age
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        marca = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._opened))
+        archivo = f"{self.baseFilename}.{marca}.gz"
+        n = 1
+        while os.path.exists(archivo):
+            archivo = f"{self.baseFilename}.{marca}-{n}.gz"
+            n += 1
+        with open(self.baseFilename, "rb") as origen, gzip.open(archivo, "wb") as destino:
+            shutil.copyfileobj(origen, destino)
+        os.remove(self.baseFilename)
+        if self.index:
+            self.index.rename(self.baseFilename, archivo)
+
+        for viejo in archived_logs(self.baseFilename)[self.backup_count:]:
+            os.remove(viejo)
+            if self.index:
+                self.index.drop(viejo)
+
+        self.stream = self._open()
+        self._size = 0
+        self._opened = time.time()
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            texto = self.format(record) + self.terminator
+            longitud = len(texto.encode("utf-8"))
+            # Posición real del final del archivo (otro proceso pudo escribir)
+            offset = os.fstat(self.stream.fileno()).st_size
+            self.stream.write(texto)
+            self.flush()
+            self._size = offset + longitud
+            if self.index:
+                self.index.add(self.baseFilename, offset, longitud, record.created, record.levelno)
+        except Exception:
+            self.handleError(record)
+
+
+def archived_logs(path=LOG_PATH):
+    """Archivos rotados, del más reciente al más antiguo"""
+    archivos = glob.glob(glob.escape(os.path.abspath(path)) + ".*.gz")
+    return sorted(archivos, key=lambda archivo: (os.path.getmtime(archivo), archivo), reverse=True)
+
+
+_shared_index = None
+_shared_handler = None
+_shared_lock = threading.Lock()
+
+
+def get_log_index():
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = LogIndex()
+        return _shared_index
+
+
+def get_log_handler():
+    """Handler del historial compartido por todos los loggers del proceso"""
+    global _shared_handler
+    indice = get_log_index()
+    with _shared_lock:
+        if _shared_handler is None:
+            _shared_handler = RotatingLogHandler(index=indice)
+            _shared_handler.setFormatter(logging.Formatter('%(asctime)s - [%(levelname)s] - %(message)s'))
+        return _shared_handler
+
+
+def attach_log_file(logger):
+    """Envía los registros de logger al historial (una sola vez)"""
+    handler = get_log_handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,217 @@
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Traza activa en el contexto actual (se propaga a tareas asyncio y asyncio.to_thread)
+_current_trace = contextvars.ContextVar("sinergia_trace", default=None)
+
+
+class MetricsStore:
+    """
+    Almacén local de trazas y etapas (spans) en SQLite.
+
+    Una traza corresponde a una consulta o a una ingesta; cada etapa guarda su
+    duración y atributos (tokens, documentos, aciertos de caché, etc.). Se
+    conservan las últimas max_traces trazas.
+    """
+
+    def __init__(self, path=METRICS_DB_PATH, max_traces=METRICS_MAX_TRACES):
+        self.path = path
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS traces (
+                trace_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                label TEXT,
+                start REAL NOT NULL,
+                duration REAL NOT NULL,
+                attrs TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_traces_kind ON traces(kind, start);
+            CREATE TABLE IF NOT EXISTS spans (
+                trace_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                start REAL NOT NULL,
+                duration REAL NOT NULL,
+                attrs TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans(trace_id);
+            CREATE INDEX IF NOT EXISTS idx_spans_name ON spans(name, start);
+            """
+        )
+        self._conn.commit()
+
+    def save(self, traza):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?, ?, ?)",
+                (traza.trace_id, traza.kind, traza.label, traza.start, traza.duration,
+                 json.dumps(traza.attrs, ensure_ascii=False, default=str)),
+            )
+            self._conn.executemany(
+                "INSERT INTO spans VALUES (?, ?, ?, ?, ?)",
+                [(traza.trace_id, nombre, inicio, duracion, json.dumps(attrs, ensure_ascii=False, default=str))
+                 for nombre, inicio, duracion, attrs in traza.spans],
+            )
+            self._trim()
+            self._conn.commit()
+
+    def _trim(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM traces").fetchone()[0]
+        if total > self.max_traces:
+            viejas = [
+                fila[0] for fila in self._conn.execute(
+                    "SELECT trace_id FROM traces ORDER BY start ASC LIMIT ?", (total - self.max_traces,)
+                )
+            ]
+            self._conn.executemany("DELETE FROM spans WHERE trace_id = ?", [(t,) for t in viejas])
+            self._conn.executemany("DELETE FROM traces WHERE trace_id = ?", [(t,) for t in viejas])
+
+    def stage_durations(self, kind="consulta", since=None):
+        """Lista de (etapa, duración en s) de las trazas del tipo indicado"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT s.name, s.duration FROM spans s JOIN traces t ON t.trace_id = s.trace_id "
+                "WHERE t.kind = ? AND t.start >= ?",
+                (kind, since or 0),
+            ).fetchall()
+
+    def trace_durations(self, kind="consulta", since=None):
+        with self._lock:
+            return [
+                fila[0] for fila in self._conn.execute(
+                    "SELECT duration FROM traces WHERE kind = ? AND start >= ?", (kind, since or 0)
+                )
+            ]
+
+    def slowest_traces(self, kind="consulta", limit=10):
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT trace_id, label, start, duration, attrs FROM traces "
+                "WHERE kind = ? ORDER BY duration DESC LIMIT ?",
+                (kind, limit),
+            ).fetchall()
+        return [
+            {"trace_id": t, "etiqueta": label, "inicio": inicio, "duracion": duracion, "atributos": json.loads(attrs)}
+            for t, label, inicio, duracion, attrs in filas
+        ]
+
+    def trace_spans(self, trace_id):
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT name, start, duration, attrs FROM spans WHERE trace_id = ? ORDER BY start", (trace_id,)
+            ).fetchall()
+        return [
+            {"etapa": nombre, "inicio": inicio, "duracion": duracion, "atributos": json.loads(attrs)}
+            for nombre, inicio, duracion, attrs in filas
+        ]
+
+
+class Trace:
+    def __init__(self, kind, label=None):
+        self.trace_id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.start = time.time()
+        self.duration = 0.0
+        self.attrs = {}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add_span(self, nombre, inicio, duracion, attrs):
+        with self._lock:
+            self.spans.append((nombre, inicio, duracion, attrs))
+
+
+class Span:
+    def __init__(self):
+        self.attrs = {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def trace(kind, label=None):
+    """
+    Abre una traza (consulta o ingesta) y la guarda al terminar.
+
+    Las etapas registradas con span() o record_span() dentro del bloque,
+    incluidas tareas asyncio creadas en él, quedan asociadas a esta traza.
+    """
+    traza = Trace(kind, label)
+    token = _current_trace.set(traza)
+    inicio = time.perf_counter()
+    try:
+        yield traza
+    except Exception as e:
+        traza.set(error=str(e))
+        raise
+    finally:
+        traza.duration = time.perf_counter() - inicio
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Generadores consumidos desde otro contexto (streaming)
+            _current_trace.set(None)
+        if ENABLE_METRICS:
+            try:
+                get_metrics_store().save(traza)
+            except Exception as e:
+                # Las métricas nunca deben tumbar una consulta
+                logger.warning(f"No se pudo guardar la traza: {e}")
+
+
+@contextmanager
+def span(nombre, **attrs):
+    """Mide una etapa dentro de la traza activa (no hace nada si no hay traza)"""
+    etapa = Span()
+    etapa.set(**attrs)
+    inicio_pared = time.time()
+    inicio = time.perf_counter()
+    try:
+        yield etapa
+    finally:
+        record_span(nombre, time.perf_counter() - inicio, inicio=inicio_pared, **etapa.attrs)
+
+
+def record_span(nombre, duracion, inicio=None, **attrs):
+    """Registra una etapa ya medida en la traza activa"""
+    traza = _current_trace.get()
+    if traza is not None:
+        traza.add_span(nombre, inicio if inicio is not None else time.time() - duracion, duracion, attrs)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_metrics_store():
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = MetricsStore()
+        return _shared_store
@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from dotenv import load_dotenv
+from clients import indexed_projects, open_vector_store, reset_clients
+from config import *
+from embedding_batcher import EmbeddingBatcher
+from embeddings_cache import get_embeddings
+from numpy_store import get_numpy_index
+from projects import collection_name
+from vector_quantization import (
+    QuantizedVectorStore, collection_dimensions, get_quantized_store, iter_collection, normalize,
+    truncate_dimensions,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def make_transform(dims, reembed):
+    """
+    Función lote -> vectores nuevos. Por defecto trunca los vectores existentes
+    (gemini-embedding-001 es Matryoshka) sin llamar al API; con reembed los
+    vuelve a pedir con la dimensión de config (pasando por la caché).
+    """
+    if reembed:
+        batcher = EmbeddingBatcher(get_embeddings())
+        return lambda lote: normalize(batcher.embed_documents(lote["documents"]))
+    if dims is None:
+        return lambda lote: np.asarray(lote["embeddings"], dtype=np.float32)
+    return lambda lote: truncate_dimensions(lote["embeddings"], dims)
+
+
+class _TopK:
+    """Los k vecinos más cercanos (por producto punto) de un conjunto de consultas, por lotes"""
+
+    def __init__(self, consultas, filas_propias, k):
+        self.consultas = consultas
+        self.filas_propias = filas_propias
+        self.k = k
+        self.puntajes = np.full((len(consultas), k), -np.inf, dtype=np.float32)
+        self.filas = np.full((len(consultas), k), -1, dtype=np.int64)
+
+    def update(self, vectores, inicio):
+        puntajes = self.consultas @ vectores.T
+        filas = np.arange(inicio, inicio + len(vectores))
+        # La consulta no cuenta como su propio vecino
+        propias = (self.filas_propias[:, None] == filas[None, :])
+        puntajes[propias] = -np.inf
+        todos = np.concatenate([self.puntajes, puntajes], axis=1)
+        todas_filas = np.concatenate([self.filas, np.broadcast_to(filas, puntajes.shape)], axis=1)
+        mejores = np.argpartition(-todos, self.k - 1, axis=1)[:, :self.k]
+        self.puntajes = np.take_along_axis(todos, mejores, axis=1)
+        self.filas = np.take_along_axis(todas_filas, mejores, axis=1)
+
+
+def evaluate(collection, transform, quantization, sample=200, k=10, batch_size=1000, seed=42):
+    """
+    Mide el recall@k de la configuración nueva contra la búsqueda exacta con
+    los vectores actuales, usando fragmentos de la colección como consultas.
+    """
+    total = collection.count()
+    rng = np.random.default_rng(seed)
+    filas_muestra = np.sort(rng.choice(total, size=min(sample, total), replace=False))
+    incluir = ("embeddings", "metadatas", "documents")
+
+    # Primera pasada: vectores (actuales y nuevos) de las consultas de muestra
+    consultas_actuales, consultas_nuevas = [], []
+    inicio = 0
+    for lote in iter_collection(collection, batch_size, include=incluir):
+        locales = filas_muestra[(filas_muestra >= inicio) & (filas_muestra < inicio + len(lote["ids"]))] - inicio
+        if len(locales):
+            consultas_actuales.append(normalize(np.asarray(lote["embeddings"])[locales]))
+            consultas_nuevas.append(transform({
+                "embeddings": np.asarray(lote["embeddings"])[locales],
+                "documents": [lote["documents"][i] for i in locales],
+            }))
+        inicio += len(lote["ids"])
+    consultas_actuales = np.concatenate(consultas_actuales)
+    consultas_nuevas = normalize(np.concatenate(consultas_nuevas))
+
+    exacto_actual = _TopK(consultas_actuales, filas_muestra, k)
+    exacto_nuevo = _TopK(consultas_nuevas, filas_muestra, k)
+    ids = []
+
+    def lotes_nuevos():
+        # Segunda pasada: vecinos exactos con ambas configuraciones y vectores para el índice cuantizado
+        fila = 0
+        for lote in iter_collection(collection, batch_size, include=incluir):
+            nuevos = transform(lote)
+            exacto_actual.update(normalize(lote["embeddings"]), fila)
+            exacto_nuevo.update(normalize(nuevos), fila)
+            ids.extend(lote["ids"])
+            fila += len(lote["ids"])
+            yield lote["ids"], nuevos, [(m or {}).get("source") for m in lote["metadatas"]]
+
+    def recall(filas_encontradas):
+        aciertos = [
+            len(set(encontradas) & set(verdad)) / k
+            for encontradas, verdad in zip(filas_encontradas, exacto_actual.filas.tolist())
+        ]
+        return round(float(np.mean(aciertos)), 4)
+
+    directorio = tempfile.mkdtemp(prefix="sinergia_migracion_")
+    try:
+        reporte = {"vectores": total, "consultas": len(filas_muestra), "k": k}
+        if quantization:
+            store = QuantizedVectorStore(path=directorio)
+            store.build(lotes_nuevos(), total, quantization)
+        else:
+            for _ in lotes_nuevos():
+                pass
+
+        dims_actuales = consultas_actuales.shape[1]
+        dims_nuevas = consultas_nuevas.shape[1]
+        reporte["dimensiones"] = {"actual": dims_actuales, "nueva": dims_nuevas}
+        reporte["memoria_mb"] = {
+            "vectores_actuales": round(total * dims_actuales * 4 / 2 ** 20, 2),
+            "vectores_nuevos": round(total * dims_nuevas * 4 / 2 ** 20, 2),
+        }
+        reporte["recall"] = {"dimension_reducida": recall(exacto_nuevo.filas.tolist())}
+
+        if quantization:
+            posicion = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            for rescore, nombre in ((False, "cuantizado_sin_reordenar"), (True, "cuantizado_reordenado")):
+                encontradas, tiempos = [], []
+                for consulta, propia in zip(consultas_nuevas, filas_muestra):
+                    inicio = time.perf_counter()
+                    resultados = store.search(consulta, k=k + 1, rescore=rescore)
+                    tiempos.append(time.perf_counter() - inicio)
+                    filas = [posicion[chunk_id] for chunk_id, _, _ in resultados if posicion[chunk_id] != propia]
+                    encontradas.append(filas[:k])
+                reporte["recall"][nombre] = recall(encontradas)
+                reporte.setdefault("busqueda_ms", {})[nombre] = round(1000 * float(np.mean(tiempos)), 3)
+
+            stats = store.stats()
+            reporte["memoria_mb"]["codigos_en_memoria"] = stats["memoria_codigos_mb"]
+            reporte["cuantizacion"] = quantization
+        return reporte
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def migrate(vector_store, transform, batch_size=1000):
+    """
+    Reescribe la colección con los vectores nuevos en una colección temporal
+    y la pone en lugar de la original al terminar.
+    """
+    original = vector_store._collection
+    nombre = original.name
+    cliente = vector_store._client
+    temporal = cliente.create_collection(f"{nombre}_migracion_{uuid.uuid4().hex[:8]}", metadata=original.metadata)
+
+    copiados = 0
+    for lote in iter_collection(original, batch_size, include=("embeddings", "documents", "metadatas")):
+        temporal.upsert(
+            ids=lote["ids"], embeddings=transform(lote).tolist(),
+            documents=lote["documents"], metadatas=lote["metadatas"],
+        )
+        copiados += len(lote["ids"])
+        logger.info(f"Migrados {copiados} vectores...")
+
+    logger.info(f"Reemplazando la colección '{nombre}' (si se interrumpe, los datos quedan en '{temporal.name}').")
+    cliente.delete_collection(nombre)
+    temporal.modify(name=nombre)
+    return copiados
+
+
+def migrate_project(proyecto, args):
+    """Evalúa y migra la colección de un proyecto; devuelve True si reescribió vectores"""
+    vector_store = open_vector_store(get_embeddings(), collection_name=collection_name(proyecto))
+    collection = vector_store._collection
+    dims_actuales = collection_dimensions(collection)
+    if dims_actuales is None:
+        print(f"[{proyecto}] La colección está vacía; no hay nada que migrar.")
+        return False
+    if EMBEDDING_DIMENSIONS and EMBEDDING_DIMENSIONS > dims_actuales and not args.reembed:
+        print(f"[{proyecto}] No se puede pasar de {dims_actuales} a {EMBEDDING_DIMENSIONS} dimensiones sin --reembed.")
+        return False
+
+    cambia_dimension = args.reembed or (EMBEDDING_DIMENSIONS and EMBEDDING_DIMENSIONS != dims_actuales)
+    transform = make_transform(EMBEDDING_DIMENSIONS if cambia_dimension else None, args.reembed)
+
+    print(f"--- [{proyecto}] Evaluando {dims_actuales} -> {EMBEDDING_DIMENSIONS or dims_actuales} dimensiones, "
+          f"cuantización {VECTOR_QUANTIZATION or 'ninguna'} ---")
+    reporte = evaluate(collection, transform, VECTOR_QUANTIZATION, args.sample, args.k, args.batch_size)
+    print(json.dumps(reporte, ensure_ascii=False, indent=2))
+    if args.report_only:
+        return False
+
+    if cambia_dimension:
+        total = migrate(vector_store, transform, args.batch_size)
+        print(f"[{proyecto}] Colección migrada: {total} vectores de {EMBEDDING_DIMENSIONS} dimensiones.")
+        vector_store = open_vector_store(get_embeddings(), collection_name=collection_name(proyecto))
+
+    if VECTOR_QUANTIZATION:
+        get_quantized_store(proyecto).rebuild(vector_store._collection)
+        print(f"[{proyecto}] Índice cuantizado listo: {get_quantized_store(proyecto).stats()}")
+    if VECTOR_BACKEND == "numpy":
+        get_numpy_index(proyecto).rebuild(vector_store._collection)
+        print(f"[{proyecto}] Índice NumPy listo: {get_numpy_index(proyecto).stats()}")
+    return bool(cambia_dimension)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migra las colecciones Chroma a EMBEDDING_DIMENSIONS y construye el índice VECTOR_QUANTIZATION"
+    )
+    parser.add_argument("--reembed", action="store_true",
+                        help="Volver a embeber con el API en lugar de truncar los vectores existentes")
+    parser.add_argument("--report-only", action="store_true", help="Solo medir recall y memoria, sin migrar")
+    parser.add_argument("--sample", type=int, default=200, help="Fragmentos usados como consultas de prueba")
+    parser.add_argument("--k", type=int, default=SEARCH_K * 2, help="Vecinos para el recall@k")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--project", action="append", default=None,
+                        help="Proyecto a migrar (se puede repetir; por defecto todos)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - %(message)s')
+
+    migrados = [proyecto for proyecto in (args.project or indexed_projects()) if migrate_project(proyecto, args)]
+    if migrados:
+        # Import diferido: rag_system carga streamlit y los modelos de chat
+        from answer_cache import get_answer_cache
+        from rag_system import bump_index_version
+
+        version = bump_index_version()
+        get_answer_cache().clear()
+        reset_clients()
+        print(f"Proyectos migrados: {migrados} (índice v{version}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from config import *
+from projects import project_path
+from vector_quantization import _sources_filter, collection_space, iter_collection, normalize
+
+logger = logging.getLogger(__name__)
+
+
+def distances(space, productos, normas2, consultas):
+    """
+    Distancias con la misma métrica que Chroma a partir de los productos
+    consulta-vector (m, n) y las normas al cuadrado de los vectores (n,).
+    """
+    if space == "ip":
+        return 1.0 - productos
+    if space == "cosine":
+        normas = np.sqrt(normas2)[None, :] * np.linalg.norm(consultas, axis=1)[:, None]
+        return 1.0 - productos / np.where(normas == 0, 1.0, normas)
+    return normas2[None, :] + (consultas * consultas).sum(axis=1)[:, None] - 2 * productos
+
+
+def mmr_batch(consultas, candidatos, k, lambda_mult=MMR_DIVERSITY_LAMBDA, validos=None):
+    """
+    MMR de varias consultas a la vez (mismo criterio que maximal_marginal_relevance
+    de LangChain, con similitud coseno).
+
+    consultas: (m, d); candidatos: (m, c, d); validos: (m, c) marca los
+    candidatos reales cuando las consultas tienen distinto número (el resto
+    es relleno). Devuelve (m, min(k, c)) posiciones de los candidatos
+    elegidos en orden de elección, con -1 donde no quedaban candidatos.
+    """
+    consultas = normalize(consultas)
+    candidatos = normalize(candidatos)
+    m, c = candidatos.shape[:2]
+    k = min(k, c)
+    similitud = np.einsum("md,mcd->mc", consultas, candidatos)
+    entre_si = np.einsum("mcd,med->mce", candidatos, candidatos)
+
+    filas = np.arange(m)
+    elegidos = np.full((m, k), -1, dtype=np.int64)
+    disponibles = np.ones((m, c), dtype=bool) if validos is None else np.array(validos, dtype=bool)
+    redundancia = np.zeros((m, c), dtype=np.float32)
+    for paso in range(k):
+        # El primero es el más parecido a la consulta; luego se penaliza la redundancia
+        puntaje = similitud if paso == 0 else lambda_mult * similitud - (1 - lambda_mult) * redundancia
+        elegido = np.where(disponibles, puntaje, -np.inf).argmax(axis=1)
+        hay = disponibles[filas, elegido]
+        elegidos[hay, paso] = elegido[hay]
+        disponibles[filas, elegido] = False
+        redundancia = np.maximum(redundancia, entre_si[filas, elegido])
+    return elegidos
+
+
+class NumpyVectorIndex:
+    """
+    Motor vectorial en memoria: matriz de embeddings contigua (float32 o
+    float16) en un memmap y una tabla de fragmentos (ID, texto, metadatos)
+    en SQLite.
+
+    Las búsquedas son exactas: un producto matricial por bloques para todas
+    las consultas de una llamada y top-k con argpartition, con la misma
+    métrica que la colección Chroma de origen. Es un índice derivado: se
+    construye desde la colección tras cada ingesta, se publica de forma
+    atómica y se recarga solo al cambiar.
+    """
+
+    def __init__(self, path=NUMPY_INDEX_PATH, dtype=NUMPY_INDEX_DTYPE, block_rows=NUMPY_BLOCK_ROWS):
+        self.path = path
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self._lock = threading.Lock()
+        self._cargado = None  # mtime del puntero current.json cargado
+        self._datos = None
+
+    # --- Construcción ---
+
+    def rebuild(self, collection, batch_size=1000):
+        """Reconstruye el índice a partir de una colección Chroma"""
+        if self.dtype not in ("float32", "float16"):
+            raise ValueError(f"Tipo no soportado para el motor NumPy: {self.dtype}")
+        total = collection.count()
+        os.makedirs(self.path, exist_ok=True)
+        build_id = uuid.uuid4().hex[:8]
+        destino = os.path.join(self.path, build_id)
+        os.makedirs(destino)
+
+        conn = sqlite3.connect(os.path.join(destino, "chunks.sqlite3"))
+        conn.execute(
+            "CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL, document TEXT, metadata TEXT)"
+        )
+        vectores = normas2 = codigos_fuente = None
+        fuentes = {}
+        fila = 0
+        for lote in iter_collection(collection, batch_size, include=("embeddings", "documents", "metadatas")):
+            matriz = np.asarray(lote["embeddings"], dtype=np.float32).astype(self.dtype)
+            if vectores is None:
+                vectores = np.lib.format.open_memmap(
+                    os.path.join(destino, "vectors.npy"), mode="w+", dtype=self.dtype,
+                    shape=(total, matriz.shape[1]),
+                )
+                normas2 = np.zeros(total, dtype=np.float32)
+                codigos_fuente = np.zeros(total, dtype=np.int32)
+            # La colección pudo crecer durante el recorrido: lo excedente se omite
+            n = min(len(lote["ids"]), total - fila)
+            if n <= 0:
+                break
+            fin = fila + n
+            vectores[fila:fin] = matriz[:n]
+            # Normas de los vectores ya redondeados, para que las distancias sean coherentes
+            normas2[fila:fin] = (matriz[:n].astype(np.float32) ** 2).sum(axis=1)
+            metadatos = [m or {} for m in lote["metadatas"][:n]]
+            for i, metadata in enumerate(metadatos):
+                codigos_fuente[fila + i] = fuentes.setdefault(metadata.get("source"), len(fuentes))
+            conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                [
+                    (fila + i, chunk_id, documento, json.dumps(metadata, ensure_ascii=False))
+                    for i, (chunk_id, documento, metadata) in enumerate(zip(lote["ids"], lote["documents"], metadatos))
+                ],
+            )
+            fila = fin
+        conn.commit()
+        conn.close()
+
+        if vectores is None:
+            shutil.rmtree(destino, ignore_errors=True)
+            logger.info("Índice NumPy: la colección está vacía.")
+            return 0
+        dims = int(vectores.shape[1])
+        vectores.flush()
+        del vectores
+        np.save(os.path.join(destino, "norms.npy"), normas2[:fila])
+        np.save(os.path.join(destino, "sources.npy"), codigos_fuente[:fila])
+        with open(os.path.join(destino, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "dtype": self.dtype, "space": collection_space(collection), "count": fila, "dims": dims,
+                "sources": sorted(fuentes, key=fuentes.get),
+            }, f, ensure_ascii=False)
+
+        # Publicación atómica: el puntero cambia cuando el índice ya está completo
+        temporal = os.path.join(self.path, "current.json.tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"build": build_id}, f)
+        os.replace(temporal, os.path.join(self.path, "current.json"))
+
+        for nombre in os.listdir(self.path):
+            anterior = os.path.join(self.path, nombre)
+            if nombre != build_id and os.path.isdir(anterior):
+                # En Windows puede fallar si otro proceso aún tiene el memmap abierto
+                shutil.rmtree(anterior, ignore_errors=True)
+        logger.info(f"Índice NumPy ({self.dtype}) reconstruido con {fila} vectores.")
+        return fila
+
+    # --- Consulta ---
+
+    def _ensure_loaded(self):
+        puntero = os.path.join(self.path, "current.json")
+        try:
+            mtime = os.path.getmtime(puntero)
+        except OSError:
+            self._datos = None
+            return None
+        with self._lock:
+            if self._cargado != mtime:
+                with open(puntero, encoding="utf-8") as f:
+                    directorio = os.path.join(self.path, json.load(f)["build"])
+                with open(os.path.join(directorio, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                if self._datos is not None:
+                    self._datos["conn"].close()
+                self._datos = {
+                    "meta": meta,
+                    "fuentes": {fuente: i for i, fuente in enumerate(meta["sources"])},
+                    "vectores": np.load(os.path.join(directorio, "vectors.npy"), mmap_mode="r")[:meta["count"]],
+                    "normas2": np.load(os.path.join(directorio, "norms.npy")),
+                    "codigos_fuente": np.load(os.path.join(directorio, "sources.npy")),
+                    "conn": sqlite3.connect(os.path.join(directorio, "chunks.sqlite3"), check_same_thread=False),
+                }
+                self._cargado = mtime
+            return self._datos
+
+    def available(self):
+        return self._ensure_loaded() is not None
+
+    def _rows(self, datos, sources):
+        """Filas de los archivos indicados (None = todas)"""
+        if sources is None:
+            return None
+        codigos = [datos["fuentes"][s] for s in sources if s in datos["fuentes"]]
+        return np.flatnonzero(np.isin(datos["codigos_fuente"], codigos))
+
+    def search(self, consultas, k=SEARCH_K, sources=None):
+        """
+        Top-k exacto de varias consultas en una sola pasada por la matriz.
+
+        consultas: (m, d). Devuelve (filas, distancias), ambas (m, k') con
+        k' = min(k, vectores disponibles), ordenadas de menor a mayor distancia.
+        """
+        datos = self._ensure_loaded()
+        if datos is None:
+            raise RuntimeError("El índice NumPy no está construido.")
+        consultas = np.atleast_2d(np.asarray(consultas, dtype=np.float32))
+        if consultas.shape[1] != datos["meta"]["dims"]:
+            raise ValueError(
+                f"La consulta tiene {consultas.shape[1]} dimensiones y el índice {datos['meta']['dims']}: "
+                "ejecuta python migrate_vectors.py tras cambiar EMBEDDING_DIMENSIONS."
+            )
+        m = len(consultas)
+        filas = self._rows(datos, sources)
+        total = datos["meta"]["count"] if filas is None else len(filas)
+        k = min(k, total)
+        if k == 0:
+            return np.empty((m, 0), dtype=np.int64), np.empty((m, 0), dtype=np.float32)
+
+        mejores_filas, mejores_distancias = [], []
+        # Por bloques: acota la memoria temporal (conversión de float16 y matriz de distancias)
+        for inicio in range(0, total, self.block_rows):
+            fin = min(inicio + self.block_rows, total)
+            bloque_filas = np.arange(inicio, fin) if filas is None else filas[inicio:fin]
+            if filas is None:
+                bloque = np.asarray(datos["vectores"][inicio:fin], dtype=np.float32)
+            else:
+                bloque = np.asarray(datos["vectores"][bloque_filas], dtype=np.float32)
+            d = distances(datos["meta"]["space"], consultas @ bloque.T, datos["normas2"][bloque_filas], consultas)
+            kk = min(k, fin - inicio)
+            parte = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+            mejores_filas.append(bloque_filas[parte])
+            mejores_distancias.append(np.take_along_axis(d, parte, axis=1))
+
+        candidatos = np.concatenate(mejores_filas, axis=1)
+        distancias = np.concatenate(mejores_distancias, axis=1)
+        orden = np.argsort(distancias, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(candidatos, orden, axis=1), np.take_along_axis(distancias, orden, axis=1)
+
+    def vectors(self, filas):
+        """Vectores float32 de las filas indicadas (cualquier forma)"""
+        datos = self._ensure_loaded()
+        filas = np.asarray(filas)
+        unicas, inversa = np.unique(filas, return_inverse=True)
+        # Lectura ordenada del memmap: una sola vez por fila
+        leidos = np.asarray(datos["vectores"][unicas], dtype=np.float32)
+        return leidos[inversa.reshape(filas.shape)]
+
+    def chunks(self, filas):
+        """{fila: (id, documento, metadata)} de la tabla de fragmentos"""
+        datos = self._ensure_loaded()
+        unicas = sorted({int(f) for f in np.ravel(filas)})
+        resultado = {}
+        with self._lock:
+            # SQLite limita los parámetros por consulta
+            for inicio in range(0, len(unicas), 900):
+                lote = unicas[inicio:inicio + 900]
+                marcas = ",".join("?" * len(lote))
+                for fila, chunk_id, documento, metadata in datos["conn"].execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({marcas})", lote
+                ):
+                    resultado[fila] = (chunk_id, documento, json.loads(metadata) if metadata else {})
+        return resultado
+
+    def documents(self, filas):
+        """Documentos de LangChain de las filas indicadas, en el mismo orden"""
+        fragmentos = self.chunks(filas)
+        return [
+            Document(id=fragmentos[f][0], page_content=fragmentos[f][1] or "", metadata=fragmentos[f][2])
+            for f in map(int, filas)
+        ]
+
+    def stats(self):
+        datos = self._ensure_loaded()
+        if datos is None:
+            return None
+        return {
+            "tipo": datos["meta"]["dtype"],
+            "vectores": datos["meta"]["count"],
+            "dimensiones": datos["meta"]["dims"],
+            "matriz_mb": round(datos["vectores"].nbytes / 2 ** 20, 2),
+        }
+
+
+class NumpyChroma(Chroma):
+    """
+    Chroma cuyas búsquedas se resuelven con NumpyVectorIndex.
+
+    La ingesta sigue escribiendo en la colección Chroma; las consultas leen
+    la matriz en memoria y la tabla de fragmentos del índice, sin pasar por
+    HNSW. Se vuelve a Chroma con filtros que el índice no resuelve (solo
+    filtra por source) o mientras no esté construido. Además de la interfaz
+    de Chroma ofrece búsquedas por lote: todas las reescrituras de una
+    consulta en un solo producto matricial y un solo MMR vectorizado.
+    """
+
+    def __init__(self, *args, numpy_index=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.numpy_index = numpy_index or get_numpy_index()
+
+    def _usable(self, where=None, where_document=None):
+        """Fuentes del filtro si la búsqueda se puede resolver con el índice NumPy; False si no"""
+        fuentes = _sources_filter(where)
+        if where_document or fuentes is False or not self.numpy_index.available():
+            return False
+        return fuentes
+
+    def _Chroma__query_collection(self, query_texts=None, query_embeddings=None, n_results=4,
+                                  where=None, where_document=None, **kwargs):
+        fuentes = self._usable(where, where_document)
+        if query_embeddings is None or fuentes is False:
+            return super()._Chroma__query_collection(
+                query_texts=query_texts, query_embeddings=query_embeddings, n_results=n_results,
+                where=where, where_document=where_document, **kwargs
+            )
+
+        filas, distancias = self.numpy_index.search(query_embeddings, k=n_results, sources=fuentes)
+        fragmentos = self.numpy_index.chunks(filas)
+        respuesta = {
+            "ids": [[fragmentos[int(f)][0] for f in fila] for fila in filas],
+            "documents": [[fragmentos[int(f)][1] for f in fila] for fila in filas],
+            "metadatas": [[fragmentos[int(f)][2] for f in fila] for fila in filas],
+            "distances": distancias.tolist(),
+        }
+        if "embeddings" in kwargs.get("include", []):
+            respuesta["embeddings"] = list(self.numpy_index.vectors(filas))
+        return respuesta
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                                lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None,
+                                                where_document=None, **kwargs):
+        return self.batch_max_marginal_relevance_search_by_vector(
+            [embedding], k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter,
+            where_document=where_document,
+        )[0]
+
+    def batch_max_marginal_relevance_search(self, queries, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                            lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None):
+        """MMR de varias consultas; cada una se embebe con embed_query (con caché)"""
+        embeddings = [self.embeddings.embed_query(query) for query in queries]
+        return self.batch_max_marginal_relevance_search_by_vector(
+            embeddings, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+    def batch_max_marginal_relevance_search_by_vector(self, embeddings, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                                      lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None,
+                                                      where_document=None):
+        fuentes = self._usable(filter, where_document)
+        if fuentes is False:
+            return [
+                super(NumpyChroma, self).max_marginal_relevance_search_by_vector(
+                    embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter,
+                    where_document=where_document,
+                )
+                for embedding in embeddings
+            ]
+        if not embeddings:
+            return []
+        consultas = np.asarray(embeddings, dtype=np.float32)
+        filas, _ = self.numpy_index.search(consultas, k=fetch_k, sources=fuentes)
+        if filas.shape[1] == 0:
+            return [[] for _ in embeddings]
+        elegidos = np.take_along_axis(
+            filas, mmr_batch(consultas, self.numpy_index.vectors(filas), k, lambda_mult), axis=1
+        )
+        documentos = self.numpy_index.documents(elegidos.ravel())
+        ancho = elegidos.shape[1]
+        return [documentos[i * ancho:(i + 1) * ancho] for i in range(len(embeddings))]
+
+
+_shared_indices = {}
+_shared_lock = threading.Lock()
+
+
+def get_numpy_index(project=PROJECT_DEFAULT):
+    with _shared_lock:
+        if project not in _shared_indices:
+            _shared_indices[project] = NumpyVectorIndex(path=project_path(NUMPY_INDEX_PATH, project))
+        return _shared_indices[project]
@@ -0,0 +1,253 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from config import *
+from numpy_store import mmr_batch
+from projects import current_documents, current_scope
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def get_search_pool():
+    """Hilos compartidos para repartir una búsqueda entre colecciones"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = ThreadPoolExecutor(max_workers=PROJECT_SEARCH_WORKERS, thread_name_prefix="proyectos")
+        return _shared_pool
+
+
+def fan_out(funcion, objetivos):
+    """Aplica funcion a cada objetivo; en paralelo si hay más de uno"""
+    if len(objetivos) == 1:
+        return [funcion(objetivos[0])]
+    return list(get_search_pool().map(funcion, objetivos))
+
+
+def scoped_filter(filter):
+    """
+    Agrega al filtro where el alcance de documentos activo (projects.document_scope).
+    Un filtro que ya fija el source (ruta de identificadores, revisión por
+    lotes) se respeta tal cual.
+    """
+    fuentes = current_documents()
+    if not fuentes or (filter and "source" in filter):
+        return filter
+    # Mismo formato que entiende _sources_filter (índices cuantizado y NumPy)
+    alcance = {"source": {"$in": list(fuentes)}} if len(fuentes) > 1 else {"source": fuentes[0]}
+    return {"$and": [filter, alcance]} if filter else alcance
+
+
+class _MultiCollection:
+    """Lecturas por ID repartidas entre las colecciones de los proyectos elegidos"""
+
+    def __init__(self, collections):
+        self.collections = collections
+
+    def get(self, ids=None, include=("documents", "metadatas"), **kwargs):
+        lotes = fan_out(lambda coleccion: coleccion.get(ids=ids, include=list(include), **kwargs), self.collections)
+        resultado = {"ids": []}
+        for campo in include:
+            resultado[campo] = []
+        for lote in lotes:
+            resultado["ids"].extend(lote["ids"])
+            for campo in include:
+                resultado[campo].extend(lote[campo] if lote[campo] is not None else [None] * len(lote["ids"]))
+        return resultado
+
+    def count(self):
+        return sum(coleccion.count() for coleccion in self.collections)
+
+
+class ProjectVectorStore(VectorStore):
+    """
+    Búsqueda sobre las colecciones de varios proyectos.
+
+    Los proyectos salen del alcance activo (projects.project_scope) o, sin
+    él, de todos los indexados. La consulta se embebe una sola vez y se busca
+    en paralelo en cada colección; como todas usan el mismo modelo y la misma
+    métrica, las distancias son comparables y el resultado es el mismo que
+    buscar en la unión. Con un solo proyecto se delega directamente. Con un
+    alcance de documentos (projects.document_scope) solo se buscan sus
+    fragmentos.
+    """
+
+    def __init__(self, open_store, available, embedding):
+        self.open_store = open_store
+        self.available = available
+        self._embedding = embedding
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _stores(self):
+        proyectos = current_scope()
+        if proyectos is None:
+            proyectos = self.available()
+        return [self.open_store(proyecto) for proyecto in proyectos]
+
+    @property
+    def _collection(self):
+        return _MultiCollection([store._collection for store in self._stores()])
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("La ingesta escribe directamente en la colección de cada proyecto")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("La ingesta escribe directamente en la colección de cada proyecto")
+
+    def similarity_search(self, query, k=SEARCH_K, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_with_score(self, query, k=SEARCH_K, filter=None, **kwargs):
+        return self._search_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=SEARCH_K, filter=None, **kwargs):
+        return [doc for doc, _ in self._search_by_vector(embedding, k, filter)]
+
+    def _search_by_vector(self, embedding, k, filter):
+        filter = scoped_filter(filter)
+        listas = fan_out(
+            lambda store: store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter),
+            self._stores(),
+        )
+        # Puntajes de Chroma = distancias: menor es mejor
+        return sorted((par for lista in listas for par in lista), key=lambda par: par[1])[:k]
+
+    def max_marginal_relevance_search(self, query, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                      lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                                lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None, **kwargs):
+        filter = scoped_filter(filter)
+        stores = self._stores()
+        if len(stores) == 1:
+            return stores[0].max_marginal_relevance_search_by_vector(
+                embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+            )
+
+        # Candidatos de cada colección (el método de consulta de Chroma, que
+        # QuantizedChroma sustituye); MMR sobre los fetch_k más cercanos de todas
+        def candidatos(store):
+            resultado = store._Chroma__query_collection(
+                query_embeddings=[embedding], n_results=fetch_k, where=filter,
+                include=["documents", "metadatas", "distances", "embeddings"],
+            )
+            return list(zip(
+                resultado["ids"][0], resultado["documents"][0], resultado["metadatas"][0],
+                resultado["distances"][0], resultado["embeddings"][0],
+            ))
+
+        todos = sorted((c for lista in fan_out(candidatos, stores) for c in lista), key=lambda c: c[3])[:fetch_k]
+        if not todos:
+            return []
+        elegidos = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), [c[4] for c in todos], k=k, lambda_mult=lambda_mult
+        )
+        return [
+            Document(id=todos[i][0], page_content=todos[i][1], metadata=todos[i][2] or {})
+            for i in elegidos
+        ]
+
+    def batch_max_marginal_relevance_search(self, queries, k=SEARCH_K, fetch_k=MMR_FETCH_K,
+                                            lambda_mult=MMR_DIVERSITY_LAMBDA, filter=None):
+        """MMR de varias consultas (las reescrituras de una pregunta) en una sola pasada, ver batch_mmr_search"""
+        if not queries:
+            return []
+        embeddings = [self._embedding.embed_query(query) for query in queries]
+        return batch_mmr_search(self._stores(), embeddings, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult,
+                                filter=scoped_filter(filter))
+
+
+def batch_mmr_search(stores, embeddings, k=SEARCH_K, fetch_k=MMR_FETCH_K, lambda_mult=MMR_DIVERSITY_LAMBDA,
+                     filter=None):
+    """
+    MMR de varias consultas ya embebidas sobre una o más colecciones: cada
+    colección responde a todas en una sola consulta y la selección MMR se
+    hace vectorizada para todas a la vez (numpy_store.mmr_batch). Devuelve
+    una lista de documentos por consulta.
+    """
+    if not embeddings:
+        return []
+    if len(stores) == 1 and hasattr(stores[0], "batch_max_marginal_relevance_search_by_vector"):
+        return stores[0].batch_max_marginal_relevance_search_by_vector(
+            embeddings, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+    def candidatos(store):
+        resultado = store._Chroma__query_collection(
+            query_embeddings=embeddings, n_results=fetch_k, where=filter,
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        return [
+            list(zip(*(resultado[campo][i] for campo in ("ids", "documents", "metadatas", "distances", "embeddings"))))
+            for i in range(len(embeddings))
+        ]
+
+    por_store = fan_out(candidatos, stores)
+    listas = [
+        sorted((c for lista in por_store for c in lista[i]), key=lambda c: c[3])[:fetch_k]
+        for i in range(len(embeddings))
+    ]
+    ancho = max(len(lista) for lista in listas)
+    if ancho == 0:
+        return [[] for _ in embeddings]
+    # Relleno con vectores nulos para consultas con menos candidatos
+    vectores = np.zeros((len(listas), ancho, len(embeddings[0])), dtype=np.float32)
+    validos = np.zeros((len(listas), ancho), dtype=bool)
+    for i, lista in enumerate(listas):
+        if lista:
+            vectores[i, :len(lista)] = [c[4] for c in lista]
+            validos[i, :len(lista)] = True
+    elegidos = mmr_batch(np.asarray(embeddings, dtype=np.float32), vectores, k, lambda_mult, validos)
+    return [
+        [
+            Document(id=lista[j][0], page_content=lista[j][1], metadata=lista[j][2] or {})
+            for j in fila if j >= 0
+        ]
+        for lista, fila in zip(listas, elegidos)
+    ]
+
+
+class ProjectBM25:
+    """
+    Índices BM25 de los proyectos en el alcance activo, con la interfaz de
+    BM25Index que usan los retrievers (search, get_documents). Los puntajes
+    de índices distintos se comparan tal cual, aunque cada uno calcula su
+    propio idf. También respeta el alcance de documentos activo.
+    """
+
+    def __init__(self, open_index, available):
+        self.open_index = open_index
+        self.available = available
+
+    def _indices(self):
+        proyectos = current_scope()
+        if proyectos is None:
+            proyectos = self.available()
+        return [self.open_index(proyecto) for proyecto in proyectos]
+
+    def count(self):
+        return sum(indice.count() for indice in self._indices())
+
+    def search(self, query, k=SEARCH_K):
+        fuentes = current_documents()
+        listas = fan_out(lambda indice: indice.search(query, k=k, sources=fuentes), self._indices())
+        return sorted((par for lista in listas for par in lista), key=lambda par: par[1], reverse=True)[:k]
+
+    def get_documents(self, ids):
+        por_id = {}
+        for docs in fan_out(lambda indice: indice.get_documents(ids), self._indices()):
+            por_id.update((doc.id, doc) for doc in docs)
+        return [por_id[i] for i in ids if i in por_id]
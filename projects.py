@@ -0,0 +1,169 @@
+import contextvars
+import os
+import re
+import unicodedata
+from contextlib import contextmanager
+
+from config import *
+
+# Módulo ligero (sin LangChain ni Chroma): lo usan la app, la ingesta y el
+# enrutamiento de consultas. La búsqueda sobre varias colecciones está en
+# project_search.py.
+
+# Proyectos a los que se limita la búsqueda en curso (None = todos)
+_scope = contextvars.ContextVar("proyectos", default=None)
+# Documentos (metadata source) a los que se limita la búsqueda en curso (None = todos)
+_documents = contextvars.ContextVar("documentos", default=None)
+
+
+def _words(texto):
+    """Minúsculas sin acentos, con guiones entre palabras"""
+    texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z0-9]+", "-", texto).strip("-")
+
+
+def project_slug(nombre):
+    """'Obra Norte 2025' -> 'obra-norte-2025' (válido como parte de un nombre de colección)"""
+    return _words(nombre)[:40].strip("-") or PROJECT_DEFAULT
+
+
+def project_of(nombre):
+    """Proyecto de un archivo según su ruta relativa a la carpeta de contratos"""
+    partes = nombre.replace("\\", "/").split("/")
+    return project_slug(partes[0]) if len(partes) > 1 else PROJECT_DEFAULT
+
+
+def project_of_source(source, raiz=CONTRATOS_PATH):
+    """Proyecto de un fragmento a partir de su metadata source"""
+    try:
+        relativa = os.path.relpath(source, raiz)
+    except ValueError:
+        # Otra unidad en Windows
+        return PROJECT_DEFAULT
+    if relativa.startswith(".."):
+        return PROJECT_DEFAULT
+    return project_of(relativa)
+
+
+def collection_name(proyecto):
+    if proyecto == PROJECT_DEFAULT:
+        return DEFAULT_COLLECTION_NAME
+    return f"{PROJECT_COLLECTION_PREFIX}{proyecto}"
+
+
+def project_of_collection(nombre):
+    """Proyecto de una colección Chroma; None si no es de un proyecto (p. ej. temporales)"""
+    if nombre == DEFAULT_COLLECTION_NAME:
+        return PROJECT_DEFAULT
+    if nombre.startswith(PROJECT_COLLECTION_PREFIX):
+        return nombre[len(PROJECT_COLLECTION_PREFIX):]
+    return None
+
+
+def project_path(path, proyecto):
+    """Archivo o carpeta de un índice auxiliar del proyecto (el general usa la ruta original)"""
+    if proyecto == PROJECT_DEFAULT:
+        return path
+    raiz, extension = os.path.splitext(path)
+    return f"{raiz}_{proyecto}{extension}"
+
+
+def list_pdfs(ruta=CONTRATOS_PATH):
+    """
+    Devuelve {nombre: ruta} de los PDF de la carpeta de contratos. Los de
+    subcarpetas se nombran con su ruta relativa ("obra-norte/contrato.pdf").
+    """
+    if not os.path.exists(ruta):
+        return {}
+    archivos = {}
+    for carpeta, subcarpetas, nombres in os.walk(ruta):
+        subcarpetas.sort()
+        for nombre in sorted(nombres):
+            if nombre.lower().endswith(".pdf"):
+                path = os.path.join(carpeta, nombre)
+                archivos[os.path.relpath(path, ruta).replace(os.sep, "/")] = path
+    return archivos
+
+
+def list_project_folders(ruta=CONTRATOS_PATH):
+    """{proyecto: carpeta} de las subcarpetas de contratos"""
+    if not os.path.exists(ruta):
+        return {}
+    return {
+        project_slug(nombre): os.path.join(ruta, nombre)
+        for nombre in sorted(os.listdir(ruta))
+        if os.path.isdir(os.path.join(ruta, nombre))
+    }
+
+
+def project_folder(proyecto, ruta=CONTRATOS_PATH):
+    """Carpeta donde se guardan los PDF de un proyecto (se crea si no existe)"""
+    if proyecto == PROJECT_DEFAULT:
+        carpeta = ruta
+    else:
+        carpeta = list_project_folders(ruta).get(proyecto, os.path.join(ruta, proyecto))
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+@contextmanager
+def project_scope(proyectos):
+    """Limita las búsquedas de project_search a los proyectos indicados"""
+    token = _scope.set(tuple(proyectos) if proyectos is not None else None)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope():
+    return _scope.get()
+
+
+@contextmanager
+def document_scope(fuentes):
+    """Limita las búsquedas de project_search a los fragmentos de esos archivos"""
+    token = _documents.set(tuple(fuentes) if fuentes is not None else None)
+    try:
+        yield
+    finally:
+        _documents.reset(token)
+
+
+def current_documents():
+    return _documents.get()
+
+
+def route_projects(question, disponibles, seleccion=None, identifier_index=None):
+    """
+    Elige los proyectos en los que se busca una consulta.
+
+    Por orden: la selección del usuario, los proyectos nombrados en la
+    pregunta y los que contienen los números de contrato citados (índice de
+    identificadores). Si nada lo acota se busca en todos. Devuelve
+    (proyectos, motivo).
+    """
+    if seleccion:
+        elegidos = [p for p in seleccion if p in disponibles]
+        return elegidos, "seleccion"
+
+    texto = f" {_words(question).replace('-', ' ')} "
+    mencionados = [
+        p for p in disponibles
+        if p != PROJECT_DEFAULT and f" {p.replace('-', ' ')} " in texto
+    ]
+    if mencionados:
+        return mencionados, "nombre"
+
+    if identifier_index is not None:
+        # Import diferido: identifier_index carga LangChain
+        from identifier_index import CONTRATO, extract_identifiers
+
+        contratos = [valor for tipo, valor in extract_identifiers(question) if tipo == CONTRATO]
+        if contratos:
+            fuentes = {source for _, source in identifier_index.lookup(CONTRATO, contratos) if source}
+            por_contrato = sorted({project_of_source(source) for source in fuentes} & set(disponibles))
+            if por_contrato:
+                return por_contrato, "contrato"
+
+    return list(disponibles), "todos"
@@ -27,4 +27,77 @@ Considera variaciones en:
 
 Consulta original: {question}
 
-Genera 3 versiones técnicas alternativas, una por línea, enfocadas en recuperar el contexto normativo y técnico más preciso:"""
\ No newline at end of file
+Genera 3 versiones técnicas alternativas, una por línea, enfocadas en recuperar el contexto normativo y técnico más preciso:"""
+
+# Sinónimos y abreviaturas del dominio para la reescritura local (sin LLM).
+# Cada grupo lista formas equivalentes; la primera es la forma preferida.
+REWRITE_SYNONYMS = [
+    ["ley de obras publicas y servicios relacionados con las mismas", "lopsrm", "ley de obra publica", "ley de obra"],
+    ["reglamento de la ley de obras publicas", "rlopsrm", "reglamento"],
+    ["terminos de referencia", "tdr", "tdrs"],
+    ["resistencia a la compresion del concreto", "f'c", "fc", "resistencia del concreto"],
+    ["especificaciones generales", "especificaciones tecnicas", "especificaciones particulares"],
+    ["catalogo de conceptos", "presupuesto de obra", "conceptos de obra"],
+    ["precio unitario", "p.u.", "pu", "precios unitarios"],
+    ["garantia de cumplimiento", "fianza de cumplimiento", "fianza", "garantia"],
+    ["anticipo", "pago anticipado"],
+    ["monto del contrato", "importe del contrato", "monto", "importe"],
+    ["plazo de ejecucion", "periodo de ejecucion", "plazo", "vigencia"],
+    ["penas convencionales", "sanciones", "retenciones economicas"],
+    ["convenio modificatorio", "convenio de modificacion", "convenio"],
+    ["bitacora electronica de obra publica", "beop", "bitacora"],
+    ["residencia de obra", "residente de obra", "residente"],
+    ["superintendente de construccion", "superintendente"],
+    ["estimaciones", "estimacion de pago", "pago de estimaciones"],
+    ["finiquito", "cierre del contrato", "acta de finiquito"],
+    ["impuesto al valor agregado", "iva"],
+]
+
+# Prompt de la revisión por lotes (batch_qa.py): respuestas breves para una celda de la matriz
+BATCH_QA_TEMPLATE = """Eres un Consultor Senior de FOA Consultores y FIS, experto en Normatividad de Obra Pública.
+Responde la pregunta sobre el documento "{document}" basándote ÚNICAMENTE en sus fragmentos.
+
+FRAGMENTOS DEL DOCUMENTO:
+{context}
+
+PREGUNTA: {question}
+
+INSTRUCCIONES:
+1. Responde en una a tres líneas, con el dato concreto (monto, plazo, fecha, número de cláusula o anexo).
+2. Cita entre corchetes el fragmento de donde sale el dato, p. ej. [Fragmento 2].
+3. Si el dato no aparece en los fragmentos, responde exactamente: "No localizado en el documento."
+
+RESPUESTA:"""
+
+# Prompt del resumen por documento (document_index.py): un campo por línea para
+# poder leerlo sin otro llamado al modelo
+DOCUMENT_SUMMARY_TEMPLATE = """Eres un Consultor Senior de FOA Consultores y FIS, experto en Normatividad de Obra Pública.
+Resume el documento "{document}" basándote ÚNICAMENTE en el texto siguiente (su parte inicial).
+
+TEXTO DEL DOCUMENTO:
+{text}
+
+Responde exactamente con estas líneas, sin texto adicional. Si un dato no aparece, escribe "No localizado".
+Resumen: <de dos a cuatro oraciones: tipo de documento, objeto, partes y ubicación de los trabajos>
+Contrato: <número de contrato o de procedimiento>
+Objeto: <objeto del contrato en una línea>
+Contratista: <razón social>
+Monto sin IVA: <importe con moneda>
+Plazo: <plazo de ejecución>
+Fecha de firma: <fecha>
+
+RESUMEN:"""
+
+# Lista de verificación sugerida para la revisión por lotes
+BATCH_QA_CHECKLIST = [
+    "¿Cuál es el número de contrato?",
+    "¿Cuál es el objeto del contrato?",
+    "¿Cuál es el monto del contrato sin IVA?",
+    "¿Cuál es el plazo de ejecución de los trabajos?",
+    "¿Cuáles son las fechas de inicio y terminación?",
+    "¿Qué porcentaje de anticipo se otorga?",
+    "¿Qué garantía de cumplimiento se exige y por qué porcentaje?",
+    "¿Qué garantía de vicios ocultos se exige?",
+    "¿Cuáles son las penas convencionales por atraso?",
+    "¿Cuál es la documentación mínima que debe presentar el licitante?",
+]
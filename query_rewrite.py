@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from answer_cache import normalize_question
+from bm25_index import STOPWORDS, strip_accents, words
+from config import *
+from metrics import record_span
+from prompts import REWRITE_SYNONYMS
+
+logger = logging.getLogger(__name__)
+
+
+def _compile_groups(grupos):
+    """Por grupo: (formas en orden de preferencia, [(forma, patrón)] de la más larga a la más corta)"""
+    compilados = []
+    for grupo in grupos:
+        patrones = [
+            (forma, re.compile(r"(?<![a-z0-9])" + re.escape(forma) + r"(?![a-z0-9])"))
+            for forma in sorted(grupo, key=len, reverse=True)
+        ]
+        compilados.append((grupo, patrones))
+    return compilados
+
+
+_GRUPOS = _compile_groups(REWRITE_SYNONYMS)
+
+# Sufijo de la variante por palabras clave (la que siempre se puede generar)
+_CONTEXTO_DOMINIO = "contrato de obra publica"
+
+
+def _key(palabra):
+    # "f'c" y "fc", "¿cual" y "cual" cuentan como la misma palabra
+    return re.sub(r"[^a-z0-9]", "", palabra)
+
+
+def _substitute(texto, inicio, fin, alternativa):
+    """
+    Sustituye el término texto[inicio:fin] por alternativa dentro de la
+    pregunta, sin repetir las palabras vecinas que la alternativa ya incluye:
+    "resistencia f'c del concreto" -> "resistencia a la compresion del
+    concreto". None si la alternativa no agrega nada a la pregunta.
+    """
+    antes = [_key(p) for p in texto[:inicio].split()]
+    despues = [_key(p) for p in texto[fin:].split()]
+    propias = alternativa.split()
+    claves = [_key(p) for p in propias]
+    prefijo = max((k for k in range(min(len(claves), len(antes)) + 1) if claves[:k] == antes[len(antes) - k:]))
+    resto = len(claves) - prefijo
+    sufijo = max((k for k in range(min(resto, len(despues)) + 1) if claves[len(claves) - k:] == despues[:k]))
+    nuevas = propias[prefijo:len(propias) - sufijo]
+    if not nuevas or {_key(p) for p in nuevas} <= set(antes) | set(despues):
+        return None
+    return texto[:inicio] + " ".join(nuevas) + texto[fin:]
+
+
+def _key_terms(texto):
+    """La pregunta sin palabras vacías ni signos"""
+    return " ".join(palabra for palabra in words(texto) if palabra not in STOPWORDS)
+
+
+def local_rewrites(question, max_rewrites=REWRITE_COUNT):
+    """
+    Reescrituras sin LLM: sustituye cada término del dominio que aparece en
+    la pregunta por sus sinónimos o abreviaturas (REWRITE_SYNONYMS), siempre
+    dentro de la pregunta completa. Toma una alternativa de cada término por
+    ronda, así las primeras variantes cubren todos los términos encontrados.
+    Si faltan variantes se completan con las palabras clave de la pregunta,
+    solas y con el contexto del dominio.
+    """
+    texto = " ".join(strip_accents(question.lower()).split())
+    encontrados = []
+    for grupo, patrones in _GRUPOS:
+        for forma, patron in patrones:
+            match = patron.search(texto)
+            if match:
+                encontrados.append((match.start(), match.end(), [otra for otra in grupo if otra != forma]))
+                break
+
+    variantes = []
+
+    def agregar(variante):
+        if variante and variante != texto and variante not in variantes:
+            variantes.append(variante)
+        return len(variantes) >= max_rewrites
+
+    rondas = max((len(alternativas) for _, _, alternativas in encontrados), default=0)
+    for ronda in range(rondas):
+        for inicio, fin, alternativas in encontrados:
+            if ronda < len(alternativas) and agregar(_substitute(texto, inicio, fin, alternativas[ronda])):
+                return variantes
+    claves = _key_terms(texto)
+    if claves:
+        for variante in (claves, f"{claves} {_CONTEXTO_DOMINIO}"):
+            if agregar(variante):
+                break
+    return variantes
+
+
+class RewriteCache:
+    """
+    Reescrituras del LLM memorizadas por pregunta normalizada y versión del
+    índice, en SQLite con desalojo LRU. Las entradas de otras versiones se
+    descartan al consultar.
+    """
+
+    def __init__(self, path=REWRITE_CACHE_PATH, max_entries=REWRITE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rewrites (
+                question_norm TEXT PRIMARY KEY,
+                rewrites TEXT NOT NULL,
+                index_version INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def lookup(self, question, index_version):
+        with self._lock:
+            self._conn.execute("DELETE FROM rewrites WHERE index_version != ?", (index_version,))
+            clave = normalize_question(question)
+            fila = self._conn.execute("SELECT rewrites FROM rewrites WHERE question_norm = ?", (clave,)).fetchone()
+            if fila is not None:
+                self._conn.execute(
+                    "UPDATE rewrites SET last_access = ? WHERE question_norm = ?", (time.time(), clave)
+                )
+            self._conn.commit()
+        if fila is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(fila[0])
+
+    def store(self, question, index_version, rewrites):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rewrites VALUES (?, ?, ?, ?)",
+                (normalize_question(question), json.dumps(rewrites, ensure_ascii=False), index_version, time.time()),
+            )
+            total = self._conn.execute("SELECT COUNT(*) FROM rewrites").fetchone()[0]
+            if total > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM rewrites WHERE question_norm IN "
+                    "(SELECT question_norm FROM rewrites ORDER BY last_access ASC LIMIT ?)",
+                    (total - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM rewrites").fetchone()[0]
+        return {"aciertos": self.hits, "fallos": self.misses, "entradas": entradas}
+
+
+class QueryRewriter:
+    """
+    Reescrituras de la consulta para la búsqueda multi-consulta.
+
+    - "llm": las genera el LLM de consultas con MULTI_QUERY_PROMPT.
+    - "local": tabla de sinónimos y abreviaturas, en microsegundos.
+    - "auto": LLM, salvo que el presupuesto sea menor que REWRITE_MIN_LLM_BUDGET;
+      si el LLM excede el presupuesto o falla (p. ej. por cuota) se usa la
+      tabla local y el LLM se pausa REWRITE_LLM_COOLDOWN segundos.
+
+    Con cache, las reescrituras del LLM se reutilizan por pregunta y versión
+    del índice (index_version es una función que devuelve la versión).
+    """
+
+    def __init__(self, llm, prompt, mode=REWRITE_MODE, cache=None, index_version=None,
+                 max_rewrites=REWRITE_COUNT):
+        self.llm = llm
+        self.prompt = prompt
+        self.mode = mode
+        self.cache = cache
+        self.index_version = index_version or (lambda: 0)
+        self.max_rewrites = max_rewrites
+        self._paused_until = 0.0
+
+    def _parse(self, respuesta):
+        lineas = [linea.strip() for linea in str(respuesta.content).strip().split("\n")]
+        return [linea for linea in lineas if linea]
+
+    def _cached(self, question):
+        if self.cache is None:
+            return None
+        return self.cache.lookup(question, self.index_version())
+
+    def _store(self, question, consultas):
+        if self.cache is not None and consultas:
+            self.cache.store(question, self.index_version(), consultas)
+
+    def _prefer_local(self, budget=None):
+        if self.mode == "local":
+            return True
+        if self.mode != "auto":
+            return False
+        return time.monotonic() < self._paused_until or (budget is not None and budget < REWRITE_MIN_LLM_BUDGET)
+
+    def _fallback(self, question, error):
+        """En modo auto, pausa el LLM y responde con la tabla local; en otro caso propaga el error"""
+        if self.mode != "auto":
+            raise error
+        self._paused_until = time.monotonic() + REWRITE_LLM_COOLDOWN
+        logger.warning(
+            f"Reescritura con LLM no disponible ({type(error).__name__}); "
+            f"se usa la tabla local durante {REWRITE_LLM_COOLDOWN}s."
+        )
+        return local_rewrites(question, self.max_rewrites)
+
+    async def arewrite(self, question, budget=None):
+        """Reescrituras de la pregunta; budget limita la espera por el LLM (segundos)"""
+        inicio = time.perf_counter()
+        try:
+            consultas, origen = await self._arewrite(question, budget)
+        except asyncio.TimeoutError:
+            record_span("reescritura", time.perf_counter() - inicio, estado="excedida")
+            raise
+        record_span("reescritura", time.perf_counter() - inicio, origen=origen, resultados=len(consultas))
+        return consultas
+
+    async def _arewrite(self, question, budget):
+        cacheadas = self._cached(question)
+        if cacheadas is not None:
+            return cacheadas, "cache"
+        if self._prefer_local(budget):
+            return local_rewrites(question, self.max_rewrites), "local"
+        try:
+            respuesta = await asyncio.wait_for(self.llm.ainvoke(self.prompt.format(question=question)), timeout=budget)
+        except asyncio.TimeoutError:
+            # Agotar el presupuesto de esta pregunta no indica que el LLM esté
+            # caído: se responde con la tabla local sin pausarlo para las demás
+            if self.mode != "auto":
+                raise
+            logger.info(f"Reescritura con LLM excedió {budget}s; se usa la tabla local para esta pregunta.")
+            return local_rewrites(question, self.max_rewrites), "local"
+        except Exception as e:
+            return self._fallback(question, e), "local"
+        consultas = self._parse(respuesta)
+        self._store(question, consultas)
+        return consultas, "llm"
+
+    def rewrite(self, question):
+        """Variante síncrona (MultiQueryRetriever), sin presupuesto de tiempo"""
+        inicio = time.perf_counter()
+        consultas = self._cached(question)
+        origen = "cache"
+        if consultas is None:
+            if self._prefer_local():
+                consultas, origen = local_rewrites(question, self.max_rewrites), "local"
+            else:
+                try:
+                    consultas, origen = self._parse(self.llm.invoke(self.prompt.format(question=question))), "llm"
+                    self._store(question, consultas)
+                except Exception as e:
+                    consultas, origen = self._fallback(question, e), "local"
+        record_span("reescritura", time.perf_counter() - inicio, origen=origen, resultados=len(consultas))
+        return consultas
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_rewrite_cache():
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = RewriteCache()
+        return _shared_cache
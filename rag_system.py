@@ -1,19 +1,39 @@
 
+import hashlib
+import json
 import logging
+import os
+import time
+import uuid
 from datetime import datetime
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFDirectoryLoader
 
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langchain_classic.retrievers.multi_query import MultiQueryRetriever
 from langchain_classic.retrievers import EnsembleRetriever
-from config import EMBEDDING_MODEL
+from answer_cache import get_answer_cache
+from async_retrieval import AsyncMultiQueryRetriever
+from bm25_index import BM25Retriever, backfill_from_chroma, get_bm25_index
+from clause_splitter import LEGACY_CHUNKING, chunking_signature
+from clients import get_generation_llm, get_query_llm, get_vector_store, indexed_projects, open_vector_store
+from context_packer import pack_documents
+from document_catalog import get_document_catalog
+from document_index import asks_for_summary, format_summary, get_document_index, update_document_index
+from embedding_batcher import EmbeddingBatcher, estimate_tokens
+from embeddings_cache import get_embeddings
+from identifier_index import CONTRATO, IdentifierRetriever, extract_identifiers, get_identifier_index
+from ingest_pipeline import iter_batches
+from log_store import attach_log_file
+from metrics import record_span, span, trace
+from numpy_store import get_numpy_index
+from project_search import ProjectBM25, ProjectVectorStore
+from projects import collection_name, document_scope, list_pdfs, project_of, project_scope, route_projects
+from query_rewrite import QueryRewriter, get_rewrite_cache
+from vector_quantization import collection_dimensions, get_quantized_store
 
 import streamlit as st
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from config import *
 from prompts import *
@@ -27,21 +47,29 @@ def initialize_rag_system():
     - Retriever con MMR y MultiQueryRetriever
     - Prompt base para RAG
     """
-    # Vector Store
-    vector_store = Chroma(
-        embedding_function=GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
-        persist_directory=CHROMA_DB_PATH,
+    # Clientes compartidos del proceso (ver clients.py); con VECTOR_QUANTIZATION
+    # las búsquedas usan el índice cuantizado. Cada proyecto tiene su colección
+    # y su índice BM25; la búsqueda se reparte entre los proyectos elegidos por
+    # route_query (ver project_search).
+    return build_rag_system(
+        ProjectVectorStore(get_vector_store, indexed_projects, get_embeddings()),
+        get_query_llm(),
+        get_generation_llm(),
+        ProjectBM25(get_bm25_index, indexed_projects),
+        get_identifier_index(),
+        rewrite_cache=get_rewrite_cache(),
     )
 
-    # Modelos
-    llm_queries = ChatGoogleGenerativeAI(
-        model=QUERY_MODEL,
-        temperature=0,
-        max_retries=10,  # Aumenta los reintentos
-        timeout=60,  # Espera más tiempo
-    )
-    llm_generation = ChatGoogleGenerativeAI(model=GENERATION_MODEL, temperature=0)
 
+def build_rag_system(vector_store, llm_queries, llm_generation, bm25_index=None, identifier_index=None,
+                     rewrite_cache=None):
+    """
+    Arma el retriever y la cadena RAG sobre componentes ya creados.
+
+    Separado de initialize_rag_system para poder usar modelos y vector stores
+    locales (benchmarks) sin llamar a Gemini. Sin rewrite_cache las
+    reescrituras no se memorizan.
+    """
     # Retriever MMR (Maximum Marginal Relevance)
     base_retriever = vector_store.as_retriever(
         search_type=SEARCH_TYPE,
@@ -52,33 +80,52 @@ def initialize_rag_system():
         }
     )
 
-    # Retriever adicional con similarity para comparar
-    similarity_retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": SEARCH_K}
-    )
-
     # Prompt personalizado para MultiQueryRetriever
     multi_query_prompt = PromptTemplate.from_template(MULTI_QUERY_PROMPT)
 
+    # Reescrituras memorizadas por pregunta y versión del índice, con respaldo
+    # local de sinónimos según REWRITE_MODE (ver query_rewrite)
+    rewriter = QueryRewriter(
+        llm_queries, multi_query_prompt, cache=rewrite_cache, index_version=get_index_version,
+    )
+
     # MultiQueryRetriever con prompt personalizado
-    mmr_multi_retriever = MultiQueryRetriever.from_llm(
+    mmr_multi_retriever = MultiQueryRetriever(
         retriever=base_retriever,
-        llm=llm_queries,
-        prompt=multi_query_prompt,
+        llm_chain=RunnableLambda(lambda entrada: rewriter.rewrite(entrada["question"])),
     )
 
-    # Ensemble Retriever que combinar MMR y similarity
-    if ENABLE_HYBRID_SEARCH:
+    # Ensemble Retriever que combina MMR (denso) con BM25 (léxico): la rama léxica
+    # aporta coincidencias exactas de números de contrato, cláusulas y anexos
+    if ENABLE_ASYNC_RETRIEVAL:
+        # Mismas ramas, pero concurrentes y con plazo máximo (ver async_retrieval)
+        final_retriever = AsyncMultiQueryRetriever(
+            vector_store=vector_store,
+            llm=llm_queries,
+            prompt=multi_query_prompt,
+            bm25_index=bm25_index if ENABLE_HYBRID_SEARCH else None,
+            rewriter=rewriter,
+        )
+    elif ENABLE_HYBRID_SEARCH and bm25_index is not None:
+        bm25_retriever = BM25Retriever(index=bm25_index, k=SEARCH_K)
         ensemble_retriever = EnsembleRetriever(
-            retrievers=[mmr_multi_retriever, similarity_retriever],
-            weights=[0.7, 0.3],  # mayor peso a MMR
+            retrievers=[mmr_multi_retriever, bm25_retriever],
+            weights=[1 - BM25_WEIGHT, BM25_WEIGHT],  # mayor peso a MMR
             similarity_threshold=SIMILARITY_THRESHOLD
         )
         final_retriever = ensemble_retriever
     else:
         final_retriever = mmr_multi_retriever
 
+    # Consultas con número de contrato, cláusula, anexo o monto van directo a
+    # los fragmentos que los contienen, sin pasar por el LLM de reescritura
+    if ENABLE_IDENTIFIER_ROUTING and identifier_index is not None:
+        final_retriever = IdentifierRetriever(
+            index=identifier_index,
+            vector_store=vector_store,
+            fallback=final_retriever,
+        )
+
     prompt = PromptTemplate.from_template(RAG_TEMPLATE)
 
     # Función para formatear y pre procesar los documentos recuperados
@@ -95,23 +142,69 @@ def initialize_rag_system():
                     header += f" - Fuente: {source}"
                 if 'page' in doc.metadata:
                     header += f" - Pagina: {doc.metadata['page']}"
+                if 'clausula' in doc.metadata:
+                    header += f" - Cláusula: {doc.metadata['clausula']}"
+                elif 'apartado' in doc.metadata:
+                    header += f" - Apartado: {doc.metadata['apartado']}"
+                if 'seccion' in doc.metadata:
+                    header += f" - Sección: {doc.metadata['seccion']}"
 
             content = doc.page_content.strip()
             formatted.append(f"{header}\n{content}")
 
         return "\n\n".join(formatted)
 
+    # Cadena en una sola pasada: los documentos recuperados (ya empaquetados) son
+    # los mismos que se envían al prompt y los que se devuelven para mostrar las
+    # fuentes, así la numeración de los fragmentos coincide con las citas.
+    # Cada etapa anota su duración en state["tiempos"].
+    # Además se registra cada etapa en la traza activa (metrics).
+    def retrieve(question):
+        inicio = time.perf_counter()
+        with span("recuperacion") as etapa:
+            docs = final_retriever.invoke(question)
+            etapa.set(documentos=len(docs))
+        with span("empaquetado", recuperados=len(docs)) as etapa:
+            docs = pack_documents(docs)
+            etapa.set(documentos=len(docs))
+        tiempos = {"recuperacion": time.perf_counter() - inicio}
+        return {"question": question, "docs": docs, "tiempos": tiempos}
+
+    def build_prompt(state):
+        inicio = time.perf_counter()
+        with span("formato") as etapa:
+            context = format_docs(state["docs"])
+            state["prompt"] = prompt.invoke({
+                "context": context,
+                "question": state["question"],
+            })
+            etapa.set(caracteres_contexto=len(context), tokens_prompt=estimate_tokens(state["prompt"].to_string()))
+        state["tiempos"]["formato"] = time.perf_counter() - inicio
+        return state
+
+    def generate(state):
+        inicio = time.perf_counter()
+        with span("generacion") as etapa:
+            state["answer"] = (llm_generation | StrOutputParser()).invoke(state["prompt"])
+            etapa.set(tokens_respuesta=estimate_tokens(state["answer"]))
+        state["tiempos"]["generacion"] = time.perf_counter() - inicio
+        return state
+
     rag_chain = (
-            {
-                "context": final_retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt
-            | llm_generation
-            | StrOutputParser()
+            RunnableLambda(retrieve)
+            | RunnableLambda(build_prompt)
+            | RunnableLambda(generate)
     )
 
-    return rag_chain, mmr_multi_retriever
+    # Las etapas se exponen por separado para la variante en streaming
+    return {
+        "chain": rag_chain,
+        "retrieve": retrieve,
+        "build_prompt": build_prompt,
+        "format_docs": format_docs,
+        "rewriter": rewriter,
+        "generation": llm_generation | StrOutputParser(),
+    }
 
 # Configuración básica de logging para ver en consola
 logging.basicConfig(
@@ -123,10 +216,6 @@ logger = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN PROFESIONAL DE LOGGING ---
 def setup_logger():
-    # Crear carpeta de logs si no existe
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
     logger_sys = logging.getLogger("SISTEMA_RAG")
     logger_sys.setLevel(logging.INFO)
 
@@ -140,78 +229,591 @@ def setup_logger():
         console_handler.setFormatter(formatter)
         logger_sys.addHandler(console_handler)
 
-        # 3. Handler para el ARCHIVO FÍSICO (Modo 'a' para anexar sin borrar lo previo)
-        file_handler = logging.FileHandler('logs/historial_db.log', mode='a', encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        logger_sys.addHandler(file_handler)
+        # 3. Handler para el ARCHIVO FÍSICO: rota por tamaño y antigüedad,
+        # comprime los archivos rotados e indexa cada registro (ver log_store)
+        attach_log_file(logger_sys)
 
     return logger_sys
 
 
+# --- INGESTA INCREMENTAL ---
+def file_hash(path):
+    """SHA-256 del contenido binario de un archivo"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
 
 
+def chunk_hash(doc):
+    """SHA-256 del texto de un fragmento"""
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
 
-def ingest_docs():
-    inicio = datetime.now()
-    logger.info(">>> INICIO DE ACTUALIZACIÓN DE BDs <<<")
 
+def chunk_id_prefix(nombre, hash_archivo):
+    """
+    Prefijo de los IDs de fragmento de un archivo: su ruta relativa y su hash,
+    para que dos PDF idénticos (o el mismo PDF en dos proyectos) no compartan IDs
+    """
+    return hashlib.sha256(f"{nombre}:{hash_archivo}".encode("utf-8")).hexdigest()[:16]
+
+
+def stage_batch(staging, embedder, lote, en_proceso):
+    """
+    Asigna IDs a un lote de (nombre, doc) de iter_batches, lo embebe y lo
+    escribe en la colección temporal. en_proceso: {nombre: {"hash", "proyecto",
+    "fragmentos"}}; cada fragmento se registra en "fragmentos". Devuelve los
+    fragmentos escritos.
+    """
+    ids, docs = [], []
+    for nombre, doc in lote:
+        registro = en_proceso[nombre]
+        # ID estable: archivo y hash + posición del fragmento
+        chunk_id = f"{chunk_id_prefix(nombre, registro['hash'])}-{len(registro['fragmentos'])}"
+        doc.metadata["file_hash"] = registro["hash"]
+        doc.metadata["proyecto"] = registro["proyecto"]
+        registro["paginas"] = doc.metadata.get("total_pages")
+        registro["fragmentos"].append({"id": chunk_id, "hash": chunk_hash(doc)})
+        ids.append(chunk_id)
+        docs.append(doc)
+    textos = [doc.page_content for doc in docs]
+    with span("embedding", fragmentos=len(docs), tokens=sum(estimate_tokens(t) for t in textos)):
+        vectores = embedder.embed_documents(textos)
+    with span("upsert", fragmentos=len(docs)):
+        staging._collection.upsert(
+            ids=ids, embeddings=vectores, metadatas=[doc.metadata for doc in docs], documents=textos
+        )
+    return len(docs)
+
+
+def load_manifest(path=INGEST_MANIFEST_PATH):
+    """
+    Lee el manifiesto de ingesta. Estructura:
+    {"archivos": {nombre: {"hash": ..., "fragmentos": [{"id": ..., "hash": ...}]}}}
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"archivos": {}}
+
+
+def save_manifest(manifest, path=INGEST_MANIFEST_PATH):
+    # Escritura atómica para no corromper el manifiesto si la ingesta se interrumpe
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_index_version(path=INDEX_VERSION_PATH):
+    """Versión del índice; cambia cada vez que ingest_docs modifica la colección"""
     try:
-        # Carga de documentos
-        loader = PyPDFDirectoryLoader(CONTRATOS_PATH)
-        documentos = loader.load()
-        logger.info(f"Archivos leídos: {len(documentos)} páginas cargadas.")
-
-        # Fragmentación
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=200)
-        docs_split = text_splitter.split_documents(documentos)
-        logger.info(f"Procesamiento: {len(docs_split)} fragmentos generados.")
-
-        # Embeddings e Ingesta
-        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
-        vector_store = Chroma.from_documents(
-            documents=docs_split,
-            embedding=embeddings,
-            persist_directory=CHROMA_DB_PATH
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_index_version(path=INDEX_VERSION_PATH):
+    version = get_index_version(path) + 1
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(str(version))
+    return version
+
+
+def publish_staging(staging, destinos, batch_size=1000):
+    """
+    Copia los fragmentos ya embebidos de la colección temporal a la colección
+    de su proyecto y los agrega a los índices auxiliares (BM25, identificadores).
+
+    destinos: {proyecto: (vector_store, indices)}
+    """
+    total = 0
+    offset = 0
+    while True:
+        lote = staging._collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
         )
+        if not lote["ids"]:
+            break
+        por_proyecto = {}
+        for i, metadata in enumerate(lote["metadatas"]):
+            por_proyecto.setdefault((metadata or {}).get("proyecto", PROJECT_DEFAULT), []).append(i)
+        for proyecto, filas in por_proyecto.items():
+            vector_store, indices = destinos[proyecto]
+            ids = [lote["ids"][i] for i in filas]
+            vector_store._collection.upsert(
+                ids=ids, embeddings=[lote["embeddings"][i] for i in filas],
+                metadatas=[lote["metadatas"][i] for i in filas], documents=[lote["documents"][i] for i in filas]
+            )
+            docs = [Document(page_content=lote["documents"][i], metadata=lote["metadatas"][i]) for i in filas]
+            for indice in indices:
+                indice.add(ids, docs)
+        offset += len(lote["ids"])
+        total += len(lote["ids"])
+    return total
+
+
+def ingest_docs(progress=None):
+    """
+    Sincroniza la carpeta de contratos con Chroma de forma incremental.
+
+    Solo se embeben los PDF nuevos o modificados (según su hash) y se eliminan
+    los fragmentos de archivos borrados o reemplazados. Cada subcarpeta de
+    contratos es un proyecto con su propia colección e índice BM25; los PDF
+    sueltos van al proyecto general.
+
+    El embedding se hace sobre una colección temporal; las colecciones de los
+    proyectos solo cambian en la fase final de publicación (copia local, sin llamadas al
+    API), así que las consultas siguen usando el índice anterior durante toda
+    la ingesta. progress(fraccion, mensaje) recibe el avance si se indica.
+    """
+    inicio = datetime.now()
+    logger.info(">>> INICIO DE ACTUALIZACIÓN DE BDs <<<")
+    avisar = progress or (lambda fraccion, mensaje: None)
 
-        tiempo_total = datetime.now() - inicio
-        logger.info(f"--- ÉXITO: Base de datos actualizada en {tiempo_total.total_seconds():.2f}s ---")
-        return vector_store
+    try:
+        with trace("ingesta") as traza:
+            # Lotes concurrentes con cuota y reintentos; la caché guarda cada lote terminado
+            embeddings = get_embeddings()
+            batcher = EmbeddingBatcher(embeddings)
+            identificadores = get_identifier_index()
+            destinos = {}
+
+            def destino(proyecto):
+                """Colección e índices de un proyecto (se crean la primera vez)"""
+                if proyecto not in destinos:
+                    store = open_vector_store(batcher, collection_name=collection_name(proyecto))
+                    dims_indice = collection_dimensions(store._collection)
+                    if dims_indice and EMBEDDING_DIMENSIONS and dims_indice != EMBEDDING_DIMENSIONS:
+                        raise ValueError(
+                            f"La colección de '{proyecto}' tiene vectores de {dims_indice} dimensiones y "
+                            f"EMBEDDING_DIMENSIONS es {EMBEDDING_DIMENSIONS}: ejecuta python migrate_vectors.py "
+                            f"antes de ingestar."
+                        )
+                    bm25 = get_bm25_index(proyecto)
+                    # El índice BM25 se reconstruye desde Chroma si aún no existe
+                    if bm25.count() == 0 and store._collection.count() > 0:
+                        total = backfill_from_chroma(bm25, store)
+                        logger.info(f"Índice BM25 de '{proyecto}' reconstruido con {total} fragmentos existentes.")
+                    destinos[proyecto] = (store, [bm25, identificadores])
+                return destinos[proyecto]
+
+            for proyecto in indexed_projects():
+                destino(proyecto)
+            if identificadores.count() == 0:
+                for proyecto, (store, _) in destinos.items():
+                    if store._collection.count() > 0:
+                        total = backfill_from_chroma(identificadores, store)
+                        logger.info(f"Índice de identificadores: {total} fragmentos existentes de '{proyecto}'.")
+
+            manifest_previo = os.path.exists(INGEST_MANIFEST_PATH)
+            manifest = load_manifest()
+            indexados = manifest["archivos"]
+            actuales = list_pdfs()
+
+            # Clasificación de archivos según su hash (el catálogo evita volver a
+            # leer los archivos cuyo tamaño y fecha no cambiaron)
+            avisar(0.0, "Comparando archivos con el índice...")
+            catalogo = get_document_catalog()
+            with span("hash", archivos=len(actuales)):
+                catalogo.scan(full=True)
+                hashes = catalogo.file_hashes(actuales, file_hash)
+            # Si cambió la fragmentación (CHUNK_STRATEGY o tamaños) se vuelven a fragmentar todos
+            fragmentacion = chunking_signature()
+            refragmentar = manifest.get("fragmentacion", LEGACY_CHUNKING) != fragmentacion
+            if refragmentar and indexados:
+                logger.info(
+                    f"Fragmentación cambió ({manifest.get('fragmentacion', LEGACY_CHUNKING)} -> {fragmentacion}): "
+                    f"se vuelven a indexar {len(actuales)} archivos."
+                )
+            # También los indexados con IDs derivados solo del hash (dos PDF idénticos
+            # compartían IDs): se vuelven a indexar una vez con chunk_id_prefix
+            nuevos = [
+                n for n in actuales
+                if refragmentar or n not in indexados or indexados[n]["hash"] != hashes[n]
+                or any(not c["id"].startswith(f"{chunk_id_prefix(n, hashes[n])}-") for c in indexados[n]["fragmentos"][:1])
+            ]
+            eliminados = [n for n in indexados if n not in actuales or n in nuevos]
+            # Proyecto de cada archivo: su subcarpeta (los sueltos van al general)
+            proyectos = {n: project_of(n) for n in nuevos}
+            for proyecto in set(proyectos.values()):
+                destino(proyecto)
+            cambiados = set(proyectos.values()) | {
+                indexados[n].get("proyecto", PROJECT_DEFAULT) for n in eliminados
+            }
+            logger.info(
+                f"Archivos: {len(actuales)} en carpeta, {len(nuevos)} nuevos o modificados, "
+                f"{len([n for n in indexados if n not in actuales])} eliminados."
+            )
+
+            # Fase 1: lectura, fragmentación y embedding en una colección temporal
+            staging = open_vector_store(
+                batcher, collection_name=f"{STAGING_COLLECTION_PREFIX}{uuid.uuid4().hex[:8]}"
+            )
+            try:
+                en_proceso = {n: {"hash": hashes[n], "proyecto": proyectos[n], "fragmentos": []} for n in nuevos}
+                listos = {}
+                total_fragmentos = 0
+                for lote, completados in iter_batches({n: actuales[n] for n in nuevos}):
+                    if lote:
+                        total_fragmentos += stage_batch(staging, batcher, lote, en_proceso)
+
+                    for nombre in completados:
+                        listos[nombre] = en_proceso.pop(nombre)
+                    avisar(
+                        0.9 * len(listos) / max(1, len(nuevos)),
+                        f"Embebidos {total_fragmentos} fragmentos ({len(listos)}/{len(nuevos)} archivos)"
+                    )
+
+                # Fase 2: publicación en las colecciones de los proyectos
+                avisar(0.9, "Publicando el nuevo índice...")
+                with span("publicacion", fragmentos=total_fragmentos):
+                    # Primero se copian los fragmentos nuevos y después se borran los
+                    # anteriores que no fueron reemplazados: una consulta concurrente
+                    # ve el índice anterior o el nuevo, nunca uno vacío a medias.
+                    publish_staging(staging, destinos)
+                    vigentes = {c["id"] for registro in listos.values() for c in registro["fragmentos"]}
+
+                    # Borrar fragmentos de archivos eliminados o reemplazados
+                    for nombre in eliminados:
+                        ids_previos = [c["id"] for c in indexados[nombre]["fragmentos"] if c["id"] not in vigentes]
+                        if ids_previos:
+                            vector_store, indices = destino(indexados[nombre].get("proyecto", PROJECT_DEFAULT))
+                            vector_store.delete(ids=ids_previos)
+                            for indice in indices:
+                                indice.delete(ids_previos)
+                        del indexados[nombre]
+
+                    # Sin manifiesto previo la colección puede tener vectores sin ID conocido
+                    # (ingestas anteriores): se purgan por fuente para no duplicarlos.
+                    if not manifest_previo:
+                        for nombre in nuevos:
+                            vector_store, indices = destino(proyectos[nombre])
+                            previos = vector_store._collection.get(where={"source": actuales[nombre]}, include=[])
+                            sobrantes = [i for i in previos["ids"] if i not in vigentes]
+                            if sobrantes:
+                                vector_store.delete(ids=sobrantes)
+                            for indice in indices:
+                                indice.delete_source(actuales[nombre], keep=vigentes)
+
+                    indexados.update(listos)
+                    manifest["fragmentacion"] = fragmentacion
+                    save_manifest(manifest)
+
+                    # El índice cuantizado es derivado: se reconstruye en los proyectos que cambiaron
+                    if VECTOR_QUANTIZATION:
+                        for proyecto, (vector_store, _) in destinos.items():
+                            cuantizado = get_quantized_store(proyecto)
+                            if proyecto in cambiados or not cuantizado.available():
+                                with span("cuantizacion", cuantizacion=VECTOR_QUANTIZATION, proyecto=proyecto):
+                                    cuantizado.rebuild(vector_store._collection)
+
+                    # Igual con la matriz del motor NumPy
+                    if VECTOR_BACKEND == "numpy":
+                        for proyecto, (vector_store, _) in destinos.items():
+                            matriz = get_numpy_index(proyecto)
+                            if proyecto in cambiados or not matriz.available():
+                                with span("indice_numpy", proyecto=proyecto):
+                                    matriz.rebuild(vector_store._collection)
+
+                    # Cualquier cambio invalida las respuestas cacheadas de la versión anterior
+                    if nuevos or eliminados:
+                        version = bump_index_version()
+                        get_answer_cache().clear()
+                        logger.info(f"Índice en versión {version}; caché de respuestas invalidada.")
+
+                    # Estado por archivo para la pestaña Archivo Documental
+                    catalogo.reconcile(indexados, get_index_version())
+            finally:
+                staging.delete_collection()
+
+            # Centroide, resumen y campos clave por archivo (etapa gruesa de la
+            # búsqueda); también completa los archivos indexados antes de que existiera
+            if ENABLE_DOCUMENT_ROUTING:
+                avisar(0.95, "Resumiendo documentos...")
+                with span("resumenes") as etapa:
+                    etapa.set(**update_document_index(
+                        get_document_index(), indexados, actuales, lambda proyecto: destino(proyecto)[0],
+                        get_query_llm() if DOCUMENT_SUMMARIES else None,
+                    ))
+
+            logger.info(f"Procesamiento: {total_fragmentos} fragmentos nuevos embebidos.")
+            cache_stats = embeddings.stats()
+            logger.info(f"Caché de embeddings: {cache_stats}")
+            logger.info(f"Embeddings: {batcher.batches_done} lotes enviados, {batcher.rate_limited} rechazos por cuota.")
+            traza.set(
+                archivos_nuevos=len(nuevos), archivos_eliminados=len(eliminados), fragmentos=total_fragmentos,
+                proyectos=sorted(cambiados),
+                cache_aciertos=cache_stats["aciertos"], cache_fallos=cache_stats["fallos"],
+                rechazos_cuota=batcher.rate_limited,
+            )
+            avisar(1.0, f"Índice actualizado: {len(nuevos)} archivos nuevos, {len(eliminados)} retirados.")
+
+            tiempo_total = datetime.now() - inicio
+            logger.info(f"--- ÉXITO: Base de datos actualizada en {tiempo_total.total_seconds():.2f}s ---")
+            return {proyecto: vector_store for proyecto, (vector_store, _) in destinos.items()}
 
     except Exception as e:
         logger.error(f"!!! ERROR EN LA INGESTA: {str(e)}")
+        get_document_catalog().mark_error(str(e))
         raise e
-def query_rag(question):
-    try:
-        rag_chain, retriever = initialize_rag_system()
-
-        # Obtener respuesta
-        response = rag_chain.invoke(question)
-
-        # Obtener documentos para mostrarlos
-        docs = retriever.invoke(question)
-
-        # Formatear los documentos para mostrar
-        docs_info = []
-        for i, doc in enumerate(docs[:SEARCH_K], 1):
-            doc_info = {
-                "fragmento": i,
-                "contenido": doc.page_content[:1000] + "..." if len(doc.page_content) > 1000 else doc.page_content,
-                "fuente": doc.metadata.get('source', 'No especificada').split("\\")[-1],
-                "pagina": doc.metadata.get('page', 'No especificada')
-            }
-            docs_info.append(doc_info)
 
-        return response, docs_info
+
+def format_docs_info(docs):
+    """Convierte los documentos recuperados al formato que muestra la interfaz"""
+    docs_info = []
+    for i, doc in enumerate(docs, 1):
+        doc_info = {
+            "fragmento": i,
+            "contenido": doc.page_content[:1000] + "..." if len(doc.page_content) > 1000 else doc.page_content,
+            "fuente": doc.metadata.get('source', 'No especificada').split("\\")[-1],
+            "pagina": doc.metadata.get('page', 'No especificada')
+        }
+        docs_info.append(doc_info)
+    return docs_info
+
+
+def route_query(question, projects=None):
+    """Proyectos en los que se busca la pregunta (ver projects.route_projects)"""
+    with span("enrutamiento") as etapa:
+        identificadores = get_identifier_index() if ENABLE_IDENTIFIER_ROUTING else None
+        proyectos, motivo = route_projects(question, indexed_projects(), projects, identificadores)
+        etapa.set(proyectos=proyectos, motivo=motivo)
+    return proyectos
+
+
+def route_documents(question, proyectos):
+    """
+    Etapa gruesa de la búsqueda: los DOCUMENT_TOP_N documentos cuyo centroide
+    se parece más a la pregunta (ver DocumentIndex.route). Devuelve
+    (fuentes, proyectos); fuentes es None si no conviene acotar. Las preguntas
+    con número de contrato ya van a sus archivos por la ruta de identificadores.
+    """
+    with span("documentos") as etapa:
+        if any(tipo == CONTRATO for tipo, _ in extract_identifiers(question)):
+            etapa.set(documentos="contrato")
+            return None, proyectos
+        # El embedding de la pregunta ya está en la caché de embeddings
+        elegidos = get_document_index().route(get_embeddings().embed_query(question), proyectos)
+        if elegidos is None:
+            etapa.set(documentos="todos")
+            return None, proyectos
+        etapa.set(documentos=len(elegidos), similitud=round(elegidos[0][2], 4))
+    return [fuente for fuente, _, _ in elegidos], sorted({proyecto for _, proyecto, _ in elegidos})
+
+
+def lookup_document_summary(question, projects=None):
+    """
+    Respuesta inmediata para "¿de qué trata el contrato X?": el resumen y los
+    campos clave guardados en la ingesta. Devuelve (respuesta, docs_info) o
+    None si la pregunta no pide un resumen o no nombra un documento indexado.
+    """
+    if not asks_for_summary(question):
+        return None
+    with span("resumen_documento") as etapa:
+        indice = get_document_index()
+        entradas = indice.get(indice.find(question, get_identifier_index() if ENABLE_IDENTIFIER_ROUTING else None))
+        if projects:
+            entradas = [entrada for entrada in entradas if entrada["project"] in projects]
+        etapa.set(documentos=len(entradas))
+    if not entradas:
+        return None
+    respuesta = "\n\n---\n\n".join(format_summary(entrada) for entrada in entradas)
+    docs_info = [
+        {
+            "fragmento": i,
+            "contenido": entrada["summary"],
+            "fuente": os.path.basename(entrada["source"]),
+            "pagina": "Resumen del documento",
+        }
+        for i, entrada in enumerate(entradas, 1)
+    ]
+    return respuesta, docs_info
+
+
+def cache_key(question, projects=None):
+    """Pregunta con la que se guarda la respuesta: incluye la selección de proyectos"""
+    if not projects:
+        return question
+    return f"{question} [proyectos: {', '.join(sorted(projects))}]"
+
+
+def lookup_cached_answer(question, projects=None):
+    """
+    Busca la pregunta en la caché de respuestas (exacta y luego semántica).
+
+    Devuelve (resultado, embedding): resultado es None si no hay acierto y el
+    embedding de la pregunta se reutiliza para guardar la nueva respuesta.
+    Con una selección de proyectos solo se usa la coincidencia exacta.
+    """
+    cache = get_answer_cache()
+    version = get_index_version()
+    with span("cache_respuestas") as etapa:
+        resultado = cache.lookup_exact(cache_key(question, projects), version)
+        embedding = None
+        if not resultado and not projects:
+            # El embedding de la consulta queda en la caché de embeddings
+            embedding = get_embeddings().embed_query(question)
+            resultado = cache.lookup_similar(embedding, version, question)
+        etapa.set(resultado=resultado["nivel"] if resultado else "fallo")
+    return resultado, embedding
+
+
+def query_rag(question, return_timings=False, projects=None):
+    """
+    Responde una pregunta con una sola recuperación de documentos.
+
+    Devuelve (respuesta, docs_info) y, si return_timings es True, también un
+    diccionario con la duración en segundos de cada etapa. projects limita la
+    búsqueda a esos proyectos; sin él los elige route_query.
+    """
+    try:
+        with trace("consulta", question) as traza:
+            inicio = time.perf_counter()
+            embedding = None
+            if ENABLE_ANSWER_CACHE:
+                cacheada, embedding = lookup_cached_answer(question, projects)
+                if cacheada:
+                    tiempos = {"cache": time.perf_counter() - inicio}
+                    tiempos["total"] = tiempos["cache"]
+                    traza.set(cache=cacheada["nivel"], documentos=len(cacheada["docs"]))
+                    logger.info(f"Respuesta desde caché ({cacheada['nivel']}) en {tiempos['total'] * 1000:.1f}ms")
+                    if return_timings:
+                        return cacheada["answer"], cacheada["docs"], tiempos
+                    return cacheada["answer"], cacheada["docs"]
+
+            resumen = lookup_document_summary(question, projects) if DOCUMENT_SUMMARY_ANSWERS else None
+            if resumen:
+                tiempos = {"resumen": time.perf_counter() - inicio}
+                tiempos["total"] = tiempos["resumen"]
+                traza.set(cache="resumen", documentos=len(resumen[1]))
+                if return_timings:
+                    return resumen[0], resumen[1], tiempos
+                return resumen
+
+            rag = initialize_rag_system()
+            version = get_index_version()
+
+            proyectos = route_query(question, projects)
+            fuentes = None
+            if ENABLE_DOCUMENT_ROUTING:
+                fuentes, proyectos = route_documents(question, proyectos)
+            with project_scope(proyectos), document_scope(fuentes):
+                result = rag["chain"].invoke(question)
+            tiempos = result["tiempos"]
+            tiempos["total"] = time.perf_counter() - inicio
+            traza.set(cache="fallo", documentos=len(result["docs"]), proyectos=proyectos)
+            logger.info(
+                "Consulta resuelta en %.2fs (recuperación %.2fs, generación %.2fs, %d fragmentos)",
+                tiempos["total"], tiempos["recuperacion"], tiempos["generacion"], len(result["docs"])
+            )
+
+            # Los fragmentos mostrados son exactamente los usados en el prompt
+            docs_info = format_docs_info(result["docs"])
+
+            if ENABLE_ANSWER_CACHE:
+                get_answer_cache().store(cache_key(question, projects), version, result["answer"], docs_info, embedding)
+
+            if return_timings:
+                return result["answer"], docs_info, tiempos
+            return result["answer"], docs_info
 
     except Exception as e:
         error_msg = f"Error al procesar la consulta: {str(e)}"
+        if return_timings:
+            return error_msg, [], {}
         return error_msg, []
 
+def query_rag_stream(question, projects=None):
+    """
+    Variante en streaming de query_rag.
+
+    Produce eventos (tipo, valor) en este orden:
+    - ("docs", docs_info): fragmentos recuperados, antes de generar
+    - ("token", texto): fragmentos de la respuesta conforme los emite el modelo
+    - ("fin", tiempos): duración de cada etapa, incluido el primer token
+    Si ocurre un error se produce ("error", mensaje) y termina. projects
+    funciona igual que en query_rag.
+    """
+    try:
+        with trace("consulta", question) as traza:
+            inicio = time.perf_counter()
+            embedding = None
+            if ENABLE_ANSWER_CACHE:
+                cacheada, embedding = lookup_cached_answer(question, projects)
+                if cacheada:
+                    tiempos = {"cache": time.perf_counter() - inicio}
+                    tiempos["primer_token"] = tiempos["total"] = tiempos["cache"]
+                    traza.set(cache=cacheada["nivel"], documentos=len(cacheada["docs"]))
+                    yield "docs", cacheada["docs"]
+                    yield "token", cacheada["answer"]
+                    yield "fin", tiempos
+                    return
+
+            resumen = lookup_document_summary(question, projects) if DOCUMENT_SUMMARY_ANSWERS else None
+            if resumen:
+                tiempos = {"resumen": time.perf_counter() - inicio}
+                tiempos["primer_token"] = tiempos["total"] = tiempos["resumen"]
+                traza.set(cache="resumen", documentos=len(resumen[1]))
+                yield "docs", resumen[1]
+                yield "token", resumen[0]
+                yield "fin", tiempos
+                return
+
+            rag = initialize_rag_system()
+            version = get_index_version()
+
+            proyectos = route_query(question, projects)
+            fuentes = None
+            if ENABLE_DOCUMENT_ROUTING:
+                fuentes, proyectos = route_documents(question, proyectos)
+            with project_scope(proyectos), document_scope(fuentes):
+                state = rag["retrieve"](question)
+            docs_info = format_docs_info(state["docs"])
+            yield "docs", docs_info
+
+            state = rag["build_prompt"](state)
+            tiempos = state["tiempos"]
+            inicio_generacion = time.perf_counter()
+            partes = []
+            for texto in rag["generation"].stream(state["prompt"]):
+                if not partes:
+                    tiempos["primer_token"] = time.perf_counter() - inicio
+                partes.append(texto)
+                yield "token", texto
+            tiempos["generacion"] = time.perf_counter() - inicio_generacion
+            tiempos["total"] = time.perf_counter() - inicio
+            respuesta = "".join(partes)
+            record_span("generacion", tiempos["generacion"], tokens_respuesta=estimate_tokens(respuesta),
+                        primer_token=tiempos.get("primer_token"))
+            traza.set(cache="fallo", documentos=len(state["docs"]), primer_token=tiempos.get("primer_token"),
+                      proyectos=proyectos)
+            logger.info(
+                "Consulta en streaming: primer token %.2fs, total %.2fs (%d fragmentos)",
+                tiempos.get("primer_token", tiempos["total"]), tiempos["total"], len(state["docs"])
+            )
+
+            if ENABLE_ANSWER_CACHE:
+                get_answer_cache().store(cache_key(question, projects), version, respuesta, docs_info, embedding)
+
+            yield "fin", tiempos
+
+    except Exception as e:
+        yield "error", f"Error al procesar la consulta: {str(e)}"
+
+
 def get_retriever_info():
     """Obtiene información sobre la configuración del retriever"""
     return {
-        "tipo": f"{SEARCH_TYPE.upper()} + MultiQuery" + (" + Hybrid" if ENABLE_HYBRID_SEARCH else ""),
+        "tipo": f"{SEARCH_TYPE.upper()} + MultiQuery" + (" + BM25" if ENABLE_HYBRID_SEARCH else "")
+                + (" (async)" if ENABLE_ASYNC_RETRIEVAL else "")
+                + (" + identificadores" if ENABLE_IDENTIFIER_ROUTING else "")
+                + (f" · top {DOCUMENT_TOP_N} documentos" if ENABLE_DOCUMENT_ROUTING else "")
+                + " · por proyecto",
         "documentos": SEARCH_K,
         "diversidad": MMR_DIVERSITY_LAMBDA,
         "candidatos": MMR_FETCH_K,
@@ -0,0 +1,251 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Servicio de consultas: todas las sesiones de la app comparten un pool acotado
+# de workers. Cada usuario (sesión) tiene su propia cola y los workers las
+# atienden por turnos, de modo que quien manda muchas consultas seguidas no
+# deja esperando a los demás.
+
+_FIN = object()
+
+
+class QueueFull(RuntimeError):
+    """La cola global o la del usuario está llena"""
+
+
+class _Request:
+    def __init__(self, user, fn, args, kwargs):
+        self.user = user
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+        # Los workers ejecutan en el contexto de quien encola (traza activa, proyectos)
+        self.context = contextvars.copy_context()
+
+
+def _percentile(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+class QueryScheduler:
+    """
+    Pool de workers con una cola por usuario atendida en turno rotativo.
+
+    submit devuelve un Future; stream consume un generador de eventos en un
+    worker y los entrega a quien llama, con eventos ("cola", posición)
+    mientras espera. Más de max_queue solicitudes en espera (o más de
+    max_per_user de un mismo usuario) se rechazan con QueueFull.
+    """
+
+    def __init__(self, workers=SERVING_WORKERS, max_queue=SERVING_MAX_QUEUE,
+                 max_per_user=SERVING_MAX_PER_USER, window=SERVING_STATS_WINDOW):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._colas = OrderedDict()
+        self._en_cola = 0
+        self._ocupados = 0
+        self._cond = threading.Condition()
+        self._cerrado = False
+        self._inicio = time.perf_counter()
+        self._servicio_total = 0.0
+        self._esperas = deque(maxlen=window)
+        self._servicios = deque(maxlen=window)
+        self._completadas = 0
+        self._rechazadas = 0
+        self._max_en_cola = 0
+        self._threads = [
+            threading.Thread(target=self._work, name=f"sinergia-servicio-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _enqueue(self, user, fn, args, kwargs):
+        solicitud = _Request(user, fn, args, kwargs)
+        with self._cond:
+            if self._cerrado:
+                raise RuntimeError("El servicio de consultas está detenido.")
+            cola = self._colas.get(user)
+            if self._en_cola >= self.max_queue or (cola and len(cola) >= self.max_per_user):
+                self._rechazadas += 1
+                raise QueueFull(
+                    f"Servidor saturado ({self._en_cola} consultas en espera); intenta de nuevo en unos segundos."
+                )
+            if cola is None:
+                cola = self._colas[user] = deque()
+            cola.append(solicitud)
+            self._en_cola += 1
+            self._max_en_cola = max(self._max_en_cola, self._en_cola)
+            self._cond.notify()
+        return solicitud
+
+    def _next(self):
+        # Turno rotativo: el primer usuario pasa al final si aún tiene solicitudes
+        user, cola = next(iter(self._colas.items()))
+        solicitud = cola.popleft()
+        if cola:
+            self._colas.move_to_end(user)
+        else:
+            del self._colas[user]
+        self._en_cola -= 1
+        return solicitud
+
+    def _discard(self, solicitud):
+        """Quita una solicitud que aún no empieza (la sesión se fue); devuelve True si la quitó"""
+        with self._cond:
+            cola = self._colas.get(solicitud.user)
+            if not cola or solicitud not in cola:
+                return False
+            cola.remove(solicitud)
+            if not cola:
+                del self._colas[solicitud.user]
+            self._en_cola -= 1
+        solicitud.future.cancel()
+        return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._colas and not self._cerrado:
+                    self._cond.wait()
+                if not self._colas:
+                    return
+                solicitud = self._next()
+                self._ocupados += 1
+            inicio = time.perf_counter()
+            ejecutada = solicitud.future.set_running_or_notify_cancel()
+            try:
+                if ejecutada:
+                    resultado = solicitud.context.run(solicitud.fn, *solicitud.args, **solicitud.kwargs)
+            except BaseException as e:
+                solicitud.future.set_exception(e)
+            else:
+                if ejecutada:
+                    solicitud.future.set_result(resultado)
+            finally:
+                fin = time.perf_counter()
+                with self._cond:
+                    self._ocupados -= 1
+                    if ejecutada:
+                        self._completadas += 1
+                        self._servicio_total += fin - inicio
+                        self._esperas.append(inicio - solicitud.enqueued)
+                        self._servicios.append(fin - inicio)
+
+    def submit(self, user, fn, *args, **kwargs):
+        """Encola fn(*args, **kwargs) para user; devuelve un Future (QueueFull si no hay lugar)"""
+        return self._enqueue(user, fn, args, kwargs).future
+
+    def position(self, solicitud):
+        """Solicitudes que se atenderán antes (aproximado por el turno rotativo); None si ya empezó"""
+        with self._cond:
+            cola = self._colas.get(solicitud.user)
+            if not cola or solicitud not in cola:
+                return None
+            turno = cola.index(solicitud)
+            return sum(min(len(otra), turno + 1) for otra in self._colas.values()) - 1
+
+    def stream(self, user, fn, *args, **kwargs):
+        """
+        Consume el generador fn(*args, **kwargs) en un worker y produce sus
+        eventos (tipo, valor). Mientras espera produce ("cola", posición);
+        si la cola está llena produce ("error", mensaje), como query_rag_stream.
+        Si quien consume se detiene, la solicitud se retira o el worker deja
+        de leer el generador.
+        """
+        eventos = queue.Queue()
+        detener = threading.Event()
+
+        def producir():
+            try:
+                iterador = fn(*args, **kwargs)
+                try:
+                    for evento in iterador:
+                        if detener.is_set():
+                            break
+                        eventos.put(evento)
+                finally:
+                    iterador.close()
+            finally:
+                eventos.put(_FIN)
+
+        try:
+            solicitud = self._enqueue(user, producir, (), {})
+        except QueueFull as e:
+            logger.warning(f"Consulta rechazada para {user}: {e}")
+            yield "error", str(e)
+            return
+
+        try:
+            while True:
+                try:
+                    evento = eventos.get(timeout=SERVING_POLL_SECONDS)
+                except queue.Empty:
+                    posicion = self.position(solicitud)
+                    if posicion is not None:
+                        yield "cola", posicion
+                    continue
+                if evento is _FIN:
+                    break
+                yield evento
+            solicitud.future.result()
+        finally:
+            detener.set()
+            self._discard(solicitud)
+
+    def stats(self):
+        with self._cond:
+            transcurrido = time.perf_counter() - self._inicio
+            esperas = list(self._esperas)
+            servicios = list(self._servicios)
+            return {
+                "trabajadores": self.workers,
+                "ocupados": self._ocupados,
+                "saturacion": round(self._ocupados / self.workers, 3),
+                "utilizacion_media": round(self._servicio_total / (self.workers * transcurrido), 3)
+                if transcurrido else 0.0,
+                "en_cola": self._en_cola,
+                "max_en_cola": self._max_en_cola,
+                "usuarios_en_cola": len(self._colas),
+                "completadas": self._completadas,
+                "rechazadas": self._rechazadas,
+                "espera_p50_s": _percentile(esperas, 50),
+                "espera_p95_s": _percentile(esperas, 95),
+                "servicio_p50_s": _percentile(servicios, 50),
+                "servicio_p95_s": _percentile(servicios, 95),
+            }
+
+    def shutdown(self, wait=True):
+        """Deja de aceptar solicitudes; los workers terminan las que ya están en cola"""
+        with self._cond:
+            self._cerrado = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_query_scheduler():
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = QueryScheduler()
+        return _shared_scheduler
@@ -0,0 +1,22 @@
+from clause_splitter import ClauseTextSplitter
+
+# Piezas breves: un encabezado sin cuerpo se une a lo que sigue; una cláusula
+# breve pero completa conserva su etiqueta.
+#     python -m pytest test_clause_splitter.py
+
+_CUERPO = "El contratista se obliga a ejecutar los trabajos conforme al proyecto. " * 3
+
+
+def test_short_clause_keeps_its_label():
+    texto = f"PRIMERA.- IDIOMA.\nEl contrato se redacta en español.\nSEGUNDA.- OBJETO.\n{_CUERPO}"
+    piezas, _ = ClauseTextSplitter(chunk_size=1200, min_size=100).split_with_state(texto)
+    assert [(contenido.split(".-")[0], estado["clausula"]) for _, contenido, estado in piezas] == [
+        ("PRIMERA", "PRIMERA"), ("SEGUNDA", "SEGUNDA"),
+    ]
+
+
+def test_bare_heading_joins_next_clause():
+    texto = f"ANEXO AT-1\nPRIMERA.- OBJETO.\n{_CUERPO}"
+    piezas, _ = ClauseTextSplitter(chunk_size=1200, min_size=100).split_with_state(texto)
+    assert len(piezas) == 1
+    assert piezas[0][1].startswith("ANEXO AT-1") and piezas[0][2] == {"apartado": "ANEXO AT-1", "clausula": "PRIMERA"}
@@ -1,9 +1,8 @@
 import os
 from dotenv import load_dotenv # <--- Añadir esto
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from clients import get_vector_store
+from embeddings_cache import get_embeddings
 from config import CHROMA_DB_PATH
-from config import EMBEDDING_MODEL
 
 # Cargar variables de entorno desde el archivo .env
 # Esto debe ir antes de usar GoogleGenerativeAIEmbeddings
@@ -19,8 +18,8 @@ def verify_chroma_db():
         return
 
     # 1. Configurar Embeddings
-    # Ahora que cargamos el .env, esto ya no fallará
-    embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+    # Ahora que cargamos el .env, esto ya no fallará (con caché persistente)
+    embeddings = get_embeddings()
 
     # 2. Cargar la DB desde el directorio persistente
     persist_directory = CHROMA_DB_PATH
@@ -30,10 +29,8 @@ def verify_chroma_db():
         return
 
     try:
-        vector_db = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=embeddings
-        )
+        # Mismo vector store compartido que usa la app
+        vector_db = get_vector_store()
 
         # 3. Verificar cantidad de documentos
         collection_count = vector_db._collection.count()
@@ -56,6 +53,8 @@ def verify_chroma_db():
             print(f"📄 Fuente: {source} (Pág. {page})")
             print(f"✂️ Contenido: {doc.page_content[:150]}...")
 
+        print(f"\n📦 Caché de embeddings: {embeddings.stats()}")
+
     except Exception as e:
         print(f"❌ Ocurrió un error inesperado: {e}")
 
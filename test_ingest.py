@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import chromadb
+from langchain_chroma import Chroma
+
+from benchmarks.stand_ins import HashingEmbeddings
+from config import *
+from ingest_pipeline import iter_batches
+from rag_system import chunk_id_prefix, file_hash, stage_batch
+
+# Regresión: dos PDF idénticos (contratos/ trae index.pdf y una copia con el
+# número de contrato) deben indexarse con IDs distintos.
+#     python -m pytest test_ingest.py
+
+
+def test_identical_files_get_distinct_ids(tmp_path):
+    origen = os.path.join(CONTRATOS_PATH, "index.pdf")
+    archivos = {}
+    for nombre in ("a.pdf", "obra-norte/b.pdf"):
+        destino = tmp_path / nombre
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(origen, destino)
+        archivos[nombre] = str(destino)
+    hashes = {nombre: file_hash(path) for nombre, path in archivos.items()}
+    assert len(set(hashes.values())) == 1
+
+    staging = Chroma(
+        client=chromadb.EphemeralClient(), collection_name="staging_prueba",
+        embedding_function=HashingEmbeddings(dimensions=32),
+    )
+    en_proceso = {n: {"hash": hashes[n], "proyecto": PROJECT_DEFAULT, "fragmentos": []} for n in archivos}
+    total = 0
+    for lote, _ in iter_batches(archivos, batch_size=7, max_workers=1):
+        if lote:
+            total += stage_batch(staging, staging.embeddings, lote, en_proceso)
+
+    ids = {n: [c["id"] for c in registro["fragmentos"]] for n, registro in en_proceso.items()}
+    assert total > 0 and len(ids["a.pdf"]) == len(ids["obra-norte/b.pdf"])
+    assert not set(ids["a.pdf"]) & set(ids["obra-norte/b.pdf"])
+    assert all(i.startswith(chunk_id_prefix("a.pdf", hashes["a.pdf"])) for i in ids["a.pdf"])
+    assert staging._collection.count() == total
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from query_rewrite import QueryRewriter, local_rewrites
+
+# Reescrituras locales y caída al modo local por presupuesto agotado.
+#     python -m pytest test_query_rewrite.py
+
+
+def test_local_rewrites_replace_whole_term():
+    assert local_rewrites("resistencia f'c del concreto") == [
+        "resistencia a la compresion del concreto",
+        "resistencia fc del concreto",
+        "resistencia f'c concreto",
+    ]
+
+
+def test_local_rewrites_without_known_terms():
+    assert local_rewrites("documentación mínima a presentar") == [
+        "documentacion minima presentar",
+        "documentacion minima presentar contrato de obra publica",
+    ]
+
+
+class _Prompt:
+    def format(self, question):
+        return question
+
+
+class _LLMLento:
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(1)
+
+
+def test_timeout_does_not_pause_llm():
+    rewriter = QueryRewriter(_LLMLento(), _Prompt(), mode="auto")
+    consultas, origen = asyncio.run(rewriter._arewrite("resistencia f'c del concreto", 0.01))
+    assert origen == "local" and consultas
+    assert rewriter._paused_until <= time.monotonic()
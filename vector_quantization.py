@@ -0,0 +1,372 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from langchain_chroma import Chroma
+
+from config import *
+from projects import project_path
+
+logger = logging.getLogger(__name__)
+
+INT8 = "int8"
+BINARY = "binary"
+
+
+def normalize(matriz):
+    """Normaliza cada fila a norma 1 (las filas nulas quedan igual)"""
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    return matriz / np.where(normas == 0, 1.0, normas)
+
+
+def truncate_dimensions(vectores, dims):
+    """
+    Reduce la dimensión de embeddings Matryoshka (gemini-embedding-001):
+    se conservan las primeras dims componentes y se renormaliza.
+    """
+    return normalize(np.asarray(vectores, dtype=np.float32)[:, :dims])
+
+
+def quantize_int8(matriz):
+    """Cuantización simétrica por vector: código int8 y escala float32"""
+    escalas = np.abs(matriz).max(axis=1) / 127.0
+    escalas = np.where(escalas == 0, 1.0, escalas).astype(np.float32)
+    codigos = np.clip(np.rint(matriz / escalas[:, None]), -127, 127).astype(np.int8)
+    return codigos, escalas
+
+
+def quantize_binary(matriz):
+    """Un bit por componente (signo), empaquetado en bytes"""
+    return np.packbits(matriz > 0, axis=1)
+
+
+def collection_dimensions(collection):
+    """Dimensión de los vectores guardados en una colección Chroma (None si está vacía)"""
+    muestra = collection.get(limit=1, include=["embeddings"])
+    if muestra["embeddings"] is None or len(muestra["embeddings"]) == 0:
+        return None
+    return len(muestra["embeddings"][0])
+
+
+def collection_space(collection):
+    """Métrica de distancia de la colección (Chroma usa l2 por defecto)"""
+    return (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def iter_collection(collection, batch_size=1000, include=("embeddings", "metadatas")):
+    """Recorre una colección Chroma en lotes"""
+    offset = 0
+    while True:
+        lote = collection.get(include=list(include), limit=batch_size, offset=offset)
+        if not lote["ids"]:
+            break
+        yield lote
+        offset += len(lote["ids"])
+
+
+class QuantizedVectorStore:
+    """
+    Índice vectorial cuantizado en memoria con reordenamiento a precisión completa.
+
+    Los códigos (int8: 1 byte por componente; binario: 1 bit) se cargan en
+    memoria y se recorren por fuerza bruta; los vectores float32 quedan en
+    disco (memmap) y solo se leen los de los candidatos para el
+    reordenamiento final. Es un índice derivado de la colección Chroma: se
+    reconstruye tras cada ingesta y se recarga solo al cambiar.
+    """
+
+    def __init__(self, path=QUANTIZED_INDEX_PATH, rescore_factor=QUANTIZATION_RESCORE_FACTOR):
+        self.path = path
+        self.rescore_factor = rescore_factor
+        self._lock = threading.Lock()
+        self._cargado = None  # mtime del puntero current.json cargado
+        self._datos = None
+
+    # --- Construcción ---
+
+    def build(self, lotes, total, quantization, space="l2"):
+        """
+        Construye un índice nuevo a partir de lotes (ids, vectores, fuentes) y
+        lo publica de forma atómica. total es el número de vectores esperado.
+        """
+        if quantization not in (INT8, BINARY):
+            raise ValueError(f"Cuantización no soportada: {quantization}")
+        os.makedirs(self.path, exist_ok=True)
+        build_id = uuid.uuid4().hex[:8]
+        destino = os.path.join(self.path, build_id)
+        os.makedirs(destino)
+
+        ids, fuentes, indice_fuentes = [], [], {}
+        codigos = escalas = vectores = codigos_fuente = None
+        fila = 0
+        for lote_ids, lote_vectores, lote_fuentes in lotes:
+            matriz = np.asarray(lote_vectores, dtype=np.float32)
+            if vectores is None:
+                dims = matriz.shape[1]
+                vectores = np.lib.format.open_memmap(
+                    os.path.join(destino, "vectors.npy"), mode="w+", dtype=np.float32, shape=(total, dims)
+                )
+                ancho = dims if quantization == INT8 else (dims + 7) // 8
+                tipo = np.int8 if quantization == INT8 else np.uint8
+                codigos = np.lib.format.open_memmap(
+                    os.path.join(destino, "codes.npy"), mode="w+", dtype=tipo, shape=(total, ancho)
+                )
+                escalas = np.ones(total, dtype=np.float32)
+                codigos_fuente = np.zeros(total, dtype=np.int32)
+
+            # La colección pudo crecer durante el recorrido: lo excedente se omite
+            n = min(len(lote_ids), total - fila)
+            if n <= 0:
+                break
+            fin = fila + n
+            matriz = matriz[:n]
+            vectores[fila:fin] = matriz
+            if quantization == INT8:
+                codigos[fila:fin], escalas[fila:fin] = quantize_int8(matriz)
+            else:
+                codigos[fila:fin] = quantize_binary(matriz)
+            for i, fuente in enumerate(lote_fuentes[:n]):
+                codigos_fuente[fila + i] = indice_fuentes.setdefault(fuente, len(indice_fuentes))
+            ids.extend(lote_ids[:n])
+            fila = fin
+
+        if vectores is None:
+            shutil.rmtree(destino, ignore_errors=True)
+            return None
+        dims = int(vectores.shape[1])
+        vectores.flush()
+        codigos.flush()
+        np.save(os.path.join(destino, "scales.npy"), escalas[:fila])
+        np.save(os.path.join(destino, "sources.npy"), codigos_fuente[:fila])
+        fuentes = sorted(indice_fuentes, key=indice_fuentes.get)
+        with open(os.path.join(destino, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "quantization": quantization, "space": space, "count": fila,
+                "dims": dims, "ids": ids, "sources": fuentes,
+            }, f, ensure_ascii=False)
+        del vectores, codigos
+
+        # Publicación atómica: el puntero cambia cuando el índice ya está completo
+        temporal = os.path.join(self.path, "current.json.tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"build": build_id}, f)
+        os.replace(temporal, os.path.join(self.path, "current.json"))
+
+        for nombre in os.listdir(self.path):
+            anterior = os.path.join(self.path, nombre)
+            if nombre != build_id and os.path.isdir(anterior):
+                # En Windows puede fallar si otro proceso aún tiene el memmap abierto
+                shutil.rmtree(anterior, ignore_errors=True)
+        return {"vectores": fila, "dimensiones": dims}
+
+    def rebuild(self, collection, quantization=VECTOR_QUANTIZATION, batch_size=1000):
+        """Reconstruye el índice a partir de una colección Chroma"""
+        total = collection.count()
+        lotes = (
+            (lote["ids"], lote["embeddings"], [(m or {}).get("source") for m in lote["metadatas"]])
+            for lote in iter_collection(collection, batch_size)
+        )
+        self.build(lotes, total, quantization, space=collection_space(collection))
+        logger.info(f"Índice cuantizado ({quantization}) reconstruido con {total} vectores.")
+        return total
+
+    # --- Consulta ---
+
+    def _ensure_loaded(self):
+        puntero = os.path.join(self.path, "current.json")
+        try:
+            mtime = os.path.getmtime(puntero)
+        except OSError:
+            self._datos = None
+            return None
+        with self._lock:
+            if self._cargado != mtime:
+                with open(puntero, encoding="utf-8") as f:
+                    directorio = os.path.join(self.path, json.load(f)["build"])
+                with open(os.path.join(directorio, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                self._datos = {
+                    "meta": meta,
+                    "ids": meta["ids"],
+                    "fuentes": {fuente: i for i, fuente in enumerate(meta["sources"])},
+                    # Los códigos van a memoria; los vectores completos se leen de disco bajo demanda
+                    "codigos": np.load(os.path.join(directorio, "codes.npy"))[:meta["count"]],
+                    "escalas": np.load(os.path.join(directorio, "scales.npy")),
+                    "codigos_fuente": np.load(os.path.join(directorio, "sources.npy")),
+                    "vectores": np.load(os.path.join(directorio, "vectors.npy"), mmap_mode="r")[:meta["count"]],
+                }
+                self._cargado = mtime
+            return self._datos
+
+    def available(self):
+        return self._ensure_loaded() is not None
+
+    @property
+    def dims(self):
+        datos = self._ensure_loaded()
+        return datos["meta"]["dims"] if datos else None
+
+    def _approximate_scores(self, datos, consulta, filas, block_size=16384):
+        """Similitud aproximada con los códigos (mayor es más parecido)"""
+        codigos = datos["codigos"] if filas is None else datos["codigos"][filas]
+        if datos["meta"]["quantization"] == BINARY:
+            bits = quantize_binary(consulta[None, :])[0]
+            return -np.bitwise_count(codigos ^ bits).sum(axis=1, dtype=np.int32).astype(np.float32)
+
+        escalas = datos["escalas"] if filas is None else datos["escalas"][filas]
+        puntajes = np.empty(len(codigos), dtype=np.float32)
+        # Por bloques para acotar la memoria temporal de la conversión a float
+        for inicio in range(0, len(codigos), block_size):
+            bloque = codigos[inicio:inicio + block_size].astype(np.float32)
+            puntajes[inicio:inicio + block_size] = (bloque @ consulta) * escalas[inicio:inicio + block_size]
+        return puntajes
+
+    def _distances(self, space, consulta, vectores):
+        """Distancias con la misma métrica que Chroma (l2 al cuadrado, cosine o ip)"""
+        productos = vectores @ consulta
+        if space == "ip":
+            return 1.0 - productos
+        if space == "cosine":
+            normas = np.linalg.norm(vectores, axis=1) * (np.linalg.norm(consulta) or 1.0)
+            return 1.0 - productos / np.where(normas == 0, 1.0, normas)
+        return (vectores * vectores).sum(axis=1) + consulta @ consulta - 2 * productos
+
+    def search(self, query, k=SEARCH_K, sources=None, rescore=True):
+        """
+        Devuelve [(id, distancia, vector)] de los k vectores más cercanos.
+
+        sources limita la búsqueda a esos archivos. Con rescore se toman
+        k * rescore_factor candidatos por los códigos y se reordenan con los
+        vectores a precisión completa.
+        """
+        datos = self._ensure_loaded()
+        if datos is None:
+            raise RuntimeError("El índice cuantizado no está construido.")
+        if k <= 0:
+            return []
+        consulta = np.asarray(query, dtype=np.float32)
+        if len(consulta) != datos["meta"]["dims"]:
+            raise ValueError(
+                f"La consulta tiene {len(consulta)} dimensiones y el índice {datos['meta']['dims']}: "
+                "ejecuta python migrate_vectors.py tras cambiar EMBEDDING_DIMENSIONS."
+            )
+
+        filas = None
+        if sources is not None:
+            codigos = [datos["fuentes"][s] for s in sources if s in datos["fuentes"]]
+            filas = np.flatnonzero(np.isin(datos["codigos_fuente"], codigos))
+            if len(filas) == 0:
+                return []
+
+        puntajes = self._approximate_scores(datos, consulta, filas)
+        n_candidatos = min(len(puntajes), k * self.rescore_factor if rescore else k)
+        candidatos = np.argpartition(-puntajes, n_candidatos - 1)[:n_candidatos]
+        filas_candidatas = candidatos if filas is None else filas[candidatos]
+
+        # Lectura ordenada del memmap: solo se tocan las páginas de los candidatos
+        orden_disco = np.argsort(filas_candidatas)
+        filas_candidatas = filas_candidatas[orden_disco]
+        vectores = np.asarray(datos["vectores"][filas_candidatas])
+        if rescore:
+            distancias = self._distances(datos["meta"]["space"], consulta, vectores)
+        else:
+            distancias = -puntajes[candidatos][orden_disco]
+        mejores = np.argsort(distancias)[:k]
+        return [(datos["ids"][filas_candidatas[i]], float(distancias[i]), vectores[i]) for i in mejores]
+
+    def stats(self):
+        datos = self._ensure_loaded()
+        if datos is None:
+            return None
+        return {
+            "cuantizacion": datos["meta"]["quantization"],
+            "vectores": datos["meta"]["count"],
+            "dimensiones": datos["meta"]["dims"],
+            "memoria_codigos_mb": round(datos["codigos"].nbytes / 2 ** 20, 2),
+            "disco_vectores_mb": round(datos["vectores"].nbytes / 2 ** 20, 2),
+        }
+
+
+def _sources_filter(where):
+    """
+    Traduce filtros where simples sobre source; None si no hay filtro y
+    False si el filtro no se puede resolver con el índice cuantizado.
+    """
+    if not where:
+        return None
+    if set(where) != {"source"}:
+        return False
+    condicion = where["source"]
+    if isinstance(condicion, str):
+        return [condicion]
+    if isinstance(condicion, dict) and len(condicion) == 1:
+        operador, valor = next(iter(condicion.items()))
+        if operador == "$eq":
+            return [valor]
+        if operador == "$in":
+            return list(valor)
+    return False
+
+
+class QuantizedChroma(Chroma):
+    """
+    Chroma cuyas búsquedas por vector se resuelven con QuantizedVectorStore.
+
+    Documentos y metadatos se siguen leyendo de Chroma; el índice HNSW solo
+    se usa para filtros que el índice cuantizado no resuelve o mientras éste
+    no exista. Sustituye el método privado de consulta de langchain_chroma,
+    por el que pasan similarity_search y max_marginal_relevance_search.
+    """
+
+    def __init__(self, *args, quantized_store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.quantized_store = quantized_store or get_quantized_store()
+
+    def _Chroma__query_collection(self, query_texts=None, query_embeddings=None, n_results=4,
+                                  where=None, where_document=None, **kwargs):
+        fuentes = _sources_filter(where)
+        if (query_embeddings is None or where_document or fuentes is False
+                or not self.quantized_store.available()):
+            return super()._Chroma__query_collection(
+                query_texts=query_texts, query_embeddings=query_embeddings, n_results=n_results,
+                where=where, where_document=where_document, **kwargs
+            )
+
+        por_consulta = [
+            self.quantized_store.search(embedding, k=n_results, sources=fuentes) for embedding in query_embeddings
+        ]
+        ids = list({chunk_id for resultados in por_consulta for chunk_id, _, _ in resultados})
+        contenido = self._collection.get(ids=ids, include=["documents", "metadatas"]) if ids else None
+        por_id = {}
+        if contenido:
+            por_id = {
+                chunk_id: (documento, metadata)
+                for chunk_id, documento, metadata in zip(contenido["ids"], contenido["documents"], contenido["metadatas"])
+            }
+        # Vectores que ya no están en Chroma (índice a punto de reconstruirse) se omiten
+        por_consulta = [[r for r in resultados if r[0] in por_id] for resultados in por_consulta]
+        respuesta = {
+            "ids": [[chunk_id for chunk_id, _, _ in resultados] for resultados in por_consulta],
+            "documents": [[por_id[chunk_id][0] for chunk_id, _, _ in resultados] for resultados in por_consulta],
+            "metadatas": [[por_id[chunk_id][1] for chunk_id, _, _ in resultados] for resultados in por_consulta],
+            "distances": [[distancia for _, distancia, _ in resultados] for resultados in por_consulta],
+        }
+        if "embeddings" in kwargs.get("include", []):
+            respuesta["embeddings"] = [[vector for _, _, vector in resultados] for resultados in por_consulta]
+        return respuesta
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def get_quantized_store(project=PROJECT_DEFAULT):
+    with _shared_lock:
+        if project not in _shared_stores:
+            _shared_stores[project] = QuantizedVectorStore(path=project_path(QUANTIZED_INDEX_PATH, project))
+        return _shared_stores[project]
@@ -1,22 +1,22 @@
 # pip install chromadb
 from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from clients import get_chroma_client
+from embeddings_cache import get_embeddings
+from projects import collection_name
 from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from clause_splitter import get_text_splitter
 
 from config import *
 
-def base_datos():
+def base_datos(proyecto=PROJECT_DEFAULT):
 
     loader = PyPDFDirectoryLoader("C:\\Users\\eduar\\PycharmProjects\\asistente_legal_RAG\\contratos")
     documentos = loader.load()
 
     print(f"Se cargaron {len(documentos)} paginas desde el directorio: {loader.path}")
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=5000,
-        chunk_overlap=1000
-    )
+    # Misma fragmentación que la ingesta (CHUNK_STRATEGY, CHUNK_SIZE, CHUNK_OVERLAP)
+    text_splitter = get_text_splitter()
 
     docs_split = text_splitter.split_documents(documentos)
 
@@ -24,8 +24,9 @@ def base_datos():
 
     vector_stores = Chroma.from_documents(
         docs_split,
-        embedding=GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
-        persist_directory=CHROMA_DB_PATH
+        embedding=get_embeddings(),
+        client=get_chroma_client(),
+        collection_name=collection_name(proyecto)
     )
 
     consulta = "¿Cual es la Documentación mínima a presentar?"